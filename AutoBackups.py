@@ -11,9 +11,7 @@ import sublime
 import sublime_plugin
 import sys
 import os
-import shutil
 import re
-import hashlib
 import time
 import threading
 import webbrowser
@@ -39,48 +37,381 @@ cprint = globals()["__builtins__"]["print"]
 try:
     # Python 3
     from AutoBackups.autobackups import reloader
-    from AutoBackups.autobackups.paths_helper import PathsHelper
+    from AutoBackups.autobackups.paths_helper import PathsHelper, untitled_dir_name, unsaved_dir_name
+    from AutoBackups.autobackups.storage import BackupStorage
+    from AutoBackups.autobackups.pack_store import PackStore, PACK_NAME, INDEX_NAME
+    from AutoBackups.autobackups import compression
+    from AutoBackups.autobackups.catalog import Catalog
+    from AutoBackups.autobackups.writer import BackupWriter
+    from AutoBackups.autobackups.settings_snapshot import SettingsSnapshot
+    from AutoBackups.autobackups.hash_cache import HashCache
+    from AutoBackups.autobackups import hashing
+    from AutoBackups.autobackups.retention import Pruner, plan_quota, plan_thinning, list_backups
+    from AutoBackups.autobackups.gc_engine import GcEngine
+    from AutoBackups.autobackups.scrubber import Scrubber
+    from AutoBackups.autobackups.snapshot import ProjectSnapshot, walk_files
+    from AutoBackups.autobackups.stats import Stats
+    from AutoBackups.autobackups.history import History
+    from AutoBackups.autobackups.version_cache import VersionCache
+    from AutoBackups.autobackups.search_index import SearchIndex, find_line
+    from AutoBackups.autobackups.mirror import Mirror
+    from AutoBackups.autobackups import diff
 except (ImportError):
     # Python 2
     import autobackups.reloader
-    from autobackups.paths_helper import PathsHelper
+    from autobackups.paths_helper import PathsHelper, untitled_dir_name, unsaved_dir_name
+    from autobackups.storage import BackupStorage
+    from autobackups.pack_store import PackStore, PACK_NAME, INDEX_NAME
+    from autobackups import compression
+    from autobackups.catalog import Catalog
+    from autobackups.writer import BackupWriter
+    from autobackups.settings_snapshot import SettingsSnapshot
+    from autobackups.hash_cache import HashCache
+    from autobackups import hashing
+    from autobackups.retention import Pruner, plan_quota, plan_thinning, list_backups
+    from autobackups.gc_engine import GcEngine
+    from autobackups.scrubber import Scrubber
+    from autobackups.snapshot import ProjectSnapshot, walk_files
+    from autobackups.stats import Stats
+    from autobackups.history import History
+    from autobackups.version_cache import VersionCache
+    from autobackups.search_index import SearchIndex, find_line
+    from autobackups.mirror import Mirror
+    from autobackups import diff
+
+
+writer = None
+scrubber = None
 
 
 def plugin_loaded():
     global settings
-    global hashes
+    global writer
+    global platform
 
-    hashes = {}
     platform = sublime.platform().title()
 
     if (platform == "Osx"):
         platform = "OSX"
     settings = sublime.load_settings('AutoBackups ('+platform+').sublime-settings')
 
-    backup_dir = settings.get('backup_dir')
-    backup_per_day = settings.get('backup_per_day')
-    backup_per_time = settings.get('backup_per_time')
-    backup_name_mode = settings.get('backup_name_mode')
+    BackupStorage.clear_materialized()
+    reload_settings()
+    settings.add_on_change('AutoBackups', reload_settings)
 
-    PathsHelper.initialize(platform, backup_dir, backup_per_day, backup_per_time, backup_name_mode)
     cprint('AutoBackups: Plugin Initialized')
     cprint('With: backup_dir: {}\n\
             backup_per_day: {}\n\
             backup_per_time: {}\n\
-            backup_name_mode: {}'.format(backup_dir, backup_per_day, backup_per_time, backup_name_mode))
+            backup_name_mode: {}\n\
+            backup_storage: {}\n\
+            backup_compression: {}'.format(config.get('backup_dir'), config.get('backup_per_day'),
+                                           config.get('backup_per_time'), config.get('backup_name_mode'),
+                                           config.get('backup_storage', 'copy'), config.get('backup_compression', False)))
+
+    if writer is not None:
+        writer.stop()
+    writer = BackupWriter(write_backup, config.get('backup_coalesce_ms', 500) / 1000.0,
+                          config.get('backup_queue_size', 256))
+    writer.start()
+
     sublime.set_timeout(gc, 10000)
 
 
+def reload_settings():
+    global config
+
+    backup_dir = settings.get('backup_dir')
+    backup_per_day = settings.get('backup_per_day')
+    backup_per_time = settings.get('backup_per_time')
+    backup_name_mode = settings.get('backup_name_mode')
+
+    PathsHelper.initialize(platform, backup_dir, backup_per_day, backup_per_time, backup_name_mode)
+    config = SettingsSnapshot(settings)
+
+    BackupStorage.initialize(config.get('backup_storage', 'copy'), PathsHelper.get_data_dir(),
+                             config.get('delta_keyframe_interval', 20),
+                             config.get('backup_compression', False), config.get('backup_compression_level', 6))
+
+    HashCache.initialize(PathsHelper.get_data_dir())
+    Stats.initialize(PathsHelper.get_data_dir(), config.get('stats_log', False))
+    History.invalidate()
+    VersionCache.initialize(config.get('preview_cache_bytes', 16777216))
+
+    if Catalog.initialize(PathsHelper.get_data_dir(), config.get('backup_catalog', True)):
+        # first run with the catalog, index the backups that already exist without hogging the disk
+        AutoBackupsRebuildCatalog(AutoBackupsRebuildCatalog.initial_files_per_second).start()
+
+    if SearchIndex.initialize(PathsHelper.get_data_dir(), config.get('search_index', False)):
+        # reading the whole backup tree is left to the user
+        cprint('AutoBackups: Search index created, use "AutoBackups: Rebuild Search Index" to index existing backups')
+
+    start_scrubber()
+
+    Mirror.initialize(config.get('mirror_dirs', []), PathsHelper.get_base_dir(True),
+                      config.get('mirror_retry_max_seconds', 300))
+
+
+def start_scrubber():
+    global scrubber
+
+    if scrubber is not None:
+        scrubber.stop()
+        scrubber = None
+    # checksums are kept in the catalog
+    if config.get('scrub_backups', False) and Catalog.enabled:
+        scrubber = Scrubber(report_problem, config.get('scrub_max_bytes_per_second', 1048576),
+                            config.get('scrub_interval_days', 7) * 86400)
+        scrubber.start()
+
+
+def report_problem(path, status):
+    cprint('AutoBackups: Backup '+status+': '+path.replace('\\', '/'))
+    sublime.status_message('AutoBackups: Backup '+status+', see "AutoBackups: Show Integrity Problems"')
+
+
+def plugin_unloaded():
+    settings.clear_on_change('AutoBackups')
+
+    # write the backups still waiting in the queue
+    if writer is not None:
+        writer.stop()
+    if scrubber is not None:
+        scrubber.stop()
+    Mirror.stop()
+
+
+def write_backup(job):
+    (filename, newname, current_hash, on_load_event) = job
+
+    # not create file backup if no changes from last backup
+    if is_last_backup(filename, current_hash):
+        Stats.incr('skipped.unchanged')
+        return
+
+    # not create file if exists
+    if on_load_event & (BackupStorage.locate(newname) is not None):
+        Stats.incr('skipped.exists')
+        return
+
+    try:
+        with Stats.timer('write.total'):
+            newname = store_backup(filename, newname, current_hash)
+    except FileNotFoundError:
+        cprint('Backup not saved. File '+filename+' does not exist!')
+        Stats.incr('errors.write')
+        return False;
+
+    cprint('Backup saved to: '+newname.replace('\\', '/'))
+
+
+def store_backup(filename, newname, current_hash):
+    """Write the backup of filename to newname and index it, return the path written."""
+    algorithm = config.get('backup_hash_algorithm', 'blake2b')
+    verify = scrubber is not None
+    if verify:
+        # checksum of the source, the copy is compared with it now and by the scrubber later
+        with Stats.timer('write.verify'):
+            expected = hashing.file_checksum(filename, algorithm)
+
+    newname = BackupStorage.store(filename, newname)
+    # after the copy, a change while copying leaves an mtime the hash cache doesn't trust
+    st = os.stat(filename)
+    with Stats.timer('write.index'):
+        Catalog.add(newname, current_hash, BackupStorage.stored_size(newname))
+        HashCache.set(filename, st, current_hash, newname)
+    Mirror.add(newname)
+
+    if verify or SearchIndex.enabled:
+        # read back what was stored
+        try:
+            with Stats.timer('write.verify'):
+                data = BackupStorage.read(newname)
+                checksum = hashing.checksum(data, algorithm)
+            if verify:
+                Catalog.set_checksum(newname, expected)
+                if checksum != expected:
+                    Stats.incr('errors.verify')
+                    Catalog.mark_verified(newname, 'corrupt')
+                    report_problem(newname, 'corrupt')
+            with Stats.timer('write.search'):
+                SearchIndex.add(newname, data, checksum)
+        except (IOError, OSError) as e:
+            cprint('AutoBackups: could not read back '+newname+', '+str(e))
+            Stats.incr('errors.verify')
+
+    # the history panel recounts this day of the file, stepping through versions finds the new one
+    parsed = PathsHelper.parse_backup_path(Catalog.relative(newname))
+    if parsed is not None:
+        History.add_version(PathsHelper.normalise_path(filename, True), parsed[1], parsed[2], newname)
+    else:
+        History.invalidate(PathsHelper.normalise_path(filename, True))
+
+    Stats.incr('backups.written')
+    Stats.incr('bytes.written', st.st_size)
+    return newname
+
+
+
+
+
+def write_snapshot(job):
+    (dest, text, line_endings) = job
+
+    data = hashing.apply_line_endings(text, line_endings).encode('UTF-8')
+
+    with Stats.timer('unsaved.write'):
+        dest = BackupStorage.store_bytes(data, dest)
+    Mirror.add(dest)
+
+    Stats.incr('unsaved.written')
+    Stats.incr('bytes.written', len(data))
+    cprint('Unsaved changes saved to: '+dest.replace('\\', '/'))
 
 
+def is_last_backup(filename, current_hash):
+    entry = HashCache.get(filename)
+    return (entry is not None and entry[2] == current_hash and entry[3] is not None
+            and BackupStorage.locate(entry[3]) is not None)
+
 
 def gc():
-    backup_time = settings.get('delete_old_backups', 0)
-    if (backup_time > 0):
+    backup_time = config.get('delete_old_backups', 0)
+    if (backup_time > 0 or pruning_enabled() or new_pruner().has_pending()):
         thread = AutoBackupsGcBackup(backup_time)
         thread.start()
 
 
+def pruning_enabled():
+    quota = config.get('backup_quota_bytes', 0) > 0 or config.get('backup_max_versions', 0) > 0
+    thinning = config.get('backup_thinning', False) and config.get('backup_per_time')
+    return bool(quota or thinning)
+
+
+def new_pruner():
+    return Pruner(PathsHelper.get_data_dir(), config.get('gc_max_files_per_second', 0),
+                  config.get('gc_max_bytes_per_second', 0))
+
+
+class UnsavedSnapshots(object):
+    """Snapshots of dirty buffers, for backup_unsaved.
+
+    A modified buffer is snapshotted once it was idle for unsaved_idle_ms and
+    at most every unsaved_min_interval_s seconds. Ticks stop after
+    unsaved_budget_ms and continue later, unchanged buffers are skipped by
+    their hash and the file is written by the backup writer thread.
+
+    Snapshots go to <backup_dir>/unsaved and <backup_dir>/untitled, never
+    to the backup paths of the file: text that was never saved must not
+    replace or pass for a backup of what is on disk.
+    """
+    # view id -> (view, last modification time)
+    pending = {}
+    # buffer id -> (last snapshot time, hash)
+    taken = {}
+    scheduled = False
+    # characters hashed per second, measured on the buffers snapshotted so far
+    hash_rate = 50000000.0
+
+    @staticmethod
+    def modified(view):
+        if view.is_scratch() or view.settings().get('is_widget'):
+            return
+        UnsavedSnapshots.pending[view.id()] = (view, time.time())
+        if not UnsavedSnapshots.scheduled:
+            UnsavedSnapshots.schedule(config.get('unsaved_idle_ms', 2000) / 1000.0)
+
+    @staticmethod
+    def closed(view):
+        UnsavedSnapshots.pending.pop(view.id(), None)
+        UnsavedSnapshots.taken.pop(view.buffer_id(), None)
+
+    @staticmethod
+    def schedule(delay):
+        UnsavedSnapshots.scheduled = True
+        if (st_version == 3):
+            sublime.set_timeout_async(UnsavedSnapshots.tick, int(delay * 1000))
+        else:
+            sublime.set_timeout(UnsavedSnapshots.tick, int(delay * 1000))
+
+    @staticmethod
+    def tick():
+        UnsavedSnapshots.scheduled = False
+        idle = config.get('unsaved_idle_ms', 2000) / 1000.0
+        interval = config.get('unsaved_min_interval_s', 60)
+        budget = config.get('unsaved_budget_ms', 10) / 1000.0
+
+        started = time.time()
+        wait = None
+        # longest idle buffers first
+        for (view_id, (view, modified)) in sorted(UnsavedSnapshots.pending.items(), key=lambda item: item[1][1]):
+            now = time.time()
+            if (now - started > budget):
+                wait = 0.1
+                break
+
+            last = UnsavedSnapshots.taken.get(view.buffer_id(), (0, None))[0]
+            due = max(modified + idle, last + interval)
+            if (due > now):
+                wait = due - now if wait is None else min(wait, due - now)
+                continue
+
+            # the view may have been closed meanwhile, on_close drops it too
+            UnsavedSnapshots.pending.pop(view_id, None)
+            if not UnsavedSnapshots.snapshot(view, budget - (now - started), budget):
+                UnsavedSnapshots.pending[view_id] = (view, modified)
+                wait = 0.1
+                break
+
+        Stats.record('unsaved.tick', time.time() - started)
+        if wait is not None:
+            UnsavedSnapshots.schedule(wait)
+
+    @staticmethod
+    def snapshot(view, remaining, budget):
+        """Snapshot view, return False when it doesn't fit in the remaining time of this tick."""
+        # closed views and saved buffers don't need one
+        if not getattr(view, 'is_valid', lambda: True)() or not view.is_dirty() or view.is_read_only():
+            return True
+        if view.size() > config.get('max_backup_file_size_bytes'):
+            Stats.incr('skipped.too_large')
+            return True
+
+        filename = view.file_name()
+        if filename is not None and (config.is_excluded(filename) or config.is_backup_file(filename)):
+            return True
+
+        # hashing is the expensive part, it has to fit in the budget before it starts
+        cost = view.size() / UnsavedSnapshots.hash_rate
+        if cost > budget:
+            Stats.incr('unsaved.skipped_budget')
+            return True
+        if cost > remaining:
+            return False
+
+        started = time.time()
+        current_hash = hashing.hash_view(view, config.get('backup_hash_algorithm', 'blake2b'), filename or '')
+        elapsed = time.time() - started
+        if view.size() >= hashing.VIEW_CHUNK_SIZE and elapsed > 0:
+            UnsavedSnapshots.hash_rate = (UnsavedSnapshots.hash_rate + view.size() / elapsed) / 2
+
+        buffer_id = view.buffer_id()
+        if UnsavedSnapshots.taken.get(buffer_id, (0, None))[1] == current_hash:
+            Stats.incr('unsaved.skipped_unchanged')
+            return True
+        UnsavedSnapshots.taken[buffer_id] = (time.time(), current_hash)
+
+        text = view.substr(sublime.Region(0, view.size()))
+        if filename is not None:
+            dest = PathsHelper.get_unsaved_filepath(filename)
+        else:
+            name = view.name() or text[:80].strip().split('\n')[0]
+            dest = PathsHelper.get_untitled_filepath(buffer_id, name)
+        writer.submit(('unsaved', buffer_id), (dest, text, view.line_endings()), write_snapshot)
+        return True
+
+
+
 class AutoBackupsEventListener(sublime_plugin.EventListener):
 
     def on_post_save(self, view):
@@ -92,26 +423,52 @@ class AutoBackupsEventListener(sublime_plugin.EventListener):
         if (st_version == 3):
             return
 
-        if settings.get('backup_on_open_file'):
+        if config.get('backup_on_open_file'):
             self.save_backup(view, 1)
 
 
+    def on_modified(self, view):
+        if (st_version == 3):
+            return
+        if config.get('backup_unsaved', False):
+            UnsavedSnapshots.modified(view)
+
     def on_post_save_async(self, view):
         self.save_backup(view, 0)
 
 
+    def on_modified_async(self, view):
+        if config.get('backup_unsaved', False):
+            UnsavedSnapshots.modified(view)
+
+
+    def on_close(self, view):
+        UnsavedSnapshots.closed(view)
+
+        # a compressed or delta backup rebuilt to be opened, unless another view still shows it
+        filename = view.file_name()
+        if filename and not any(other.file_name() == filename and other.id() != view.id()
+                                for window in sublime.windows() for other in window.views()):
+            BackupStorage.release(filename)
+
+
     def on_load_async(self, view):
-        if settings.get('backup_on_open_file'):
+        if config.get('backup_on_open_file'):
             self.save_backup(view, 1)
 
 
     def save_backup(self, view, on_load_event):
+        with Stats.timer('save.total'):
+            self.backup_view(view, on_load_event)
+
+
+    def backup_view(self, view, on_load_event):
 
         if (view.is_read_only()):
             return
 
         view_size = view.size()
-        max_backup_file_size = settings.get('max_backup_file_size_bytes')
+        max_backup_file_size = config.get('max_backup_file_size_bytes')
         if (view_size is None):
             self.console('View size not available.')
             return
@@ -124,6 +481,7 @@ class AutoBackupsEventListener(sublime_plugin.EventListener):
         # don't save files above configured size
         if view_size > max_backup_file_size:
             self.console('Backup not saved, file too large (%d bytes).' % view.size())
+            Stats.incr('skipped.too_large')
             return
 
 
@@ -132,12 +490,27 @@ class AutoBackupsEventListener(sublime_plugin.EventListener):
             return
 
         # Check file path in excluded regexes
-        if self.is_excluded(filename):
+        with Stats.timer('save.exclude'):
+            excluded = self.is_excluded(filename)
+        if excluded:
             #cprint("AutoBackups: " + filename + " is excluded");
+            Stats.incr('skipped.excluded')
             return
 
         # not create file backup if current file is backup
         if on_load_event & self.is_backup_file(filename):
+            Stats.incr('skipped.backup_file')
+            return
+
+        # not changed since its last backup, even across restarts, no need to hash it
+        with Stats.timer('save.stat'):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                st = None
+            unchanged = st is not None and HashCache.is_unchanged(filename, st)
+        if unchanged:
+            Stats.incr('skipped.unchanged')
             return
 
 
@@ -147,70 +520,26 @@ class AutoBackupsEventListener(sublime_plugin.EventListener):
 
         self.console(newname)
 
-        buffer_id = view.buffer_id()
-        content = filename+view.substr(sublime.Region(0, view_size))
-        content = self.encode(content)
-        current_hash = hashlib.md5(content).hexdigest()
-
-        last_hash = ''
-        try:
-            last_hash = hashes[buffer_id]
-        except Exception as e:
-            last_hash = ''
-
+        with Stats.timer('save.hash'):
+            current_hash = hashing.hash_view(view, config.get('backup_hash_algorithm', 'blake2b'), filename)
 
         # not create file backup if no changes from last backup
-        if (last_hash == current_hash):
-            return
-
-        # not create file if exists
-        if on_load_event & os.path.isfile(newname):
+        if is_last_backup(filename, current_hash):
+            if st is not None:
+                HashCache.update_stat(filename, st)
+            Stats.incr('skipped.unchanged')
             return
 
-        (backup_dir, file_to_write) = os.path.split(newname)
-
-        if os.access(backup_dir, os.F_OK) == False:
-            os.makedirs(backup_dir)
-
-        try:
-            shutil.copy(filename, newname)
-        except FileNotFoundError:
-            self.console('Backup not saved. File '+filename+' does not exist!')
-            return False;
-
-        hashes[buffer_id] = current_hash
-        self.console('Backup saved to: '+newname.replace('\\', '/'))
+        # disk work happens on the writer thread, repeated saves are coalesced there.
+        # saves and loads are queued apart, a load must not replace a pending save
+        with Stats.timer('save.submit'):
+            writer.submit((filename, on_load_event), (filename, newname, current_hash, on_load_event))
 
     def is_backup_file(self, path):
-        backup_per_time = settings.get('backup_per_time')
-        path = PathsHelper.normalise_path(path)
-        base_dir = PathsHelper.get_base_dir(False)
-        base_dir = PathsHelper.normalise_path(base_dir)
-        if (backup_per_time == 'folder'):
-            base_dir = base_dir[:-7]
-
-        backup_dir_len = len(base_dir)
-        sub = path[0:backup_dir_len]
-
-        if sub == base_dir:
-            return True
-        else:
-            return False
+        return config.is_backup_file(path)
 
     def is_excluded(self, filename):
-        # check
-        ignore_regexes = settings.get('ignore_regexes')
-
-        if (ignore_regexes is None or ignore_regexes == ""):
-            return False
-
-        for regex in ignore_regexes:
-            prog = re.compile('.*'+regex+'.*')
-            result = prog.match(filename)
-            if result is not None:
-                return True
-
-        return False
+        return config.is_excluded(filename)
 
 
     def console(self, text):
@@ -233,15 +562,24 @@ class AutoBackupsEventListener(sublime_plugin.EventListener):
 
 class AutoBackupsOpenBackupCommand(sublime_plugin.TextCommand):
     datalist = []
+    days = []
     curline = 1
+    preview_panel = 'autobackups_preview'
+
+    # day folders listed before the history panel is shown, older days are loaded in the background
+    first_page = 7
+    loading_entry = ['Loading...', 'Looking for older backups']
+    panel_id = 0
+    panel_open = False
+    highlighted = 0
 
     def run(self, edit):
-        backup_per_day = settings.get('backup_per_day')
+        backup_per_day = config.get('backup_per_day')
 
         window = self.view.window()
         view = self.view
 
-        open_in_same_line = settings.get('open_in_same_line', True)
+        open_in_same_line = config.get('open_in_same_line', True)
         if (open_in_same_line):
             (row,col) = view.rowcol(view.sel()[0].begin())
             self.curline = row + 1
@@ -249,91 +587,162 @@ class AutoBackupsOpenBackupCommand(sublime_plugin.TextCommand):
 
         if (not backup_per_day):
             filepath = view.file_name()
-            newname = PathsHelper.get_backup_filepath(filepath)
-            if os.path.isfile(newname):
-                window.open_file(newname)
+            newname = BackupStorage.locate(PathsHelper.get_backup_filepath(filepath))
+            if newname is not None:
+                window.open_file(BackupStorage.materialize(newname))
             else:
                 sublime.error_message('Backup for ' + filepath + ' does not exist!')
+        elif (config.get('backup_per_time')):
+            self.showDays()
         else:
-            f_files = self.getData(False)
+            with Stats.timer('listing.days'):
+                f_files = self.getData(False)
 
             if not f_files:
                 sublime.error_message('Backups for this file do not exist!')
                 return
 
-            backup_per_time = settings.get('backup_per_time')
-            if (backup_per_time):
-                window.show_quick_panel(f_files, self.timeFolders)
-            else:
-                window.show_quick_panel(f_files, self.openFile)
+            window.show_quick_panel(f_files, self.openFile)
             return
 
 
+    def showDays(self):
+        source = PathsHelper.normalise_path(self.view.file_name(), True)
+
+        limit = self.first_page if st_version == 3 else 0
+        with Stats.timer('listing.days'):
+            (summaries, complete) = History.load(source, limit)
+        f_files = self.setDays(summaries)
+
+        if (not f_files and complete):
+            sublime.error_message('Backups for this file do not exist!')
+            return
+        if (not f_files):
+            # nothing in the newest days, the panel fills in once older ones are listed
+            self.days = [self.loading_entry]
+
+        self.highlighted = 0
+        self.showDaysPanel()
+
+        if (not complete):
+            sublime.status_message('AutoBackups: Loading older backups...')
+            thread = threading.Thread(target=self.loadOlderDays, args=(source, ))
+            thread.daemon = True
+            thread.start()
+
+
+    def loadOlderDays(self, source):
+        (summaries, complete) = History.load(source)
+        sublime.set_timeout(lambda: self.refreshDays(summaries), 0)
+
+
+    def refreshDays(self, summaries):
+        sublime.status_message('')
+        # the user already picked a day or closed the panel
+        if (not self.panel_open):
+            return
+        if (not self.setDays(summaries)):
+            self.panel_open = False
+            self.view.window().run_command('hide_overlay')
+            sublime.error_message('Backups for this file do not exist!')
+            return
+        self.showDaysPanel()
+
+
+    def showDaysPanel(self):
+        self.panel_id += 1
+        panel_id = self.panel_id
+        self.panel_open = True
+
+        def on_done(index):
+            # a panel replaced by refreshDays is closed with -1
+            if (panel_id != self.panel_id):
+                return
+            if (index >= 0 and self.days[index] is self.loading_entry):
+                # shown again when the older days are listed
+                return
+            self.panel_open = False
+            self.timeFolders(index)
+
+        window = self.view.window()
+        if (st_version == 3):
+            window.show_quick_panel(self.days, on_done, 0, self.highlighted, self.highlightDay)
+        else:
+            window.show_quick_panel(self.days, on_done)
+
+
+    def highlightDay(self, index):
+        self.highlighted = max(0, index)
+
+
+    def setDays(self, summaries):
+        f_files = []
+        for (day, count, last) in summaries:
+            f_files.append([day, 'Backups: '+str(count)+', Last edit: '+self.formatTime(last)])
+        self.days = f_files
+        self.datalist = f_files
+        return f_files
+
+
+    def dayName(self, index):
+        if not self.days:
+            self.getData(False)
+        return self.days[index][0]
+
+
 
 
     def getData(self, time_folder):
+        backup_per_time = config.get('backup_per_time')
+        if (backup_per_time and time_folder is False):
+            filename = PathsHelper.normalise_path(self.view.file_name(), True)
+            return self.setDays(History.load(filename)[0])
+
+        if Catalog.ready:
+            return self.getCatalogData(time_folder)
+
         filename = PathsHelper.normalise_path(self.view.file_name(), True)
         basedir = PathsHelper.get_base_dir(True)
 
-        backup_per_time = settings.get('backup_per_time')
         if (backup_per_time):
             if (backup_per_time == 'folder'):
                 f_files = []
                 if (time_folder is not False):
-                    tm_folders = self.getData(False)
-                    tm_folder = tm_folders[time_folder][0]
+                    tm_folder = self.dayName(time_folder)
                     basedir = basedir+'/'+tm_folder
 
                     if (not os.path.isdir(basedir)):
                         sublime.error_message('Folder ' + basedir + ' not found!')
+                        return f_files
 
                     for folder in os.listdir(basedir):
-                        fl = basedir+'/'+folder+'/'+filename
+                        fl = BackupStorage.locate(basedir+'/'+folder+'/'+filename)
                         match = re.search(r"^[0-9+]{6}$", folder)
-                        if os.path.isfile(fl) and match is not None:
+                        if fl is not None and match is not None:
                             folder_name, file_name = os.path.split(fl)
                             f_file = []
                             time = self.formatTime(folder)
                             f_file.append(time+' - '+file_name)
                             f_file.append(fl)
                             f_files.append(f_file)
-                else:
-                    path, flname = os.path.split(filename)
-                    (filepart, extpart) = os.path.splitext(flname)
-                    for folder in os.listdir(basedir):
-                        match = re.search(r"^[0-9+]{4}-[0-9+]{2}-[0-9+]{2}$", folder)
-                        if match is not None:
-                            folder_name, file_name = os.path.split(filename)
-                            f_file = []
-                            basedir2 = basedir+'/'+folder
-                            count = 0
-                            last = ''
-                            for folder2 in os.listdir(basedir2):
-                                match = re.search(r"^[0-9+]{6}$", folder2)
-                                if match is not None:
-                                    basedir3 = basedir+'/'+folder+'/'+folder2+'/'+filename
-                                    if os.path.isfile(basedir3):
-                                        count += 1
-                                        last = folder2
-                            if (count > 0):
-                                f_file.append(folder)
-                                f_file.append('Backups: '+str(count)+', Last edit: '+self.formatTime(last))
-                                f_files.append(f_file)
+                    f_files.extend(self.getPackedData(filename, tm_folder))
             elif (backup_per_time == 'file'):
                 f_files = []
                 if (time_folder is not False):
-                    tm_folders = self.getData(False)
-                    tm_folder = tm_folders[time_folder][0]
+                    tm_folder = self.dayName(time_folder)
                     path, flname = os.path.split(filename)
                     basedir = basedir+'/'+tm_folder+'/'+path
                     (filepart, extpart) = os.path.splitext(flname)
 
-                    if (not os.path.isdir(basedir)):
+                    # packed versions have no folder of their own
+                    f_files.extend(self.getPackedData(filename, tm_folder))
+                    if (not os.path.isdir(basedir) and not f_files):
                         sublime.error_message('Folder ' + basedir + ' not found!')
+                        return f_files
 
-                    for folder in os.listdir(basedir):
+                    for folder in (os.listdir(basedir) if os.path.isdir(basedir) else []):
                         fl = basedir+'/'+folder
-                        match = re.search(r"^"+re.escape(filepart)+"_([0-9+]{6})"+re.escape(extpart)+"$", folder)
+                        match = re.search(r"^"+re.escape(filepart)+"_([0-9+]{6})"+re.escape(extpart)+compression.SUFFIX_PATTERN+"$", folder)
 
                         if os.path.isfile(fl) and match is not None:
                             time = self.formatTime(match.group(1))
@@ -341,33 +750,12 @@ class AutoBackupsOpenBackupCommand(sublime_plugin.TextCommand):
                             f_file.append(time+' - '+flname)
                             f_file.append(fl)
                             f_files.append(f_file)
-                else:
-                    path, flname = os.path.split(filename)
-                    (filepart, extpart) = os.path.splitext(flname)
-                    for folder in os.listdir(basedir):
-                        match = re.search(r"^[0-9+]{4}-[0-9+]{2}-[0-9+]{2}$", folder)
-                        if match is not None:
-                            folder_name, file_name = os.path.split(filename)
-                            f_file = []
-                            basedir2 = basedir+'/'+folder+'/'+path
-                            count = 0
-                            last = ''
-                            if (os.path.isdir(basedir2)):
-                                for sfile in os.listdir(basedir2):
-                                    match = re.search(r"^"+re.escape(filepart)+"_([0-9+]{6})"+re.escape(extpart)+"$", sfile)
-                                    if match is not None:
-                                        count += 1
-                                        last = match.group(1)
-                            if (count > 0):
-                                f_file.append(folder)
-                                f_file.append('Backups: '+str(count)+', Last edit: '+self.formatTime(last))
-                                f_files.append(f_file)
         else:
             f_files = []
             for folder in os.listdir(basedir):
-                fl = basedir+'/'+folder+'/'+filename
+                fl = BackupStorage.locate(basedir+'/'+folder+'/'+filename)
                 match = re.search(r"^[0-9+]{4}-[0-9+]{2}-[0-9+]{2}$", folder)
-                if os.path.isfile(fl) and match is not None:
+                if fl is not None and match is not None:
                     folder_name, file_name = os.path.split(fl)
                     f_file = []
                     f_file.append(folder+' - '+file_name)
@@ -379,14 +767,49 @@ class AutoBackupsOpenBackupCommand(sublime_plugin.TextCommand):
         return f_files
 
 
+    def getPackedData(self, filename, day):
+        flname = os.path.split(filename)[1]
+        return [[self.formatTime(tm)+' - '+flname, fl] for (day, tm, fl) in PackStore.versions(filename, day)]
+
+
+    def getCatalogData(self, time_folder):
+        filename = PathsHelper.normalise_path(self.view.file_name(), True)
+        flname = os.path.split(filename)[1]
+
+        backup_per_time = config.get('backup_per_time')
+        f_files = []
+        day = None
+        if (backup_per_time):
+            day = self.dayName(time_folder)
+
+        missing = []
+        for (day, tm, fl) in Catalog.versions(filename, day):
+            # backups removed behind our back are dropped from the catalog
+            if BackupStorage.locate(fl) is None:
+                missing.append(fl)
+                continue
+            if (backup_per_time):
+                f_files.append([self.formatTime(tm)+' - '+flname, fl])
+            else:
+                f_files.append([day+' - '+os.path.split(fl)[1], fl])
+        if missing:
+            Catalog.remove(missing)
+            SearchIndex.remove(missing)
+            History.invalidate(filename)
+
+        self.datalist = f_files
+        return f_files
+
+
     def timeFolders(self, parent):
         if (parent == -1):
             return
 
         # open file
-        f_files = self.getData(parent)
+        with Stats.timer('listing.versions'):
+            f_files = self.getData(parent)
         if (st_version == 3):
-            show_previews = settings.get('show_previews', True)
+            show_previews = config.get('show_previews', True)
             if (show_previews):
                 sublime.set_timeout_async(lambda: self.view.window().show_quick_panel(f_files, self.openFile, on_highlight=self.showFile), 100)
             else:
@@ -400,22 +823,60 @@ class AutoBackupsOpenBackupCommand(sublime_plugin.TextCommand):
         if (file == -1):
             return
 
+        if (config.get('preview_mode', 'transient') == 'panel'):
+            self.showPreview(file)
+            return
+
         f_files = self.datalist
-        filename = f_files[file][1]
+        filename = BackupStorage.materialize(f_files[file][1])
         window = self.view.window()
 
         view = window.open_file(filename+":"+str(self.curline), sublime.ENCODED_POSITION | sublime.TRANSIENT)
         view.set_read_only(True)
 
 
+    def showPreview(self, file):
+        f_files = self.datalist
+        window = self.view.window()
+
+        try:
+            with Stats.timer('preview.read'):
+                text = VersionCache.get(f_files[file][1])
+        except Exception as e:
+            text = 'AutoBackups: could not read '+f_files[file][1]+'\n'+str(e)
+
+        # one panel is reused for every version, no view is opened per highlight
+        panel = window.find_output_panel(self.preview_panel)
+        if panel is None:
+            panel = window.create_output_panel(self.preview_panel)
+        syntax = self.view.settings().get('syntax')
+        if syntax:
+            panel.set_syntax_file(syntax)
+        panel.set_read_only(False)
+        panel.run_command('auto_backups_replace_content', {'text': text, 'line': self.curline})
+        panel.set_read_only(True)
+        window.run_command('show_panel', {'panel': 'output.'+self.preview_panel})
+
+        # the next highlights are most likely the neighbouring versions
+        first = max(0, file - 2)
+        VersionCache.prefetch([f_file[1] for f_file in f_files[first:file + 3]])
+
+
+    def hidePreview(self):
+        window = self.view.window()
+        if window is not None and config.get('preview_mode', 'transient') == 'panel':
+            window.run_command('hide_panel', {'panel': 'output.'+self.preview_panel})
+
+
     def openFile(self, file):
+        self.hidePreview()
         if (file == -1):
             window = sublime.active_window()
             window.focus_view(self.view)
             return
 
         f_files = self.datalist
-        filename = f_files[file][1]
+        filename = BackupStorage.materialize(f_files[file][1])
 
         window = self.view.window()
         view = window.open_file(filename+":"+str(self.curline), sublime.ENCODED_POSITION)
@@ -428,52 +889,648 @@ class AutoBackupsOpenBackupCommand(sublime_plugin.TextCommand):
 
 
 
+class AutoBackupsDiffCommand(AutoBackupsOpenBackupCommand):
+    """Compare a backup with the current buffer (compare="buffer") or two backups (compare="backups").
+
+    Versions are picked from the same panels as auto_backups_open_backup, the
+    diff is computed on a worker thread and shown as a unified diff.
+    """
+    compare = 'buffer'
+    first = None
+
+    def run(self, edit, compare='buffer'):
+        self.compare = compare
+        self.first = None
+        self.pick()
+
+
+    def pick(self):
+        if (config.get('backup_per_day')):
+            AutoBackupsOpenBackupCommand.run(self, None)
+            return
+
+        # a single backup is kept per file
+        if (self.compare == 'backups'):
+            sublime.error_message('AutoBackups: Only one backup is kept per file, enable backup_per_day to compare backups.')
+            return
+        newname = BackupStorage.locate(PathsHelper.get_backup_filepath(self.view.file_name()))
+        if newname is None:
+            sublime.error_message('Backup for ' + self.view.file_name() + ' does not exist!')
+            return
+        self.startDiff(newname)
+
+
+    def openFile(self, file):
+        self.hidePreview()
+        if (file == -1):
+            return
+
+        path = self.datalist[file][1]
+        if (self.compare == 'backups' and self.first is None):
+            self.first = path
+            sublime.status_message('AutoBackups: Pick the backup to compare it with')
+            sublime.set_timeout(self.pick, 100)
+            return
+        self.startDiff(path)
+
+
+    def startDiff(self, path):
+        if (self.compare == 'backups'):
+            (old, new) = sorted([self.first, path], key=self.versionKey)
+            new_text = None
+        else:
+            (old, new) = (path, self.view.file_name())
+            # the buffer is read here, the worker thread only sees the text
+            new_text = self.view.substr(sublime.Region(0, self.view.size()))
+
+        sublime.status_message('AutoBackups: Comparing...')
+        thread = threading.Thread(target=self.runDiff, args=(old, new, new_text))
+        thread.daemon = True
+        thread.start()
+
+
+    def versionKey(self, path):
+        parsed = PathsHelper.parse_backup_path(Catalog.relative(path))
+        if parsed is None:
+            return ('', '', path)
+        return (parsed[1], parsed[2], path)
+
+
+    def runDiff(self, old, new, new_text):
+        try:
+            with Stats.timer('diff'):
+                old_lines = diff.split_lines(VersionCache.get(old))
+                if new_text is None:
+                    new_text = VersionCache.get(new)
+                lines = diff.unified_diff(old_lines, diff.split_lines(new_text), self.label(old), self.label(new))
+        except Exception as e:
+            # e is unbound once the except block ends, the callback runs later
+            message = 'AutoBackups: Could not compare, '+str(e)
+            sublime.set_timeout(lambda: sublime.error_message(message), 0)
+            return
+        sublime.set_timeout(lambda: self.showDiff(lines), 0)
+
+
+    def label(self, path):
+        if (path == self.view.file_name()):
+            return path.replace('\\', '/')+' (current)'
+        parsed = PathsHelper.parse_backup_path(Catalog.relative(path))
+        if parsed is None:
+            return path.replace('\\', '/')
+        label = parsed[0]
+        if parsed[1]:
+            label += ' '+parsed[1]
+        if parsed[2]:
+            label += ' '+self.formatTime(parsed[2])
+        return label
+
+
+    def showDiff(self, lines):
+        if not lines:
+            sublime.status_message('AutoBackups: No differences')
+            return
+        sublime.status_message('')
+
+        window = self.view.window()
+        view = window.new_file()
+        view.set_name('AutoBackups: Diff '+os.path.basename(self.view.file_name()))
+        view.set_scratch(True)
+        if (st_version == 3 and int(sublime.version()) >= 3084):
+            view.set_syntax_file('Packages/Diff/Diff.sublime-syntax')
+        else:
+            view.set_syntax_file('Packages/Diff/Diff.tmLanguage')
+        view.run_command('append', {'characters': '\n'.join(lines)+'\n'})
+        view.set_read_only(True)
+
+
+
+class AutoBackupsPrevVersionCommand(sublime_plugin.TextCommand):
+    """Shows the version of the file before the one in this view.
+
+    From the file itself the newest backup is shown in a view of its own,
+    in this group or with side set (or version_view "side") in the next
+    one. In that view each step replaces its content in place.
+    """
+    direction = -1
+    version_setting = 'auto_backups_version'
+
+    def run(self, edit, side=None):
+        current = self.currentVersion()
+        if current is None:
+            return
+        (source, key) = current
+
+        with Stats.timer('navigate.lookup'):
+            while True:
+                found = History.neighbour(source, key, self.direction)
+                if found is None:
+                    sublime.status_message('AutoBackups: No '+('older' if self.direction < 0 else 'newer')+' version')
+                    return
+                (index, count, key, path) = found
+                if BackupStorage.locate(path) is not None:
+                    break
+                # removed by the cleanup since the list was built
+                History.drop_version(source, path)
+
+        try:
+            with Stats.timer('navigate.read'):
+                text = VersionCache.get(path)
+        except (IOError, OSError) as e:
+            sublime.status_message('AutoBackups: Could not read '+path+', '+str(e))
+            return
+
+        if side is None:
+            side = config.get('version_view', 'same') == 'side'
+        view = self.versionView(source, side)
+        (row, col) = self.view.rowcol(self.view.sel()[0].begin()) if len(self.view.sel()) else (0, 0)
+        view.set_read_only(False)
+        view.run_command('auto_backups_replace_content', {'text': text, 'line': row + 1})
+        view.set_read_only(True)
+        view.set_name(os.path.basename(source)+' @ '+key[0]+(' '+key[1][0:2]+':'+key[1][2:4]+':'+key[1][4:6] if key[1] else ''))
+        view.settings().set(self.version_setting, [source, key[0], key[1]])
+        sublime.status_message('AutoBackups: Version '+str(index + 1)+' of '+str(count))
+
+        # the next step most likely goes on in the same direction
+        paths = History.load_versions(source)[1]
+        VersionCache.prefetch(paths[max(0, index - 1):index + 2])
+
+    def currentVersion(self):
+        """(source, (day, time)) of the version in this view, time None for the file itself."""
+        stored = self.view.settings().get(self.version_setting)
+        if stored:
+            return (stored[0], (stored[1], stored[2]))
+
+        filename = self.view.file_name()
+        if not filename:
+            return None
+        # a backup opened from the history panel, in place or rebuilt into the temp folder
+        for top in (PathsHelper.get_base_dir(True), BackupStorage.materialize_dir()):
+            try:
+                rel = os.path.relpath(filename, top)
+            except ValueError:
+                # another drive
+                continue
+            if not rel.startswith('..'):
+                parsed = PathsHelper.parse_backup_path(rel)
+                if parsed is not None:
+                    return (parsed[0], (parsed[1], parsed[2]))
+        return (PathsHelper.normalise_path(filename, True), None)
+
+    def versionView(self, source, side):
+        if self.view.settings().get(self.version_setting):
+            return self.view
+
+        window = self.view.window()
+        for view in window.views():
+            stored = view.settings().get(self.version_setting)
+            if stored and stored[0] == source:
+                window.focus_view(view)
+                return view
+
+        # never replace the file being edited, its versions get a view of their own
+        if side:
+            if window.num_groups() < 2:
+                window.set_layout({'cols': [0.0, 0.5, 1.0], 'rows': [0.0, 1.0], 'cells': [[0, 0, 1, 1], [1, 0, 2, 1]]})
+            window.focus_group((window.active_group() + 1) % window.num_groups())
+        view = window.new_file()
+        view.set_scratch(True)
+        syntax = self.view.settings().get('syntax')
+        if syntax:
+            view.set_syntax_file(syntax)
+        return view
+
+    def is_enabled(self):
+        return bool(config.get('backup_per_day'))
+
+
+
+class AutoBackupsNextVersionCommand(AutoBackupsPrevVersionCommand):
+    direction = 1
+
+
+
 class AutoBackupsGcBackup(threading.Thread):
     backup_time = 0
 
-    def __init__(self, back_time):
+    def __init__(self, back_time, dry_run=False):
         self.backup_time = back_time
+        self.dry_run = dry_run
+        self.planned = []
+        self.engine = GcEngine(config.get('gc_workers', 4), dry_run, self.progress)
         threading.Thread.__init__(self)
 
 
     def run(self):
-        import datetime
         basedir = PathsHelper.get_base_dir(True)
         backup_time = self.backup_time
 
-        if (backup_time < 1):
+        if not os.path.isdir(basedir):
+            return
+
+        if (backup_time > 0):
+            with Stats.timer('gc.old_folders'):
+                self.delete_old_folders(basedir, backup_time)
+
+        if (self.dry_run):
+            if pruning_enabled():
+                self.planned = self.plan_pruning(list_backups())
+            sublime.set_timeout(self.show_dry_run, 0)
+            return
+
+        if (self.engine.files > 0 or self.engine.errors > 0):
+            cprint('AutoBackups: Cleanup removed '+self.engine.summary())
+            sublime.status_message('AutoBackups: Cleanup removed '+self.engine.summary())
+            Stats.incr('gc.files_removed', self.engine.files)
+            Stats.incr('gc.bytes_removed', self.engine.bytes)
+            Stats.incr('gc.errors', self.engine.errors)
+
+        with Stats.timer('gc.prune'):
+            self.prune()
+
+        # blobs of the deleted backups are not referenced anymore
+        with Stats.timer('gc.sweep'):
+            (blobs, freed) = BackupStorage.sweep()
+        if (blobs > 0):
+            cprint('AutoBackups: Removed '+str(blobs)+' unused blobs ('+str(freed)+' bytes)')
+
+        # packs that are mostly deleted versions are rewritten
+        with Stats.timer('gc.compact'):
+            (packs, freed) = BackupStorage.compact()
+        if (packs > 0):
+            cprint('AutoBackups: Compacted '+str(packs)+' packs, reclaimed '+str(freed)+' bytes')
+
+        # rebased deltas and rewritten packs changed in place
+        Mirror.reconcile()
+
+
+    def progress(self, engine):
+        action = 'Would remove ' if self.dry_run else 'Cleaning up, removed '
+        sublime.status_message('AutoBackups: '+action+engine.summary())
+
+
+    def plan_pruning(self, backups):
+        max_bytes = config.get('backup_quota_bytes', 0)
+        max_versions = config.get('backup_max_versions', 0)
+        thinning = config.get('backup_thinning', False) and config.get('backup_per_time')
+
+        plan = []
+        if (thinning):
+            plan = plan_thinning(backups, time.time(), config.get('thinning_keep_all_hours', 24),
+                                 config.get('thinning_hourly_days', 7), config.get('thinning_daily_weeks', 4))
+            thinned = set(backup[1] for backup in plan)
+            backups = [backup for backup in backups if backup[1] not in thinned]
+        if (max_bytes > 0 or max_versions > 0):
+            plan.extend(plan_quota(backups, max_bytes, max_versions))
+        plan.sort()
+        return plan
+
+
+    def prune(self):
+        pruner = new_pruner()
+
+        # an interrupted pruning continues first
+        if pruner.has_pending():
+            pruner.resume()
+
+        if pruning_enabled():
+            pruner.start(self.plan_pruning(list_backups()))
+
+        if (pruner.deleted == 0 and pruner.errors == 0):
             return
 
+        History.invalidate()
+        Stats.incr('gc.files_pruned', pruner.deleted)
+        Stats.incr('gc.bytes_removed', pruner.freed)
+        Stats.incr('gc.errors', pruner.errors)
+
+        message = 'AutoBackups: Pruned '+str(pruner.deleted)+' backups, reclaimed '+str(pruner.freed)+' bytes'
+        if (pruner.errors > 0):
+            message += ', '+str(pruner.errors)+' errors'
+        cprint(message)
+        sublime.status_message(message)
+
+
+    def delete_old_folders(self, basedir, backup_time):
+        import datetime
+
         diff = (backup_time + 1) * 24 * 3600
         deleted = 0
         now_time = time.time()
-        for folder in os.listdir(basedir):
+        # snapshots of unsaved buffers expire like the backups
+        folders = [(basedir, folder) for folder in os.listdir(basedir)]
+        for name in (untitled_dir_name, unsaved_dir_name):
+            if (os.path.isdir(basedir+'/'+name)):
+                folders.extend((basedir+'/'+name, folder) for folder in os.listdir(basedir+'/'+name))
+        for (parent, folder) in folders:
             match = re.search(r"^[0-9]{4}-[0-9]{2}-[0-9]{2}$", folder)
             if match is not None:
                 folder_time = time.mktime(datetime.datetime.strptime(folder, "%Y-%m-%d").timetuple())
                 if (now_time - folder_time > diff):
-                    fldr = basedir+'/'+folder
+                    fldr = parent+'/'+folder
                     try:
-                        shutil.rmtree(fldr, onerror=self.onerror)
+                        if self.engine.delete_tree(fldr):
+                            Mirror.remove([fldr])
+                            if parent == basedir:
+                                Catalog.remove_day(folder)
+                                SearchIndex.remove_day(folder)
                         deleted = deleted + 1
                     except Exception as e:
                         cprint(e)
 
-        if (deleted > 0):
+        if (deleted > 0 and not self.dry_run):
+            History.invalidate()
             diff = backup_time * 24 * 3600
             dt = now_time - diff
             date = datetime.datetime.fromtimestamp(dt).strftime('%Y-%m-%d')
             cprint('AutoBackups: Deleted '+str(deleted)+' backup folders older than '+date)
 
 
-    def onerror(self, func, path, exc_info):
-        import stat
-        if not os.access(path, os.W_OK):
-            # Is the error an access error ?
-            os.chmod(path, stat.S_IWUSR)
-            func(path)
-        else:
-            raise
+    def show_dry_run(self):
+        lines = ['AutoBackups cleanup preview, nothing was deleted.', '']
+        lines.append('Old backup folders (delete_old_backups): '+self.engine.summary())
+        for (path, size) in self.engine.listing:
+            lines.append('  '+path+' ('+str(size)+' bytes)')
+
+        lines.append('')
+        lines.append('Quota and thinning: '+str(len(self.planned))+' backups, '
+                     +str(sum(backup[4] for backup in self.planned))+' bytes')
+        for backup in self.planned:
+            lines.append('  '+backup[1]+' ('+str(backup[4])+' bytes)')
+
+        window = sublime.active_window()
+        view = window.new_file()
+        view.set_name('AutoBackups: Cleanup Preview')
+        view.set_scratch(True)
+        view.run_command('append', {'characters': '\n'.join(lines)+'\n'})
+        view.set_read_only(True)
+
+
+
+class AutoBackupsRebuildCatalog(threading.Thread):
+    # backups listed per second by the rebuild that runs when the catalog is created
+    initial_files_per_second = 2000
+
+    def __init__(self, max_files_per_second=0):
+        self.max_files_per_second = max_files_per_second
+        threading.Thread.__init__(self)
+
+
+    def run(self):
+        cprint('AutoBackups: Rebuilding backups catalog, listings read the backup folder until it is done')
+        sublime.status_message('AutoBackups: Rebuilding backups catalog...')
+        count = Catalog.rebuild(self.progress, self.max_files_per_second)
+        History.invalidate()
+        cprint('AutoBackups: Catalog rebuilt, '+str(count)+' backups indexed')
+        sublime.status_message('AutoBackups: Catalog rebuilt, '+str(count)+' backups indexed')
+
+
+    def progress(self, count):
+        sublime.status_message('AutoBackups: Rebuilding backups catalog, '+str(count)+' backups found')
+
+
+
+class AutoBackupsRebuildCatalogCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        if not Catalog.enabled:
+            sublime.error_message('AutoBackups: Backups catalog is disabled or sqlite3 is not available!')
+            return
+        AutoBackupsRebuildCatalog().start()
+
+    def is_enabled(self):
+        return Catalog.enabled
+
+
+
+class AutoBackupsRebuildSearchIndex(threading.Thread):
+
+    def run(self):
+        sublime.status_message('AutoBackups: Rebuilding search index...')
+        # the backups on disk, the catalog may be rebuilding at the same time
+        paths = [Catalog.absolute(row[0]) for row in Catalog.scan()]
+        with Stats.timer('search.rebuild'):
+            count = SearchIndex.rebuild(paths, BackupStorage.read)
+        cprint('AutoBackups: Search index rebuilt, '+str(count)+' backups indexed')
+        sublime.status_message('AutoBackups: Search index rebuilt, '+str(count)+' backups indexed')
+
+
+
+class AutoBackupsRebuildSearchIndexCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        if not SearchIndex.enabled:
+            sublime.error_message('AutoBackups: Search index is disabled or sqlite3 is not available!')
+            return
+        AutoBackupsRebuildSearchIndex().start()
+
+    def is_enabled(self):
+        return SearchIndex.enabled
+
+
+
+class AutoBackupsSearchCommand(sublime_plugin.WindowCommand):
+    """Find the backup versions containing some words, newest first.
+
+    The chosen version opens read-only at the first line containing the
+    query, or at the line the index recorded for it.
+    """
+    query = ''
+    results = []
+
+    def run(self, query=None):
+        if not SearchIndex.enabled:
+            sublime.error_message('AutoBackups: Search index is disabled or sqlite3 is not available!')
+            return
+        if query:
+            self.search(query)
+            return
+        self.window.show_input_panel('Search backups (word* matches prefixes):', self.query, self.search, None, None)
+
+    def search(self, query):
+        self.query = query
+        with Stats.timer('search.query'):
+            self.results = SearchIndex.search(query)
+        if not self.results:
+            sublime.status_message('AutoBackups: No backups contain "'+query+'"')
+            return
+
+        items = []
+        for (path, source, day, tm, line) in self.results:
+            when = day+(' '+tm[0:2]+':'+tm[2:4]+':'+tm[4:6] if tm else '')
+            items.append([os.path.basename(source)+':'+str(line), when+' - '+source])
+        sublime.set_timeout(lambda: self.window.show_quick_panel(items, self.openResult), 10)
+
+    def openResult(self, index):
+        if (index == -1):
+            return
+        (path, source, day, tm, line) = self.results[index]
+        if BackupStorage.locate(path) is None:
+            SearchIndex.remove([path])
+            sublime.status_message('AutoBackups: This backup does not exist anymore')
+            return
+
+        try:
+            line = find_line(VersionCache.get(path), self.query.replace('*', '')) or line
+        except (IOError, OSError):
+            pass
+        view = self.window.open_file(BackupStorage.materialize(path)+':'+str(line), sublime.ENCODED_POSITION)
+        view.set_read_only(True)
+        self.window.focus_view(view)
+
+
+
+class AutoBackupsGcCommand(sublime_plugin.WindowCommand):
+    def run(self, dry_run=False):
+        AutoBackupsGcBackup(config.get('delete_old_backups', 0), dry_run).start()
+
+
+
+class AutoBackupsSnapshotProject(threading.Thread):
+    running = False
+
+    def __init__(self, folders):
+        self.folders = folders
+        self.max_size = config.get('max_backup_file_size_bytes')
+        self.engine = ProjectSnapshot(self.unchanged, self.store, config.get('snapshot_workers', 4),
+                                      config.get('backup_hash_algorithm', 'blake2b'), self.progress)
+        threading.Thread.__init__(self)
+
+
+    def run(self):
+        AutoBackupsSnapshotProject.running = True
+        try:
+            with Stats.timer('snapshot.total'):
+                self.engine.run(self.files())
+        finally:
+            AutoBackupsSnapshotProject.running = False
+
+        Stats.incr('snapshot.files', self.engine.files)
+        Stats.incr('snapshot.written', self.engine.written)
+        Stats.incr('snapshot.errors', self.engine.errors)
+        cprint('AutoBackups: Project snapshot, '+self.engine.summary())
+        sublime.status_message('AutoBackups: Project snapshot done, '+self.engine.summary())
+
+
+    def files(self):
+        for folder in self.folders:
+            for (path, st) in walk_files(folder, self.skip_dir):
+                if st.st_size > self.max_size or config.is_excluded(path) or config.is_backup_file(path):
+                    continue
+                yield (path, st)
+
+
+    def skip_dir(self, path):
+        # a trailing separator lets folder regexes like "/node_modules/" skip the whole folder
+        path = path + os.sep
+        return config.is_excluded(path) or config.is_backup_file(path)
+
+
+    def unchanged(self, path, st):
+        return HashCache.is_unchanged(path, st)
+
+
+    def store(self, path, st, current_hash):
+        if is_last_backup(path, current_hash):
+            HashCache.update_stat(path, st)
+            return False
+        store_backup(path, PathsHelper.get_backup_filepath(path), current_hash)
+        return True
+
+
+    def progress(self, engine):
+        sublime.status_message('AutoBackups: Project snapshot, '+engine.summary())
+
+
+
+class AutoBackupsSnapshotProjectCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        if AutoBackupsSnapshotProject.running:
+            sublime.status_message('AutoBackups: A project snapshot is already running')
+            return
+        AutoBackupsSnapshotProject(self.window.folders()).start()
+
+    def is_enabled(self):
+        return len(self.window.folders()) > 0
+
+
+
+class AutoBackupsReplaceContentCommand(sublime_plugin.TextCommand):
+    def run(self, edit, text, line=1):
+        self.view.replace(edit, sublime.Region(0, self.view.size()), text)
+
+        point = self.view.text_point(max(0, line - 1), 0)
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(point))
+        self.view.show_at_center(point)
+
+
+
+class AutoBackupsStatsCommand(sublime_plugin.WindowCommand):
+    def run(self, reset=False):
+        if (reset):
+            Stats.reset()
+            sublime.status_message('AutoBackups: Statistics reset')
+            return
+
+        view = self.window.new_file()
+        view.set_name('AutoBackups: Statistics')
+        view.set_scratch(True)
+        text = Stats.report()+'\n'
+        for (root, online, waiting) in Mirror.status():
+            state = {None: 'starting', True: 'online', False: 'unavailable'}[online]
+            text += '\nMirror '+root+': '+state+', '+str(waiting)+' files waiting'
+        view.run_command('append', {'characters': text+'\n'})
+        view.set_read_only(True)
+
+
+
+class AutoBackupsIntegrityReportCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        problems = Catalog.problems()
+        verified = Stats.snapshot()['counters'].get('scrub.verified', 0)
+        if not problems:
+            sublime.message_dialog('AutoBackups: No broken backups found, '+str(verified)+' verified this session.')
+            return
+
+        lines = [str(len(problems))+' broken backups, '+str(verified)+' verified this session', '']
+        for (path, status, verified_time) in problems:
+            when = time.strftime('%Y-%m-%d %H:%M', time.localtime(verified_time))
+            lines.append(status.ljust(10)+' '+when+'  '+path)
+
+        view = self.window.new_file()
+        view.set_name('AutoBackups: Integrity Problems')
+        view.set_scratch(True)
+        view.run_command('append', {'characters': '\n'.join(lines)+'\n'})
+        view.set_read_only(True)
+
+    def is_enabled(self):
+        return Catalog.enabled
+
+
+
+class AutoBackupsUnpackCommand(sublime_plugin.WindowCommand):
+    def run(self, target_dir=None):
+        if not PackStore.day_dirs():
+            sublime.message_dialog('AutoBackups: There are no packed backups.')
+            return
+        if not target_dir and BackupStorage.mode == 'pack':
+            if not sublime.ok_cancel_dialog('AutoBackups: backup_storage is "pack", new backups will be packed again. Unpack anyway?'):
+                return
+        threading.Thread(target=self.unpack, args=(target_dir, )).start()
+
+    def unpack(self, target_dir):
+        sublime.status_message('AutoBackups: Unpacking backups...')
+        day_dirs = PackStore.day_dirs()
+        try:
+            count = PackStore.export(target_dir)
+        except (IOError, OSError) as e:
+            cprint('AutoBackups: Unpacking failed, '+str(e))
+            sublime.status_message('AutoBackups: Unpacking failed, '+str(e))
+            return
+        VersionCache.initialize(config.get('preview_cache_bytes', 16777216))
+        if not target_dir:
+            Mirror.remove([os.path.join(day_dir, name) for day_dir in day_dirs for name in (PACK_NAME, INDEX_NAME)])
+            Mirror.reconcile()
+        cprint('AutoBackups: Unpacked '+str(count)+' backups to '+(target_dir or PathsHelper.get_base_dir(True)))
+        sublime.status_message('AutoBackups: Unpacked '+str(count)+' backups')
 
 
 
@@ -484,7 +1541,7 @@ class AutoBackupsDonateCommand(sublime_plugin.WindowCommand):
 
 class AutoBackupsOpenBackupsFolderCommand(sublime_plugin.WindowCommand):
     def run(self, paths = []):
-        backup_dir = settings.get('backup_dir')
+        backup_dir = config.get('backup_dir')
 
         if sublime.platform() == 'windows':
             import subprocess
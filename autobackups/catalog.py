@@ -0,0 +1,319 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import time
+import datetime
+import threading
+
+try:
+    import sqlite3
+except (ImportError):
+    # Sublime Text's embedded Python may come without sqlite3,
+    # the plugin falls back to scanning the backup folders then.
+    sqlite3 = None
+
+from .paths_helper import PathsHelper, untitled_dir_name, unsaved_dir_name
+from .pack_store import PackStore, is_pack_file
+
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS backups (
+        path TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        day TEXT NOT NULL,
+        time TEXT NOT NULL,
+        timestamp REAL NOT NULL,
+        size INTEGER NOT NULL,
+        hash TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS backups_source ON backups (source, day, time)",
+    "CREATE INDEX IF NOT EXISTS backups_day ON backups (day)",
+    # checksum of the contents as written, when and how the scrubber last found them
+    """CREATE TABLE IF NOT EXISTS checksums (
+        path TEXT PRIMARY KEY,
+        checksum TEXT NOT NULL,
+        verified REAL NOT NULL,
+        status TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS checksums_verified ON checksums (verified)",
+]
+
+
+class Catalog(object):
+    """Persistent index of written backups, stored in <data_dir>/catalog.sqlite.
+
+    Paths are kept relative to the backup base dir with '/' separators and
+    sources as built by PathsHelper.normalise_path(path, True), so listing
+    the history of one file is a single indexed query. The checksums table
+    holds what the scrubber verifies backups against.
+
+    ready is False until a rebuild() has completed once, meanwhile listings
+    read the backup tree. Completion is stored as the database user_version.
+    """
+    enabled = False
+    ready = False
+    db_path = False
+    connection = None
+    lock = threading.Lock()
+    # paths added while rebuild() walks the backup tree, None when not rebuilding
+    rebuilding = None
+    progress_interval = 0.5
+
+
+    @staticmethod
+    def initialize(data_dir, enabled=True):
+        """Open the catalog, return True when it has to be rebuilt from the backup tree."""
+        Catalog.close()
+        Catalog.enabled = False
+        Catalog.ready = False
+        if not enabled or sqlite3 is None:
+            return False
+
+        Catalog.db_path = os.path.join(data_dir, 'catalog.sqlite')
+        try:
+            if not os.path.isdir(data_dir):
+                os.makedirs(data_dir)
+            connection = sqlite3.connect(Catalog.db_path, check_same_thread=False)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+            ready = connection.execute('PRAGMA user_version').fetchone()[0] >= 1
+        except Exception as e:
+            print('AutoBackups: catalog disabled, ' + str(e))
+            return False
+
+        Catalog.connection = connection
+        Catalog.enabled = True
+        Catalog.ready = ready
+        return not ready
+
+
+    @staticmethod
+    def close():
+        with Catalog.lock:
+            if Catalog.connection is not None:
+                Catalog.connection.close()
+                Catalog.connection = None
+
+
+    @staticmethod
+    def relative(path):
+        return os.path.relpath(path, PathsHelper.get_base_dir(True)).replace('\\', '/')
+
+
+    @staticmethod
+    def absolute(rel_path):
+        return os.path.normpath(os.path.join(PathsHelper.get_base_dir(True), rel_path))
+
+
+    @staticmethod
+    def make_row(rel_path, size, hash=None):
+        parsed = PathsHelper.parse_backup_path(rel_path)
+        if parsed is None:
+            return None
+        (source, day, tm) = parsed
+        if day:
+            stamp = time.mktime(datetime.datetime.strptime(day + (tm or '000000'), '%Y-%m-%d%H%M%S').timetuple())
+        else:
+            stamp = time.time()
+        return (rel_path, source, day, tm, stamp, size, hash)
+
+
+    @staticmethod
+    def execute(sql, params=(), many=False):
+        with Catalog.lock:
+            if Catalog.connection is None:
+                return []
+            try:
+                if many:
+                    cursor = Catalog.connection.executemany(sql, params)
+                else:
+                    cursor = Catalog.connection.execute(sql, params)
+                rows = cursor.fetchall()
+                Catalog.connection.commit()
+                return rows
+            except Exception as e:
+                print('AutoBackups: catalog error, ' + str(e))
+                return []
+
+
+    @staticmethod
+    def add(stored_path, hash=None, size=None):
+        """Record a backup that was just written to stored_path."""
+        if not Catalog.enabled:
+            return
+        try:
+            if size is None:
+                size = os.path.getsize(stored_path)
+        except OSError:
+            return
+        row = Catalog.make_row(Catalog.relative(stored_path), size, hash)
+        if row is not None:
+            with Catalog.lock:
+                if Catalog.rebuilding is not None:
+                    Catalog.rebuilding.add(row[0])
+            Catalog.execute('INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+
+
+    @staticmethod
+    def remove(stored_paths):
+        if not Catalog.enabled or not stored_paths:
+            return
+        rel_paths = [(Catalog.relative(path), ) for path in stored_paths]
+        Catalog.execute('DELETE FROM backups WHERE path = ?', rel_paths, many=True)
+        Catalog.execute('DELETE FROM checksums WHERE path = ?', rel_paths, many=True)
+
+
+    @staticmethod
+    def remove_day(day):
+        if Catalog.enabled:
+            Catalog.execute('DELETE FROM backups WHERE day = ?', (day, ))
+            Catalog.execute('DELETE FROM checksums WHERE path >= ? AND path < ?', (day + '/', day + '0'))
+
+
+    @staticmethod
+    def set_checksum(stored_path, checksum):
+        """Remember the checksum of a backup that was just written."""
+        if Catalog.enabled:
+            Catalog.execute('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?)',
+                            (Catalog.relative(stored_path), checksum, time.time(), 'ok'))
+
+
+    @staticmethod
+    def due_checksums(verified_before, limit=100):
+        """Return [(absolute path, checksum)] of backups last verified before verified_before, least recently first."""
+        rows = Catalog.execute('SELECT path, checksum FROM checksums WHERE verified < ? ORDER BY verified LIMIT ?',
+                               (verified_before, limit))
+        return [(Catalog.absolute(row[0]), row[1]) for row in rows]
+
+
+    @staticmethod
+    def mark_verified(stored_path, status):
+        Catalog.execute('UPDATE checksums SET verified = ?, status = ? WHERE path = ?',
+                        (time.time(), status, Catalog.relative(stored_path)))
+
+
+    @staticmethod
+    def problems():
+        """Return [(absolute path, status, verified)] of the backups the scrubber found broken."""
+        rows = Catalog.execute("SELECT path, status, verified FROM checksums WHERE status != 'ok' ORDER BY path")
+        return [(Catalog.absolute(row[0]), row[1], row[2]) for row in rows]
+
+
+    @staticmethod
+    def days(source):
+        """Return [(day, backups count, last time)] for a source, newest day first."""
+        return Catalog.execute('SELECT day, COUNT(*), MAX(time) FROM backups WHERE source = ? '
+                               'GROUP BY day ORDER BY day DESC', (source, ))
+
+
+    @staticmethod
+    def versions(source, day=None):
+        """Return [(day, time, absolute path)] for a source, newest first."""
+        if day is None:
+            rows = Catalog.execute('SELECT day, time, path FROM backups WHERE source = ? '
+                                   'ORDER BY day DESC, time DESC', (source, ))
+        else:
+            rows = Catalog.execute('SELECT day, time, path FROM backups WHERE source = ? AND day = ? '
+                                   'ORDER BY time DESC', (source, day))
+        return [(row[0], row[1], Catalog.absolute(row[2])) for row in rows]
+
+
+    @staticmethod
+    def all():
+        """Return [(rel path, source, day, time, timestamp, size, hash)] of every backup."""
+        return Catalog.execute('SELECT path, source, day, time, timestamp, size, hash FROM backups')
+
+
+    @staticmethod
+    def scan(progress=None, max_files_per_second=0):
+        """Walk the backup tree, return catalog rows for every backup found on disk.
+
+        progress(rows found) is called about twice a second. With
+        max_files_per_second set, the walk sleeps to stay below that rate.
+        """
+        base_dir = PathsHelper.get_base_dir(True)
+        rows = []
+        if not os.path.isdir(base_dir):
+            return rows
+
+        started = time.time()
+        reported = started
+        seen = 0
+        for (root, dirs, files) in os.walk(base_dir):
+            if root == base_dir:
+                # plugin data and snapshots of unsaved buffers are not backups of a source file
+                for name in ('.autobackups', untitled_dir_name, unsaved_dir_name):
+                    if name in dirs:
+                        dirs.remove(name)
+            for name in files:
+                path = os.path.join(root, name)
+                if is_pack_file(name):
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                row = Catalog.make_row(Catalog.relative(path), size)
+                if row is not None:
+                    rows.append(row)
+
+            seen += len(files)
+            if max_files_per_second > 0:
+                ahead = float(seen) / max_files_per_second - (time.time() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+            if progress is not None and time.time() - reported >= Catalog.progress_interval:
+                reported = time.time()
+                progress(len(rows))
+
+        for day_dir in PackStore.day_dirs():
+            for (path, size) in PackStore.entries(day_dir):
+                row = Catalog.make_row(Catalog.relative(path), size)
+                if row is not None:
+                    rows.append(row)
+        return rows
+
+
+    @staticmethod
+    def rebuild(progress=None, max_files_per_second=0):
+        """Re-create the catalog from the backup tree on disk, return the number of backups found.
+
+        progress and max_files_per_second are passed on to scan().
+        """
+        if not Catalog.enabled:
+            return 0
+
+        with Catalog.lock:
+            Catalog.rebuilding = set()
+        try:
+            rows = Catalog.scan(progress, max_files_per_second)
+        finally:
+            with Catalog.lock:
+                added = Catalog.rebuilding
+                Catalog.rebuilding = None
+
+        with Catalog.lock:
+            if Catalog.connection is None:
+                return 0
+            # keep the rows added by saves that happened while walking, they carry the hash
+            kept = []
+            for path in added:
+                kept.extend(Catalog.connection.execute('SELECT * FROM backups WHERE path = ?', (path, )).fetchall())
+            Catalog.connection.execute('DELETE FROM backups')
+            Catalog.connection.executemany('INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                           [row for row in rows if row[0] not in added])
+            Catalog.connection.executemany('INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?)', kept)
+            Catalog.connection.execute('DELETE FROM checksums WHERE path NOT IN (SELECT path FROM backups)')
+            Catalog.connection.execute('PRAGMA user_version = 1')
+            Catalog.connection.commit()
+            Catalog.ready = True
+        return len(rows)
@@ -0,0 +1,116 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import gzip
+import zlib
+
+try:
+    import bz2
+except (ImportError):
+    bz2 = None
+
+try:
+    import lzma
+except (ImportError):
+    # Python 2 and some embedded Python 3 builds
+    lzma = None
+
+
+# compression method -> suffix appended to the backup file name
+METHODS = {
+    'gzip': '.gz',
+    'bz2': '.bz2',
+    'lzma': '.xz',
+}
+
+SUFFIXES = ('.gz', '.bz2', '.xz')
+
+# regex fragment matching an optional compression suffix in backup names
+SUFFIX_PATTERN = r'(?:\.gz|\.bz2|\.xz)?'
+
+
+def is_available(method):
+    if method == 'gzip':
+        return True
+    if method == 'bz2':
+        return bz2 is not None
+    if method == 'lzma':
+        return lzma is not None
+    return False
+
+
+def suffix_for(method):
+    return METHODS.get(method, '')
+
+
+def get_suffix(path):
+    for suffix in SUFFIXES:
+        if path.endswith(suffix):
+            return suffix
+    return ''
+
+
+def get_method(path):
+    """Compression method a stored backup was written with, False for plain files."""
+    suffix = get_suffix(path)
+    for (method, method_suffix) in METHODS.items():
+        if method_suffix == suffix:
+            return method
+    return False
+
+
+def strip_suffix(path):
+    suffix = get_suffix(path)
+    if suffix:
+        return path[:-len(suffix)]
+    return path
+
+
+def open_write(path, method, level):
+    """Open path for writing, compressing with method (falsy method writes plain bytes)."""
+    if method == 'gzip':
+        return gzip.GzipFile(path, 'wb', level)
+    if method == 'bz2':
+        return bz2.BZ2File(path, 'wb', compresslevel=level)
+    if method == 'lzma':
+        return lzma.LZMAFile(path, 'wb', preset=level)
+    return open(path, 'wb')
+
+
+def open_read(path):
+    """Open a stored backup for reading, decompressing according to its suffix."""
+    suffix = get_suffix(path)
+    if suffix == '.gz':
+        return gzip.GzipFile(path, 'rb')
+    if suffix == '.bz2':
+        return bz2.BZ2File(path, 'rb')
+    if suffix == '.xz':
+        return lzma.LZMAFile(path, 'rb')
+    return open(path, 'rb')
+
+
+def compress(data, method, level):
+    """Compress data held in memory, gzip is stored as a bare zlib stream."""
+    if method == 'gzip':
+        return zlib.compress(data, level)
+    if method == 'bz2':
+        return bz2.compress(data, level)
+    if method == 'lzma':
+        return lzma.compress(data, preset=level)
+    return data
+
+
+def decompress(data, method):
+    if method == 'gzip':
+        return zlib.decompress(data)
+    if method == 'bz2':
+        return bz2.decompress(data)
+    if method == 'lzma':
+        return lzma.decompress(data)
+    return data
@@ -0,0 +1,104 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+"""Copies backup files without passing their contents through Python where possible.
+
+In order of preference: a reflink clone (FICLONE ioctl, btrfs/XFS and
+friends, instant copy-on-write), os.copy_file_range, os.sendfile (Linux)
+and finally a plain buffered copy. Whatever the filesystem or kernel
+refuses is remembered per device, so it isn't tried again on every save.
+"""
+
+import os
+import sys
+import errno
+import shutil
+
+try:
+    import fcntl
+except (ImportError):
+    # Windows
+    fcntl = None
+
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+# errors meaning "not supported here", anything else is a real failure
+UNSUPPORTED = set(getattr(errno, name) for name in ('EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP',
+                                                     'ENOTTY', 'EBADF', 'EPERM', 'ENOTSOCK') if hasattr(errno, name))
+
+IS_LINUX = sys.platform.startswith('linux')
+
+# (method, source device, destination device) that failed as unsupported
+unsupported = set()
+
+
+def reflink(src, dst):
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def copy_file_range(src, dst, size):
+    copied = 0
+    while True:
+        count = os.copy_file_range(src.fileno(), dst.fileno(), max(size - copied, 1 << 20))
+        if count == 0:
+            return copied
+        copied += count
+
+
+def sendfile(src, dst, size):
+    copied = 0
+    while True:
+        count = os.sendfile(dst.fileno(), src.fileno(), copied, max(size - copied, 1 << 20))
+        if count == 0:
+            return copied
+        copied += count
+
+
+def available_methods():
+    methods = []
+    if fcntl is not None and IS_LINUX:
+        methods.append('reflink')
+    if hasattr(os, 'copy_file_range'):
+        methods.append('copy_file_range')
+    if hasattr(os, 'sendfile') and IS_LINUX:
+        methods.append('sendfile')
+    return methods
+
+
+def copy_file(source, dest, chunk_size=1024 * 1024):
+    """Copy the contents of source to dest (no permission bits), return the method used."""
+    with open(source, 'rb') as src:
+        with open(dest, 'wb') as dst:
+            size = os.fstat(src.fileno()).st_size
+            devices = (os.fstat(src.fileno()).st_dev, os.fstat(dst.fileno()).st_dev)
+
+            for method in available_methods():
+                if (method, ) + devices in unsupported:
+                    continue
+                try:
+                    if method == 'reflink':
+                        reflink(src, dst)
+                    elif method == 'copy_file_range':
+                        copy_file_range(src, dst, size)
+                    else:
+                        sendfile(src, dst, size)
+                    return method
+                except (IOError, OSError) as e:
+                    if e.errno not in UNSUPPORTED:
+                        raise
+                    unsupported.add((method, ) + devices)
+                    # start over for the next method, a failed one may have written part of the file
+                    src.seek(0)
+                    dst.seek(0)
+                    dst.truncate()
+
+            shutil.copyfileobj(src, dst, chunk_size)
+            return 'copy'
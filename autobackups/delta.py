@@ -0,0 +1,73 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+from . import diff
+
+
+# A delta file looks like:
+#
+#   AUTOBACKUPS-DELTA 1
+#   base <path of the keyframe, relative to the delta's folder>
+#   c <first line> <line count>     copy lines from the keyframe
+#   i <byte count>                  followed by that many raw bytes
+#
+DELTA_MAGIC = b'AUTOBACKUPS-DELTA 1\n'
+
+
+def split_lines(data):
+    return data.splitlines(True)
+
+
+def make_delta(base_ref, base_data, new_data):
+    base_lines = split_lines(base_data)
+    new_lines = split_lines(new_data)
+
+    out = [DELTA_MAGIC, b'base ' + base_ref.encode('UTF-8') + b'\n']
+    # the patience diff stays fast on repetitive files, SequenceMatcher is quadratic there
+    for (tag, i1, i2, j1, j2) in diff.get_opcodes(base_lines, new_lines):
+        if tag == 'equal':
+            out.append(('c %d %d\n' % (i1, i2 - i1)).encode('ascii'))
+        elif tag in ('replace', 'insert'):
+            chunk = b''.join(new_lines[j1:j2])
+            out.append(('i %d\n' % len(chunk)).encode('ascii'))
+            out.append(chunk)
+    return b''.join(out)
+
+
+def is_delta(data):
+    return data[:len(DELTA_MAGIC)] == DELTA_MAGIC
+
+
+def read_base_ref(data):
+    end = data.index(b'\n', len(DELTA_MAGIC))
+    line = data[len(DELTA_MAGIC):end]
+    if line[:5] != b'base ':
+        raise ValueError('Malformed delta header')
+    return line[5:].decode('UTF-8')
+
+
+def apply_delta(base_data, data):
+    base_lines = split_lines(base_data)
+    pos = data.index(b'\n', len(DELTA_MAGIC)) + 1
+    out = []
+    size = len(data)
+    while pos < size:
+        end = data.index(b'\n', pos)
+        op = data[pos:end].split(b' ')
+        pos = end + 1
+        if op[0] == b'c':
+            start = int(op[1])
+            out.extend(base_lines[start:start + int(op[2])])
+        elif op[0] == b'i':
+            length = int(op[1])
+            out.append(data[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError('Malformed delta operation')
+    return b''.join(out)
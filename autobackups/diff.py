@@ -0,0 +1,206 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+"""Patience style line diff.
+
+Lines are interned to integers, common prefixes and suffixes are matched
+directly and what's left is split on lines that occur exactly once on both
+sides, in the longest increasing order. Only regions without any such
+anchor fall back to difflib, and only when they are small, so big files
+don't hit SequenceMatcher's quadratic cases.
+"""
+
+import difflib
+from bisect import bisect_left
+
+
+# largest len(a) * len(b) region handed to difflib when no unique line anchors it
+FALLBACK_LIMIT = 250000
+
+
+def split_lines(text):
+    """Lines of text without their line endings, a final newline doesn't add an empty line."""
+    lines = text.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def intern_lines(a, b):
+    ids = {}
+    a_ids = [ids.setdefault(line, len(ids)) for line in a]
+    b_ids = [ids.setdefault(line, len(ids)) for line in b]
+    return (a_ids, b_ids)
+
+
+def unique_anchors(a, alo, ahi, b, blo, bhi):
+    """Return [(i, j)] of lines unique on both sides, in the longest common order."""
+    counts = {}
+    for i in range(alo, ahi):
+        entry = counts.get(a[i])
+        if entry is None:
+            counts[a[i]] = [1, i, 0, 0]
+        else:
+            entry[0] += 1
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[2] += 1
+            entry[3] = j
+
+    pairs = [(entry[1], entry[3]) for entry in counts.values() if entry[0] == 1 and entry[2] == 1]
+    if not pairs:
+        return []
+    pairs.sort()
+
+    # patience sorting: longest increasing subsequence of the b positions
+    tails = []
+    tail_index = []
+    previous = [None] * len(pairs)
+    for (index, (i, j)) in enumerate(pairs):
+        pile = bisect_left(tails, j)
+        if pile == len(tails):
+            tails.append(j)
+            tail_index.append(index)
+        else:
+            tails[pile] = j
+            tail_index[pile] = index
+        previous[index] = tail_index[pile - 1] if pile > 0 else None
+
+    anchors = []
+    index = tail_index[-1]
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def matching_blocks(a, b):
+    """Return [(i, j, size)] of equal runs of the int sequences a and b, in order."""
+    blocks = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        (alo, ahi, blo, bhi) = stack.pop()
+
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        if alo > start:
+            blocks.append((start, blo - (alo - start), alo - start))
+
+        end = ahi
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        if ahi < end:
+            blocks.append((ahi, bhi, end - ahi))
+
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = unique_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            (i, j) = (alo, blo)
+            for (ai, bj) in anchors:
+                stack.append((i, ai, j, bj))
+                blocks.append((ai, bj, 1))
+                (i, j) = (ai + 1, bj + 1)
+            stack.append((i, ahi, j, bhi))
+        elif (ahi - alo) * (bhi - blo) <= FALLBACK_LIMIT:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for (i, j, size) in matcher.get_matching_blocks():
+                if size:
+                    blocks.append((alo + i, blo + j, size))
+        # else: nothing anchors this region, it's reported as replaced
+
+    blocks.sort()
+
+    # join runs split by the anchors
+    merged = []
+    for block in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == block[0] and merged[-1][1] + merged[-1][2] == block[1]:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + block[2])
+        else:
+            merged.append(block)
+    return merged
+
+
+def get_opcodes(a, b):
+    """difflib.SequenceMatcher.get_opcodes() compatible opcodes for the line lists a and b."""
+    (a_ids, b_ids) = intern_lines(a, b)
+    opcodes = []
+    (i, j) = (0, 0)
+    for (ai, bj, size) in matching_blocks(a_ids, b_ids) + [(len(a), len(b), 0)]:
+        if i < ai and j < bj:
+            opcodes.append(('replace', i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(('delete', i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(('insert', i, ai, j, bj))
+        (i, j) = (ai + size, bj + size)
+        if size:
+            opcodes.append(('equal', ai, i, bj, j))
+    return opcodes
+
+
+def group_opcodes(opcodes, context=3):
+    """Split opcodes into hunks with up to context lines around each change."""
+    codes = list(opcodes) or [('equal', 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        (tag, i1, i2, j1, j2) = codes[0]
+        codes[0] = (tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)
+    if codes[-1][0] == 'equal':
+        (tag, i1, i2, j1, j2) = codes[-1]
+        codes[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+
+    groups = []
+    group = []
+    for (tag, i1, i2, j1, j2) in codes:
+        if tag == 'equal' and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            groups.append(group)
+            group = []
+            (i1, j1) = (max(i1, i2 - context), max(j1, j2 - context))
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        groups.append(group)
+    return groups
+
+
+def format_range(start, stop):
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return '%d,%d' % (beginning, length)
+
+
+def unified_diff(a, b, fromfile='', tofile='', context=3):
+    """Unified diff of the line lists a and b (without line endings), as a list of lines."""
+    lines = []
+    for group in group_opcodes(get_opcodes(a, b), context):
+        if not lines:
+            lines.append('--- ' + fromfile)
+            lines.append('+++ ' + tofile)
+        first = group[0]
+        last = group[-1]
+        lines.append('@@ -%s +%s @@' % (format_range(first[1], last[2]), format_range(first[3], last[4])))
+        for (tag, i1, i2, j1, j2) in group:
+            if tag == 'equal':
+                lines.extend(' ' + line for line in a[i1:i2])
+                continue
+            if tag in ('replace', 'delete'):
+                lines.extend('-' + line for line in a[i1:i2])
+            if tag in ('replace', 'insert'):
+                lines.extend('+' + line for line in b[j1:j2])
+    return lines
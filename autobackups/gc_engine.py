@@ -0,0 +1,180 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import stat
+import time
+import threading
+
+try:
+    import queue
+except (ImportError):
+    # Python 2
+    import Queue as queue
+
+
+def scan_tree(top):
+    """Yield (path, size, is_dir) for everything below top, children before their folder.
+
+    Uses os.scandir where available, its entries carry the file type, so
+    only files need a stat call for their size.
+    """
+    scandir = getattr(os, 'scandir', None)
+    stack = [(top, False)]
+    while stack:
+        (folder, visited) = stack.pop()
+        if visited:
+            yield (folder, 0, True)
+            continue
+
+        stack.append((folder, True))
+        try:
+            if scandir is not None:
+                entries = []
+                for entry in scandir(folder):
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, False))
+                    else:
+                        entries.append((entry.path, entry))
+                for (path, entry) in entries:
+                    try:
+                        size = entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        size = 0
+                    yield (path, size, False)
+            else:
+                for name in os.listdir(folder):
+                    path = os.path.join(folder, name)
+                    try:
+                        st = os.lstat(path)
+                    except OSError:
+                        continue
+                    if stat.S_ISDIR(st.st_mode):
+                        stack.append((path, False))
+                    else:
+                        yield (path, st.st_size, False)
+        except OSError:
+            continue
+
+
+
+class GcEngine(object):
+    """Deletes backup files through a bounded pool of worker threads.
+
+    Counts removed files, bytes and errors and calls progress(engine) about
+    twice a second. With dry_run nothing is deleted, the files that would
+    be are collected in self.listing.
+    """
+    progress_interval = 0.5
+
+    def __init__(self, workers=4, dry_run=False, progress=None):
+        self.workers = max(1, workers)
+        self.dry_run = dry_run
+        self.progress = progress
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.listing = []
+        self.started = time.time()
+        self.reported = 0
+        self.lock = threading.Lock()
+
+
+    def elapsed(self):
+        return time.time() - self.started
+
+
+    def summary(self):
+        return '%d files, %d bytes, %d errors in %.1fs' % (self.files, self.bytes, self.errors, self.elapsed())
+
+
+    def report(self, force=False):
+        now = time.time()
+        if self.progress is not None and (force or now - self.reported >= self.progress_interval):
+            self.reported = now
+            self.progress(self)
+
+
+    def remove_file(self, path, size):
+        try:
+            try:
+                os.remove(path)
+            except OSError:
+                # read-only files, retry once with write permission
+                if os.access(path, os.W_OK):
+                    raise
+                os.chmod(path, stat.S_IWUSR)
+                os.remove(path)
+        except OSError:
+            with self.lock:
+                self.errors += 1
+            return
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+
+
+    def worker(self, jobs):
+        while True:
+            job = jobs.get()
+            try:
+                if job is None:
+                    return
+                self.remove_file(job[0], job[1])
+            finally:
+                jobs.task_done()
+
+
+    def delete_entries(self, entries):
+        """Delete (path, size, is_dir) entries, folders after what they contain."""
+        folders = []
+        if self.dry_run:
+            for (path, size, is_dir) in entries:
+                if is_dir:
+                    continue
+                self.listing.append((path, size))
+                self.files += 1
+                self.bytes += size
+                self.report()
+            return folders
+
+        jobs = queue.Queue(self.workers * 64)
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.worker, args=(jobs, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for (path, size, is_dir) in entries:
+                if is_dir:
+                    folders.append(path)
+                else:
+                    jobs.put((path, size))
+                self.report()
+        finally:
+            for thread in threads:
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+
+        # scan_tree yields folders after their content
+        for folder in folders:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                self.errors += 1
+        self.report(True)
+        return folders
+
+
+    def delete_tree(self, top):
+        self.delete_entries(scan_tree(top))
+        return not self.dry_run and not os.path.exists(top)
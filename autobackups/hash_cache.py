@@ -0,0 +1,155 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import time
+import json
+import threading
+
+from .pack_store import PackStore
+
+
+# coarsest mtime resolution around (FAT), a file may change again within it keeping its stat
+RACY_SECONDS = 2.0
+
+
+def stat_key(st):
+    """(size, mtime in ns) of an os.stat result."""
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return (st.st_size, mtime_ns)
+
+
+class HashCache(object):
+    """Change detection state of the backed up files, kept across restarts.
+
+    Maps a source path to [size, mtime_ns, content hash, last backup path,
+    time recorded]. Updates are appended to <data_dir>/hashes.journal, which
+    is compacted when it's loaded and has grown well past the number of
+    entries.
+
+    An entry recorded less than RACY_SECONDS after the file's mtime is not
+    trusted: a save within the same mtime tick would keep size and mtime.
+    """
+    entries = {}
+    journal_path = False
+    journal_lines = 0
+    max_entries = 20000
+    lock = threading.Lock()
+
+
+    @staticmethod
+    def initialize(data_dir):
+        with HashCache.lock:
+            HashCache.entries = {}
+            HashCache.journal_lines = 0
+            HashCache.journal_path = os.path.join(data_dir, 'hashes.journal')
+            HashCache.load()
+
+
+    @staticmethod
+    def load():
+        entries = {}
+        lines = 0
+        try:
+            with open(HashCache.journal_path, 'r') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                        entries[record[0]] = record[1:]
+                    except (ValueError, IndexError):
+                        # half written line from a crash
+                        continue
+        except (IOError, OSError):
+            pass
+
+        HashCache.entries = entries
+        HashCache.journal_lines = lines
+        if lines > 2 * len(entries) + 100 or len(entries) > HashCache.max_entries:
+            HashCache.compact()
+
+
+    @staticmethod
+    def compact():
+        entries = HashCache.entries
+        paths = list(entries.keys())
+        if len(paths) > HashCache.max_entries:
+            for path in paths[:len(paths) - HashCache.max_entries]:
+                del entries[path]
+
+        tmp_path = HashCache.journal_path + '.tmp'
+        try:
+            data_dir = os.path.dirname(HashCache.journal_path)
+            if not os.path.isdir(data_dir):
+                os.makedirs(data_dir)
+            with open(tmp_path, 'w') as f:
+                for (path, entry) in entries.items():
+                    f.write(json.dumps([path] + list(entry)) + '\n')
+            if os.path.exists(HashCache.journal_path):
+                os.remove(HashCache.journal_path)
+            os.rename(tmp_path, HashCache.journal_path)
+            HashCache.journal_lines = len(entries)
+        except (IOError, OSError) as e:
+            print('AutoBackups: could not compact hash cache, ' + str(e))
+
+
+    @staticmethod
+    def get(path):
+        """Return [size, mtime_ns, hash, last backup, time recorded] for path, or None."""
+        with HashCache.lock:
+            return HashCache.entries.get(path)
+
+
+    @staticmethod
+    def is_racy(entry):
+        # entries written before the time was recorded are old enough
+        return len(entry) > 4 and entry[4] - entry[1] / 1000000000.0 < RACY_SECONDS
+
+
+    @staticmethod
+    def is_unchanged(path, st):
+        """True when path has the same size and mtime as when it was last backed up."""
+        entry = HashCache.get(path)
+        if entry is None or tuple(entry[0:2]) != stat_key(st) or HashCache.is_racy(entry):
+            return False
+        # the backup may have been removed by the GC since
+        return entry[3] is not None and (os.path.exists(entry[3]) or PackStore.contains(entry[3]))
+
+
+    @staticmethod
+    def set(path, st, hash, backup_path):
+        if st is None:
+            (size, mtime_ns) = (-1, -1)
+        else:
+            (size, mtime_ns) = stat_key(st)
+        entry = [size, mtime_ns, hash, backup_path, time.time()]
+        with HashCache.lock:
+            old = HashCache.entries.get(path)
+            if old is not None and old[0:4] == entry[0:4] and not HashCache.is_racy(old):
+                return
+            HashCache.entries[path] = entry
+            try:
+                data_dir = os.path.dirname(HashCache.journal_path)
+                if not os.path.isdir(data_dir):
+                    os.makedirs(data_dir)
+                with open(HashCache.journal_path, 'a') as f:
+                    f.write(json.dumps([path] + entry) + '\n')
+                HashCache.journal_lines += 1
+            except (IOError, OSError) as e:
+                print('AutoBackups: could not update hash cache, ' + str(e))
+
+
+    @staticmethod
+    def update_stat(path, st):
+        # content is known to match the last backup, only remember the new stat data
+        entry = HashCache.get(path)
+        if entry is not None:
+            HashCache.set(path, st, entry[2], entry[3])
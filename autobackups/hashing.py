@@ -0,0 +1,101 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import hashlib
+
+try:
+    import sublime
+except (ImportError):
+    # used outside the editor, see restore.py, only files are hashed then
+    sublime = None
+
+
+# characters of the buffer / bytes of a file fed to the hasher at once
+VIEW_CHUNK_SIZE = 64 * 1024
+FILE_CHUNK_SIZE = 1024 * 1024
+
+# newline written to disk for view.line_endings(), buffers always use \n
+NEWLINES = {'Windows': '\r\n', 'CR': '\r'}
+
+
+def new_hasher(algorithm):
+    """Incremental hasher for algorithm, md5 when it isn't available in this Python."""
+    if algorithm == 'blake2b' and hasattr(hashlib, 'blake2b'):
+        # 128 bit digest is plenty for change detection and keeps the cache small
+        return hashlib.blake2b(digest_size=16)
+    if algorithm in ('sha1', 'sha256'):
+        return hashlib.new(algorithm)
+    return hashlib.md5()
+
+
+def encode(text):
+    if not isinstance(text, bytes):
+        text = text.encode('UTF-8')
+    return text
+
+
+def apply_line_endings(text, line_endings):
+    """text of a buffer with the newlines it gets on disk."""
+    newline = NEWLINES.get(line_endings)
+    if newline is None:
+        return text
+    return text.replace('\n', newline)
+
+
+def hash_view(view, algorithm, prefix=''):
+    """Hash prefix + the buffer contents without copying the whole buffer at once.
+
+    The buffer is hashed with the view's line endings, as hash_file() sees it
+    once saved.
+    """
+    hasher = new_hasher(algorithm)
+    hasher.update(encode(prefix))
+
+    line_endings = view.line_endings()
+    size = view.size()
+    start = 0
+    while start < size:
+        end = min(size, start + VIEW_CHUNK_SIZE)
+        hasher.update(encode(apply_line_endings(view.substr(sublime.Region(start, end)), line_endings)))
+        start = end
+    return hasher.hexdigest()
+
+
+def update_from_file(hasher, path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+
+
+def hash_file(path, algorithm, prefix=''):
+    hasher = new_hasher(algorithm)
+    hasher.update(encode(prefix))
+    update_from_file(hasher, path)
+    return hasher.hexdigest()
+
+
+def checksum(data, algorithm):
+    """'<algorithm>:<hex digest>' of data, as stored for verifying backups later."""
+    hasher = new_hasher(algorithm)
+    hasher.update(data)
+    return hasher.name + ':' + hasher.hexdigest()
+
+
+def file_checksum(path, algorithm):
+    """checksum() of the contents of the file at path, read in chunks."""
+    hasher = new_hasher(algorithm)
+    update_from_file(hasher, path)
+    return hasher.name + ':' + hasher.hexdigest()
+
+
+def verify_checksum(data, stored):
+    return checksum(data, stored.split(':', 1)[0]) == stored
@@ -0,0 +1,227 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import re
+import bisect
+import threading
+
+from .paths_helper import PathsHelper
+from .catalog import Catalog
+from .storage import BackupStorage
+from .pack_store import PackStore
+from .retention import versions_of
+from . import compression
+
+
+DAY_PATTERN = re.compile(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}$')
+TIME_PATTERN = re.compile(r'^[0-9]{6}$')
+
+
+def list_days(basedir):
+    """Day folder names in the backup dir, newest first."""
+    try:
+        names = os.listdir(basedir)
+    except OSError:
+        return []
+    days = [name for name in names if DAY_PATTERN.match(name)]
+    days.sort(reverse=True)
+    return days
+
+
+def scan_day(basedir, day, source):
+    """Return (backups count, last time) of source in one day folder, by listing it."""
+    count = 0
+    last = ''
+    day_dir = os.path.join(basedir, day)
+
+    if PathsHelper.backup_per_time == 'folder':
+        try:
+            folders = os.listdir(day_dir)
+        except OSError:
+            folders = []
+        for folder in folders:
+            if TIME_PATTERN.match(folder) and BackupStorage.locate(os.path.join(day_dir, folder, source)) is not None:
+                count += 1
+                last = max(last, folder)
+    else:
+        (path, flname) = os.path.split(source)
+        (filepart, extpart) = os.path.splitext(flname)
+        pattern = re.compile(r'^' + re.escape(filepart) + r'_([0-9]{6})' + re.escape(extpart)
+                             + compression.SUFFIX_PATTERN + r'$')
+        try:
+            names = os.listdir(os.path.join(day_dir, path))
+        except OSError:
+            names = []
+        for name in names:
+            match = pattern.match(name)
+            if match is not None:
+                count += 1
+                last = max(last, match.group(1))
+
+    for (day, tm, path) in PackStore.versions(source, day):
+        count += 1
+        last = max(last, tm)
+    return (count, last)
+
+
+
+class History(object):
+    """Per source file day summaries for the backup history quick panel.
+
+    Summaries are cached as source -> {day: (count, last time)}. A day is
+    dropped from the cache when a backup of the source is written to it,
+    and the whole cache when backups are deleted. Missing days are filled
+    in newest first, from the catalog when it's enabled or by listing the
+    day folders otherwise.
+
+    For stepping through versions, every version of a source is kept as
+    source -> ([(day, time)], [stored path]), oldest first. A list is built
+    once and new backups are inserted into it, so a step is a bisection.
+    """
+    cache = {}
+    versions = {}
+    generation = 0
+    lock = threading.Lock()
+
+
+    @staticmethod
+    def invalidate(source=None, day=None):
+        with History.lock:
+            History.generation += 1
+            if source is None:
+                History.cache = {}
+                History.versions = {}
+            elif day is None:
+                History.cache.pop(source, None)
+                History.versions.pop(source, None)
+            elif source in History.cache:
+                History.cache[source].pop(day, None)
+
+
+    @staticmethod
+    def add_version(source, day, tm, path):
+        """A backup of source was written to path."""
+        History.invalidate(source, day)
+        with History.lock:
+            entry = History.versions.get(source)
+            if entry is None:
+                return
+            (keys, paths) = entry
+            index = bisect.bisect_left(keys, (day, tm))
+            if index < len(keys) and keys[index] == (day, tm):
+                # written again within the same second
+                paths[index] = path
+            else:
+                keys.insert(index, (day, tm))
+                paths.insert(index, path)
+
+
+    @staticmethod
+    def drop_version(source, path):
+        with History.lock:
+            entry = History.versions.get(source)
+            if entry is not None and path in entry[1]:
+                index = entry[1].index(path)
+                del entry[0][index]
+                del entry[1][index]
+
+
+    @staticmethod
+    def load(source, limit=0):
+        """Fill in the summaries of source, return (summaries, complete).
+
+        summaries is [(day, count, last time)] of the days that have backups,
+        newest first. With limit set, at most that many day folders are
+        listed, complete tells whether older days are still missing.
+        """
+        basedir = PathsHelper.get_base_dir(True)
+        days = list_days(basedir)
+
+        with History.lock:
+            generation = History.generation
+            cached = dict((day, summary) for (day, summary) in History.cache.get(source, {}).items() if day in days)
+        missing = [day for day in days if day not in cached]
+
+        if missing and Catalog.ready:
+            # a single indexed query answers every day at once
+            rows = dict((row[0], (row[1], row[2])) for row in Catalog.days(source))
+            for day in missing:
+                cached[day] = rows.get(day, (0, ''))
+            missing = []
+
+        summaries = []
+        complete = True
+        scanned = 0
+        for day in days:
+            if day not in cached:
+                if limit and scanned >= limit:
+                    complete = False
+                    break
+                cached[day] = scan_day(basedir, day, source)
+                scanned += 1
+            (count, last) = cached[day]
+            if count > 0:
+                summaries.append((day, count, last))
+
+        with History.lock:
+            # a backup written meanwhile may have made these stale, they are recounted next time
+            if History.generation == generation:
+                History.cache[source] = cached
+
+        return (summaries, complete)
+
+
+    @staticmethod
+    def load_versions(source):
+        """Return ([(day, time)], [stored path]) of every version of source, oldest first."""
+        with History.lock:
+            entry = History.versions.get(source)
+            generation = History.generation
+        if entry is not None:
+            return entry
+
+        if Catalog.ready:
+            found = [((day, tm), path) for (day, tm, path) in Catalog.versions(source)]
+        else:
+            basedir = PathsHelper.get_base_dir(True)
+            found = []
+            for day in list_days(basedir):
+                for path in versions_of(source, day):
+                    parsed = PathsHelper.parse_backup_path(os.path.relpath(path, basedir))
+                    if parsed is not None:
+                        found.append(((parsed[1], parsed[2]), path))
+        found.sort()
+        entry = ([key for (key, path) in found], [path for (key, path) in found])
+
+        with History.lock:
+            if History.generation == generation:
+                History.versions[source] = entry
+        return entry
+
+
+    @staticmethod
+    def neighbour(source, key, direction):
+        """Return (index, count, (day, time), path) of the version right before or after key.
+
+        direction is -1 for the older, 1 for the newer version. key None
+        stands for the file itself, newer than all of its versions. Returns
+        None when there is no version that way.
+        """
+        (keys, paths) = History.load_versions(source)
+        with History.lock:
+            if key is None:
+                index = len(keys) - 1 if direction < 0 else len(keys)
+            elif direction < 0:
+                index = bisect.bisect_left(keys, tuple(key)) - 1
+            else:
+                index = bisect.bisect_right(keys, tuple(key))
+            if index < 0 or index >= len(keys):
+                return None
+            return (index, len(keys), keys[index], paths[index])
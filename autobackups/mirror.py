@@ -0,0 +1,483 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import json
+import stat
+import shutil
+import errno
+import threading
+from collections import deque
+
+from .paths_helper import PathsHelper
+from .pack_store import PackStore, PACK_NAME, INDEX_NAME, replace_file
+from .hash_cache import stat_key
+from .snapshot import walk_files
+from .stats import Stats
+from . import copy_engine
+
+
+# kept in <mirror>/.autobackups/, like the plugin's own data
+MANIFEST_NAME = 'mirror.journal'
+
+# written by PackStore while a pack is rewritten, never worth copying
+PACK_TMP_NAMES = (PACK_NAME + '.tmp', INDEX_NAME + '.tmp')
+
+
+class MirrorRoot(threading.Thread):
+    """Copies the changed files of the backup tree to one mirror folder.
+
+    The manifest maps every mirrored file (relative to the backup dir) to
+    the size and mtime of the local file it was copied from. Updates are
+    appended to <root>/.autobackups/mirror.journal a batch at a time, so
+    reconciling is a walk of the local tree against that one file instead
+    of a walk of a possibly remote mirror.
+
+    Queued paths are synced to their local state: copied when they exist
+    and differ from the manifest, removed from the mirror when they are
+    gone. Packs and their indexes only grow between compactions, of those
+    only the bytes past the mirrored size are copied. A root that can't be written to is retried with a doubling delay,
+    its queue is kept meanwhile. The root folder itself is never created,
+    an unmounted drive must not fill up the mount point instead.
+    """
+    batch_delay = 2.0
+    batch_size = 200
+    first_retry_delay = 5
+    max_pending = 100000
+    # bytes before the mirrored end of a pack compared to tell an append from a rewrite
+    tail_check_size = 65536
+    chunk_size = 1024 * 1024
+
+    def __init__(self, root, base_dir, max_retry_delay=300):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.root = root
+        self.base_dir = base_dir
+        self.data_dir = os.path.join(base_dir, '.autobackups')
+        self.max_retry_delay = max(self.first_retry_delay, max_retry_delay)
+        self.journal_path = os.path.join(root, '.autobackups', MANIFEST_NAME)
+        self.manifest = None
+        self.journal_lines = 0
+        self.pending = deque()
+        self.queued = set()
+        self.needs_reconcile = True
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.retry_delay = 0
+        self.online = None
+
+
+    def enqueue(self, rel_paths):
+        with self.condition:
+            for rel in rel_paths:
+                if rel in self.queued:
+                    continue
+                if len(self.queued) >= self.max_pending:
+                    # the next reconcile finds whatever is dropped here
+                    self.needs_reconcile = True
+                    break
+                self.pending.append(rel)
+                self.queued.add(rel)
+            self.condition.notify_all()
+
+
+    def request_reconcile(self):
+        with self.condition:
+            self.needs_reconcile = True
+            self.condition.notify_all()
+
+
+    def stop(self):
+        self.stopped.set()
+        with self.condition:
+            self.condition.notify_all()
+
+
+    def wait(self, seconds):
+        """Sleep up to seconds, return True when the mirror was stopped meanwhile."""
+        self.stopped.wait(seconds)
+        return self.stopped.is_set()
+
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped.is_set() and not self.pending and not self.needs_reconcile:
+                    self.condition.wait()
+            # saves in quick succession end up in one batch
+            if self.wait(self.batch_delay):
+                return
+
+            try:
+                if not os.path.isdir(self.root):
+                    raise IOError(errno.ENOENT, 'folder not found')
+                if self.manifest is None:
+                    self.load_manifest()
+                if self.needs_reconcile:
+                    with Stats.timer('mirror.reconcile'):
+                        self.reconcile()
+                while self.pending and not self.stopped.is_set():
+                    with Stats.timer('mirror.batch'):
+                        self.sync_batch()
+            except (IOError, OSError) as e:
+                Stats.incr('mirror.errors')
+                self.retry_delay = min(self.max_retry_delay, self.retry_delay * 2 or self.first_retry_delay)
+                if self.online is not False:
+                    print('AutoBackups: mirror ' + self.root + ' is unavailable, ' + str(e)
+                          + ', retrying in the background')
+                self.online = False
+                # the mirror may come back as another drive, compare it again then
+                self.manifest = None
+                self.needs_reconcile = True
+                if self.wait(self.retry_delay):
+                    return
+                continue
+
+            if self.online is False:
+                print('AutoBackups: mirror ' + self.root + ' is available again')
+            self.online = True
+            self.retry_delay = 0
+
+
+    def load_manifest(self):
+        manifest = {}
+        lines = 0
+        try:
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # half written line from a crash
+                        continue
+                    if len(record) == 3:
+                        manifest[record[0]] = record[1:]
+                    elif len(record) == 1:
+                        self.forget(manifest, record[0])
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.manifest = manifest
+        self.journal_lines = lines
+
+
+    def forget(self, manifest, rel):
+        # "folder/" stands for a folder removed with everything below it
+        if not rel.endswith('/'):
+            manifest.pop(rel, None)
+            return
+        for key in [key for key in manifest if key.startswith(rel)]:
+            del manifest[key]
+
+
+    def write_journal(self, records):
+        if not records:
+            return
+        data_dir = os.path.dirname(self.journal_path)
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        with open(self.journal_path, 'a') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+        self.journal_lines += len(records)
+
+
+    def compact(self):
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for (rel, key) in self.manifest.items():
+                f.write(json.dumps([rel] + list(key)) + '\n')
+        replace_file(tmp_path, self.journal_path)
+        self.journal_lines = len(self.manifest)
+
+
+    def skip_dir(self, path):
+        return os.path.normpath(path) == self.data_dir
+
+
+    def reconcile(self):
+        """Queue every local file the manifest doesn't know in its current state.
+
+        Files the manifest lists but which are gone locally stay on the
+        mirror: a lost or replaced backup disk must not empty the mirror,
+        deletions are passed on as the cleanup makes them.
+        """
+        with self.condition:
+            self.needs_reconcile = False
+        if not os.path.isdir(self.base_dir):
+            return
+
+        changed = []
+        adopted = []
+        for (path, st) in walk_files(self.base_dir, self.skip_dir):
+            if os.path.basename(path) in PACK_TMP_NAMES:
+                continue
+            rel = os.path.relpath(path, self.base_dir).replace('\\', '/')
+            key = list(stat_key(st))
+            if self.manifest.get(rel) == key:
+                continue
+            if rel not in self.manifest and self.is_copy(rel, st):
+                # copied before the manifest existed, by hand or by an older journal
+                self.manifest[rel] = key
+                adopted.append([rel] + key)
+                continue
+            changed.append(rel)
+
+        self.write_journal(adopted)
+        if self.journal_lines > 2 * len(self.manifest) + 100:
+            self.compact()
+        if changed:
+            print('AutoBackups: mirror ' + self.root + ' is missing ' + str(len(changed)) + ' backup files')
+        self.enqueue(changed)
+
+
+    def is_copy(self, rel, st):
+        try:
+            target = os.stat(os.path.join(self.root, rel))
+        except OSError:
+            return False
+        # network and FAT drives keep mtimes at 1-2 second precision
+        return target.st_size == st.st_size and abs(target.st_mtime - st.st_mtime) <= 2
+
+
+    def sync_batch(self):
+        records = []
+        try:
+            for i in range(self.batch_size):
+                with self.condition:
+                    if not self.pending or self.stopped.is_set():
+                        break
+                    rel = self.pending.popleft()
+                    self.queued.discard(rel)
+                try:
+                    record = self.sync(rel)
+                except (IOError, OSError):
+                    with self.condition:
+                        if rel not in self.queued:
+                            self.pending.appendleft(rel)
+                            self.queued.add(rel)
+                    raise
+                if record is not None:
+                    records.append(record)
+        finally:
+            self.write_journal(records)
+
+
+    def sync(self, rel):
+        """Bring the mirror copy of rel up to date, return its journal record or None."""
+        source = os.path.join(self.base_dir, rel)
+        target = os.path.join(self.root, rel)
+        try:
+            st = os.stat(source)
+        except OSError:
+            st = None
+
+        if st is None:
+            if not os.path.isdir(self.base_dir) or (rel not in self.manifest and not os.path.lexists(target)):
+                # the backup disk is gone, or there is nothing to remove
+                return None
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+                rel += '/'
+            elif os.path.lexists(target):
+                os.remove(target)
+            self.remove_empty_dirs(target)
+            self.forget(self.manifest, rel)
+            Stats.incr('mirror.removed')
+            return [rel]
+
+        key = list(stat_key(st))
+        if not stat.S_ISREG(st.st_mode) or self.manifest.get(rel) == key:
+            return None
+
+        appended = None
+        if os.path.basename(rel) in (PACK_NAME, INDEX_NAME):
+            appended = self.append_tail(source, target, self.manifest.get(rel), st.st_size)
+        if appended is not None:
+            Stats.incr('mirror.appended')
+            Stats.incr('mirror.bytes', appended)
+        else:
+            self.copy(source, target)
+            Stats.incr('mirror.copied')
+            Stats.incr('mirror.bytes', st.st_size)
+        try:
+            if list(stat_key(os.stat(source))) != key:
+                # written to while it was copied (an open pack), copy it again
+                self.enqueue([rel])
+        except OSError:
+            pass
+        self.manifest[rel] = key
+        return [rel] + key
+
+
+    def copy(self, source, target):
+        folder = os.path.dirname(target)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+        # a copy cut short never replaces the previous one
+        tmp_path = target + '.mirror-tmp'
+        try:
+            copy_engine.copy_file(source, tmp_path)
+            shutil.copystat(source, tmp_path)
+            replace_file(tmp_path, target)
+        except Exception:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+    def append_tail(self, source, target, known, size):
+        """Append the bytes of source past the mirrored size known to target, up to size.
+
+        Return the number of bytes appended, None when target isn't the
+        mirrored copy of a prefix of source and has to be copied in full.
+        A cut short append leaves target longer than the manifest says, the
+        next sync copies it in full.
+        """
+        if known is None or not 0 < known[0] <= size:
+            return None
+        offset = known[0]
+        try:
+            if os.path.getsize(target) != offset:
+                return None
+        except OSError:
+            return None
+
+        check = min(offset, self.tail_check_size)
+        with open(source, 'rb') as src:
+            with open(target, 'r+b') as dst:
+                src.seek(offset - check)
+                dst.seek(offset - check)
+                if src.read(check) != dst.read(check):
+                    # rewritten by a compaction since
+                    return None
+                dst.seek(offset)
+                remaining = size - offset
+                while remaining > 0:
+                    chunk = src.read(min(remaining, self.chunk_size))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    remaining -= len(chunk)
+        shutil.copystat(source, target)
+        return size - offset - remaining
+
+
+    def remove_empty_dirs(self, target):
+        # drop the folders left empty, never the mirror root
+        folder = os.path.dirname(target)
+        while len(folder) > len(self.root) and folder.startswith(self.root):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                return
+            folder = os.path.dirname(folder)
+
+
+
+class Mirror(object):
+    """Replicates the backup tree to secondary folders (a NAS mount, a second disk).
+
+    Every backup is queued once it's written and copied by one background
+    thread per mirror, so a slow or missing mirror never holds up saving.
+    Mirrors have the layout of the backup dir, the restore tool reads them
+    directly. The plugin's own data folder is not mirrored, dedup blobs
+    arrive as plain copies of the backups linking them.
+    """
+    roots = []
+
+
+    @staticmethod
+    def initialize(roots, base_dir, max_retry_delay=300):
+        base_dir = os.path.normpath(base_dir)
+        wanted = []
+        for root in roots or []:
+            if not root:
+                continue
+            root = os.path.normpath(os.path.expanduser(root))
+            if (root + os.sep).startswith(base_dir + os.sep) or (base_dir + os.sep).startswith(root + os.sep):
+                print('AutoBackups: mirror ' + root + ' overlaps backup_dir, it is not used')
+                continue
+            wanted.append(root)
+
+        current = [(mirror.root, mirror.base_dir, mirror.max_retry_delay) for mirror in Mirror.roots]
+        if current == [(root, base_dir, max(MirrorRoot.first_retry_delay, max_retry_delay)) for root in wanted]:
+            # settings changed elsewhere, keep the queues
+            return
+
+        Mirror.stop()
+        mirrors = [MirrorRoot(root, base_dir, max_retry_delay) for root in wanted]
+        for mirror in mirrors:
+            mirror.start()
+        Mirror.roots = mirrors
+
+
+    @staticmethod
+    def stop():
+        """Stop the mirror threads, the next start reconciles what they didn't copy."""
+        mirrors = Mirror.roots
+        Mirror.roots = []
+        for mirror in mirrors:
+            mirror.stop()
+
+
+    @staticmethod
+    def relative(path):
+        """Paths below the backup dir which store the backup at path."""
+        base_dir = PathsHelper.get_base_dir(True)
+        rel = os.path.relpath(path, base_dir).replace('\\', '/')
+        if rel == '..' or rel.startswith('../'):
+            return []
+        split = PackStore.split(path)
+        if split is not None and not os.path.lexists(path) and os.path.isfile(os.path.join(split[0], INDEX_NAME)):
+            # a packed version, the pack goes before the index referencing it
+            day = rel.split('/', 1)[0]
+            return [rel, day + '/' + PACK_NAME, day + '/' + INDEX_NAME]
+        return [rel]
+
+
+    @staticmethod
+    def add(path):
+        """Queue the backup just written at path."""
+        Mirror.changed([path])
+
+
+    @staticmethod
+    def remove(paths):
+        """Queue backups (or folders of them) just deleted, the mirrors delete them too."""
+        Mirror.changed(paths)
+
+
+    @staticmethod
+    def changed(paths):
+        mirrors = Mirror.roots
+        if not mirrors or not paths:
+            return
+        rel_paths = []
+        for path in paths:
+            rel_paths.extend(Mirror.relative(path))
+        for mirror in mirrors:
+            mirror.enqueue(rel_paths)
+
+
+    @staticmethod
+    def reconcile():
+        """Compare the mirrors with the backup tree again, after changes made outside add() and remove()."""
+        for mirror in Mirror.roots:
+            mirror.request_reconcile()
+
+
+    @staticmethod
+    def status():
+        """Return [(root, online, files waiting)], online is None before the first attempt."""
+        return [(mirror.root, mirror.online, len(mirror.queued)) for mirror in Mirror.roots]
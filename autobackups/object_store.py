@@ -0,0 +1,147 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import hashlib
+import time
+from contextlib import closing
+
+from . import compression
+from . import copy_engine
+
+
+class ObjectStore(object):
+    """Content-addressed blob store shared by all deduplicated backups.
+
+    Blobs live in <objects_dir>/<2 hex chars>/<rest of the hash>[.gz|.bz2|.xz].
+    Backup paths are hardlinks to them, so identical contents are kept only once.
+    """
+    objects_dir = False
+    chunk_size = 1024 * 1024
+
+    # blobs younger than this are never swept, they may be about to be linked
+    sweep_grace_seconds = 3600
+
+
+    @staticmethod
+    def initialize(objects_dir):
+        ObjectStore.objects_dir = objects_dir
+
+
+    @staticmethod
+    def blob_path(digest, method=False):
+        return os.path.join(ObjectStore.objects_dir, digest[:2], digest[2:] + compression.suffix_for(method))
+
+
+    @staticmethod
+    def put_file(source, method=False, level=6):
+        """Copy source into the store while hashing it, return (blob_path, digest).
+
+        The digest is always taken over the uncompressed contents.
+        """
+        tmp_dir = os.path.join(ObjectStore.objects_dir, 'tmp')
+        if not os.path.isdir(tmp_dir):
+            try:
+                os.makedirs(tmp_dir)
+            except OSError:
+                # created by another thread meanwhile
+                if not os.path.isdir(tmp_dir):
+                    raise
+
+        tmp_path = os.path.join(tmp_dir, '%d.%d.%d' % (os.getpid(), id(source), time.time() * 1000000))
+        hasher = hashlib.sha1()
+        try:
+            with open(source, 'rb') as src:
+                with closing(compression.open_write(tmp_path, method, level)) as dst:
+                    while True:
+                        chunk = src.read(ObjectStore.chunk_size)
+                        if not chunk:
+                            break
+                        hasher.update(chunk)
+                        dst.write(chunk)
+        except Exception:
+            ObjectStore.remove_quietly(tmp_path)
+            raise
+
+        digest = hasher.hexdigest()
+        blob = ObjectStore.blob_path(digest, method)
+        if os.path.isfile(blob):
+            # same content already stored, keep the existing blob
+            ObjectStore.remove_quietly(tmp_path)
+            return (blob, digest)
+
+        blob_dir = os.path.dirname(blob)
+        if not os.path.isdir(blob_dir):
+            try:
+                os.makedirs(blob_dir)
+            except OSError:
+                if not os.path.isdir(blob_dir):
+                    raise
+        os.rename(tmp_path, blob)
+        return (blob, digest)
+
+
+    @staticmethod
+    def link(blob, dest):
+        """Make dest point at blob. Falls back to a plain copy where hardlinks are unavailable."""
+        dest_dir = os.path.dirname(dest)
+        if not os.path.isdir(dest_dir):
+            try:
+                os.makedirs(dest_dir)
+            except OSError:
+                if not os.path.isdir(dest_dir):
+                    raise
+
+        # never write through an existing link, it would change the shared blob
+        if os.path.lexists(dest):
+            os.remove(dest)
+
+        try:
+            os.link(blob, dest)
+        except (AttributeError, OSError):
+            try:
+                copy_engine.copy_file(blob, dest)
+            except Exception:
+                ObjectStore.remove_quietly(dest)
+                raise
+
+
+    @staticmethod
+    def sweep():
+        """Remove blobs no backup links to anymore. Returns (removed count, freed bytes)."""
+        removed = 0
+        freed = 0
+        if not ObjectStore.objects_dir or not os.path.isdir(ObjectStore.objects_dir):
+            return (removed, freed)
+
+        min_mtime = time.time() - ObjectStore.sweep_grace_seconds
+        for prefix in os.listdir(ObjectStore.objects_dir):
+            prefix_dir = os.path.join(ObjectStore.objects_dir, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                blob = os.path.join(prefix_dir, name)
+                try:
+                    st = os.stat(blob)
+                    if st.st_nlink > 1 or st.st_mtime > min_mtime:
+                        continue
+                    os.remove(blob)
+                    removed += 1
+                    freed += st.st_size
+                except OSError:
+                    pass
+        return (removed, freed)
+
+
+    @staticmethod
+    def remove_quietly(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
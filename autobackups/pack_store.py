@@ -0,0 +1,321 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import re
+import json
+import mmap
+import time
+import threading
+
+from .paths_helper import PathsHelper
+from . import compression
+
+
+PACK_NAME = 'versions.pack'
+INDEX_NAME = 'versions.pack.idx'
+
+DAY_PATTERN = re.compile(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}$')
+
+
+def is_pack_file(name):
+    return name in (PACK_NAME, INDEX_NAME, PACK_NAME + '.tmp', INDEX_NAME + '.tmp')
+
+
+def replace_file(tmp_path, path):
+    if os.path.lexists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+class PackStore(object):
+    """Stores the backups of a day appended to one <day>/versions.pack file.
+
+    Every version is a record in the pack, <day>/versions.pack.idx holds one
+    JSON line per record: {"p": path below the day folder, "o": offset,
+    "n": length, "c": compression method, "t": time written}, or {"p": path,
+    "d": 1} when a version was deleted. A backup keeps the path it would have
+    in the plain tree, so catalog, history and retention code works on it
+    unchanged. Dropping a day folder drops its pack, deleted versions leave
+    dead bytes behind until compact() rewrites the pack.
+    """
+    # day folder -> (index stat key, {path: record}, dead bytes)
+    indexes = {}
+    lock = threading.RLock()
+
+
+    @staticmethod
+    def split(path):
+        """Return (day folder, path below it) of a backup path, None when it's not below a day folder."""
+        base_dir = PathsHelper.get_base_dir(True)
+        rel = os.path.relpath(path, base_dir).replace('\\', '/')
+        parts = rel.split('/', 1)
+        if len(parts) < 2 or DAY_PATTERN.match(parts[0]) is None:
+            return None
+        return (os.path.join(base_dir, parts[0]), parts[1])
+
+
+    @staticmethod
+    def recover(day_dir):
+        # finish or roll back a compaction interrupted by a crash
+        pack = os.path.join(day_dir, PACK_NAME)
+        index = os.path.join(day_dir, INDEX_NAME)
+        if os.path.exists(pack + '.tmp') and os.path.exists(index + '.tmp'):
+            if os.path.exists(pack):
+                os.remove(pack + '.tmp')
+                os.remove(index + '.tmp')
+            else:
+                os.rename(pack + '.tmp', pack)
+                replace_file(index + '.tmp', index)
+        elif os.path.exists(index + '.tmp'):
+            replace_file(index + '.tmp', index)
+
+
+    @staticmethod
+    def load(day_dir):
+        """Return ({path: record}, dead bytes) of a day's pack, ({}, 0) without one."""
+        index = os.path.join(day_dir, INDEX_NAME)
+        with PackStore.lock:
+            try:
+                if os.path.exists(index + '.tmp'):
+                    PackStore.recover(day_dir)
+                st = os.stat(index)
+            except OSError:
+                PackStore.indexes.pop(day_dir, None)
+                return ({}, 0)
+
+            key = (st.st_size, st.st_mtime)
+            cached = PackStore.indexes.get(day_dir)
+            if cached is not None and cached[0] == key:
+                return (cached[1], cached[2])
+
+            records = {}
+            dead = 0
+            with open(index, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        path = record['p']
+                    except (ValueError, KeyError, TypeError):
+                        # a line cut short by a crash
+                        continue
+                    old = records.pop(path, None)
+                    if old is not None:
+                        dead += old['n']
+                    if not record.get('d'):
+                        records[path] = record
+            PackStore.indexes[day_dir] = (key, records, dead)
+            return (records, dead)
+
+
+    @staticmethod
+    def find(path):
+        """Return (day folder, name, record) of a packed backup, None when it isn't packed."""
+        split = PackStore.split(path)
+        if split is None or not os.path.isfile(os.path.join(split[0], INDEX_NAME)):
+            return None
+        record = PackStore.load(split[0])[0].get(split[1])
+        if record is None:
+            return None
+        return (split[0], split[1], record)
+
+
+    @staticmethod
+    def contains(path):
+        return PackStore.find(path) is not None
+
+
+    @staticmethod
+    def append(path, data, method=False, level=6):
+        """Store data as the version at backup path, in its day's pack."""
+        split = PackStore.split(path)
+        if split is None:
+            raise IOError('AutoBackups: ' + path + ' is not inside a day folder')
+        (day_dir, name) = split
+        blob = compression.compress(data, method, level)
+
+        with PackStore.lock:
+            if not os.path.isdir(day_dir):
+                os.makedirs(day_dir)
+            PackStore.load(day_dir)
+            with open(os.path.join(day_dir, PACK_NAME), 'ab') as f:
+                f.seek(0, 2)
+                offset = f.tell()
+                f.write(blob)
+            # the record is indexed once its bytes are in the pack
+            record = {'p': name, 'o': offset, 'n': len(blob), 'c': method or False, 't': round(time.time(), 3)}
+            PackStore.write_index_line(day_dir, record)
+
+
+    @staticmethod
+    def write_index_line(day_dir, record):
+        index = os.path.join(day_dir, INDEX_NAME)
+        with open(index, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+        # keep the loaded index current instead of parsing the file again
+        cached = PackStore.indexes.get(day_dir)
+        if cached is not None:
+            (key, records, dead) = cached
+            old = records.pop(record['p'], None)
+            if old is not None:
+                dead += old['n']
+            if not record.get('d'):
+                records[record['p']] = record
+            st = os.stat(index)
+            PackStore.indexes[day_dir] = ((st.st_size, st.st_mtime), records, dead)
+
+
+    @staticmethod
+    def read(path):
+        found = PackStore.find(path)
+        if found is None:
+            raise IOError('AutoBackups: ' + path + ' is not a packed backup')
+        (day_dir, name, record) = found
+        return compression.decompress(PackStore.read_record(day_dir, record), record.get('c'))
+
+
+    @staticmethod
+    def read_record(day_dir, record):
+        if record['n'] == 0:
+            return b''
+        with open(os.path.join(day_dir, PACK_NAME), 'rb') as f:
+            # slice the version out of the mapped pack, the rest of it is never read
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return mapped[record['o']:record['o'] + record['n']]
+            finally:
+                mapped.close()
+
+
+    @staticmethod
+    def stored_size(path):
+        found = PackStore.find(path)
+        if found is None:
+            raise OSError('AutoBackups: ' + path + ' is not a packed backup')
+        return found[2]['n']
+
+
+    @staticmethod
+    def remove(path):
+        """Mark a packed version deleted, return its stored size."""
+        with PackStore.lock:
+            found = PackStore.find(path)
+            if found is None:
+                return 0
+            (day_dir, name, record) = found
+            PackStore.write_index_line(day_dir, {'p': name, 'd': 1})
+            return record['n']
+
+
+    @staticmethod
+    def versions(source, day):
+        """Return [(day, time, path)] of the packed versions of source in one day, newest first."""
+        day_dir = os.path.join(PathsHelper.get_base_dir(True), day)
+        if not os.path.isfile(os.path.join(day_dir, INDEX_NAME)):
+            return []
+        versions = []
+        for name in PackStore.load(day_dir)[0]:
+            parsed = PathsHelper.parse_backup_path(day + '/' + name)
+            if parsed is not None and parsed[0] == source:
+                versions.append((day, parsed[2], os.path.normpath(os.path.join(day_dir, name))))
+        versions.sort(reverse=True)
+        return versions
+
+
+    @staticmethod
+    def entries(day_dir):
+        """Return [(path, stored size)] of every live version in a day's pack."""
+        return [(os.path.normpath(os.path.join(day_dir, name)), record['n'])
+                for (name, record) in PackStore.load(day_dir)[0].items()]
+
+
+    @staticmethod
+    def day_dirs():
+        base_dir = PathsHelper.get_base_dir(True)
+        try:
+            names = sorted(os.listdir(base_dir))
+        except OSError:
+            return []
+        return [os.path.join(base_dir, name) for name in names
+                if DAY_PATTERN.match(name) and os.path.isfile(os.path.join(base_dir, name, INDEX_NAME))]
+
+
+    @staticmethod
+    def compact(day_dir):
+        """Rewrite a day's pack without its dead records, return the bytes reclaimed."""
+        pack = os.path.join(day_dir, PACK_NAME)
+        index = os.path.join(day_dir, INDEX_NAME)
+        with PackStore.lock:
+            (records, dead) = PackStore.load(day_dir)
+            before = os.path.getsize(pack)
+
+            offset = 0
+            with open(pack + '.tmp', 'wb') as out:
+                with open(index + '.tmp', 'w') as out_index:
+                    for name in sorted(records, key=lambda name: records[name]['o']):
+                        record = dict(records[name])
+                        out.write(PackStore.read_record(day_dir, record))
+                        record['o'] = offset
+                        offset += record['n']
+                        out_index.write(json.dumps(record, sort_keys=True) + '\n')
+
+            # recover() completes these renames if they are interrupted
+            os.remove(pack)
+            os.rename(pack + '.tmp', pack)
+            replace_file(index + '.tmp', index)
+            PackStore.indexes.pop(day_dir, None)
+            return max(0, before - offset)
+
+
+    @staticmethod
+    def compact_all(min_dead_ratio=0.5):
+        """Compact the packs that are at least min_dead_ratio dead bytes, return (packs, bytes reclaimed)."""
+        packs = 0
+        freed = 0
+        for day_dir in PackStore.day_dirs():
+            try:
+                dead = PackStore.load(day_dir)[1]
+                size = os.path.getsize(os.path.join(day_dir, PACK_NAME))
+                if dead > 0 and dead >= size * min_dead_ratio:
+                    freed += PackStore.compact(day_dir)
+                    packs += 1
+            except (IOError, OSError) as e:
+                print('AutoBackups: could not compact ' + day_dir + ', ' + str(e))
+        return (packs, freed)
+
+
+    @staticmethod
+    def export(target_dir=None):
+        """Write every packed version as a plain file, return the number of files written.
+
+        Without target_dir the versions are unpacked in place, into the tree
+        layout they stand for, and the packs are removed afterwards.
+        """
+        written = 0
+        for day_dir in PackStore.day_dirs():
+            day = os.path.basename(day_dir)
+            out_dir = os.path.join(target_dir, day) if target_dir else day_dir
+            with PackStore.lock:
+                records = PackStore.load(day_dir)[0]
+                for (name, record) in records.items():
+                    dest = os.path.join(out_dir, name)
+                    if not os.path.isdir(os.path.dirname(dest)):
+                        os.makedirs(os.path.dirname(dest))
+                    with open(dest, 'wb') as f:
+                        f.write(compression.decompress(PackStore.read_record(day_dir, record), record.get('c')))
+                    if record.get('t'):
+                        os.utime(dest, (record['t'], record['t']))
+                    written += 1
+
+                if not target_dir:
+                    os.remove(os.path.join(day_dir, INDEX_NAME))
+                    os.remove(os.path.join(day_dir, PACK_NAME))
+                    PackStore.indexes.pop(day_dir, None)
+        return written
@@ -7,15 +7,21 @@
 # file that was distributed with this source code.
 ##
 
-import sublime
 import os
 import re
-import sys
 import datetime
 
+from . import compression
+
 
 backup_name_mode_text = 'auto-save'
 
+# folder below the backup dir holding snapshots of untitled buffers
+untitled_dir_name = 'untitled'
+
+# folder below the backup dir holding snapshots of unsaved changes to named files
+unsaved_dir_name = 'unsaved'
+
 class PathsHelper(object):
     platform = False
     backup_dir = False
@@ -65,6 +71,11 @@ class PathsHelper(object):
             backup_dir = backup_dir +'/'+ date
         return os.path.expanduser(backup_dir)
 
+    @staticmethod
+    def get_data_dir():
+        # Plugin's own data (object store, indexes) lives next to the day folders
+        return os.path.join(PathsHelper.get_base_dir(True), '.autobackups')
+
     @staticmethod
     def create_name_file(filename):
         (filepart, extensionpart) = os.path.splitext(filename)
@@ -121,6 +132,81 @@ class PathsHelper(object):
 
 
 
+    @staticmethod
+    def parse_backup_path(rel_path):
+        """Split a backup path relative to the base dir into (source, day, time).
+
+        source is the source path as built by normalise_path(path, True), day
+        and time are '' when the configured layout doesn't have them. Returns
+        None for paths that don't fit the configured layout.
+        """
+        parts = rel_path.replace('\\', '/').split('/')
+        day = ''
+        time = ''
+        if PathsHelper.backup_per_day:
+            if len(parts) < 2 or re.match(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}$', parts[0]) is None:
+                return None
+            day = parts.pop(0)
+            if PathsHelper.backup_per_time == 'folder':
+                if len(parts) < 2 or re.match(r'^[0-9]{6}$', parts[0]) is None:
+                    return None
+                time = parts.pop(0)
+
+        name = parts.pop()
+        stripped = compression.strip_suffix(name)
+        for candidate in (stripped, name) if stripped != name else (name, ):
+            parsed = PathsHelper.parse_backup_name(candidate)
+            if parsed is not None:
+                (name, name_time) = parsed
+                parts.append(name)
+                return ('/'.join(parts), day, name_time or time)
+        return None
+
+    @staticmethod
+    def parse_backup_name(name):
+        # reverse of create_name_file, returns (original name, time)
+        mode = PathsHelper.backup_name_mode
+        mode = mode.lower() if mode not in (False, None, ) else ''
+
+        if mode == 'prefix':
+            if not name.startswith(backup_name_mode_text + '.'):
+                return None
+            name = name[len(backup_name_mode_text) + 1:]
+
+        (filepart, extensionpart) = os.path.splitext(name)
+        if mode == 'suffix':
+            if name.endswith('.' + backup_name_mode_text):
+                # a file without extension, the marker became its extension
+                (filepart, extensionpart) = (name[:-len(backup_name_mode_text) - 1], '')
+            elif filepart.endswith('.' + backup_name_mode_text):
+                filepart = filepart[:-len(backup_name_mode_text) - 1]
+            else:
+                return None
+
+        time = ''
+        if PathsHelper.backup_per_day and PathsHelper.backup_per_time == 'file':
+            match = re.match(r'^(.*)_([0-9]{6})$', filepart)
+            if match is None:
+                return None
+            (filepart, time) = match.groups()
+
+        return ('%s%s' % (filepart, extensionpart, ), time)
+
+    @staticmethod
+    def get_untitled_filepath(buffer_id, name):
+        """Snapshot path of an untitled buffer, in its own area of the backup dir."""
+        now = datetime.datetime.now()
+        name = re.sub(r'[^\w\- ]+', '', name or '').strip()[:40] or 'untitled'
+        return os.path.join(PathsHelper.get_base_dir(True), untitled_dir_name, now.strftime('%Y-%m-%d'),
+                            '%d-%s_%s.txt' % (buffer_id, name, now.strftime('%H%M%S')))
+
+    @staticmethod
+    def get_unsaved_filepath(filepath):
+        """Snapshot path of the unsaved changes to filepath, kept apart from its backups."""
+        now = datetime.datetime.now()
+        return os.path.join(PathsHelper.get_base_dir(True), unsaved_dir_name, now.strftime('%Y-%m-%d'),
+                            now.strftime('%H%M%S'), PathsHelper.normalise_path(filepath))
+
     @staticmethod
     def get_backup_filepath(filepath):
         filename = os.path.split(filepath)[1]
@@ -23,7 +23,28 @@ mod_prefix = 'AutoBackups.autobackups'
 mods_load_order = [
     '',
 
-    '.paths_helper'
+    '.compression',
+    '.copy_engine',
+    '.stats',
+    '.paths_helper',
+    '.object_store',
+    '.pack_store',
+    '.diff',
+    '.delta',
+    '.catalog',
+    '.storage',
+    '.version_cache',
+    '.hash_cache',
+    '.hashing',
+    '.search_index',
+    '.snapshot',
+    '.mirror',
+    '.retention',
+    '.history',
+    '.gc_engine',
+    '.settings_snapshot',
+    '.scrubber',
+    '.writer'
 ]
 
 for suffix in mods_load_order:
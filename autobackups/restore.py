@@ -0,0 +1,421 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+"""Point-in-time restore of a backup directory, without Sublime Text.
+
+Picks the newest backup of every file at or before the given time and
+writes them into a directory, or a tar archive ("-" streams it to stdout).
+Run it from the AutoBackups package folder:
+
+    python -m autobackups.restore ~/.sublime/backups --at "2024-05-01 14:30" \\
+        --source /home/me/project --target /tmp/project
+    python -m autobackups.restore /mnt/copy/backups --source C:/work --tar work.tar.gz
+
+Backups don't record deletions, a file deleted before that time is
+restored as it was last backed up.
+"""
+
+import os
+import re
+import sys
+import time
+import tarfile
+import argparse
+import datetime
+import threading
+
+try:
+    import queue
+except (ImportError):
+    # Python 2
+    import Queue as queue
+
+from .paths_helper import PathsHelper, backup_name_mode_text, untitled_dir_name, unsaved_dir_name
+from .storage import BackupStorage
+from .pack_store import PackStore, is_pack_file
+from .history import list_days, TIME_PATTERN
+from . import compression
+from . import copy_engine
+
+
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d']
+FILE_TIME_PATTERN = re.compile(r'_[0-9]{6}(\.[^./\\]*)?$')
+
+
+def parse_time(text):
+    """Timestamp of "YYYY-MM-DD[ HH:MM[:SS]]", a bare day means its end."""
+    for time_format in TIME_FORMATS:
+        try:
+            moment = datetime.datetime.strptime(text, time_format)
+        except ValueError:
+            continue
+        if time_format == '%Y-%m-%d':
+            moment = moment.replace(hour=23, minute=59, second=59)
+        return time.mktime(moment.timetuple())
+    raise ValueError('unknown time format "%s", use YYYY-MM-DD[ HH:MM[:SS]]' % text)
+
+
+def source_prefix(path):
+    """A source path as stored in the backup tree: '/' separators, no leading '/', C: as C."""
+    path = path.replace('\\', '/')
+    path = re.sub(r'^//([\w\-]{2,})', r'network/\1', path)
+    path = re.sub(r'^(\w):', r'\1', path)
+    return path.strip('/')
+
+
+def strip_name_mode(name, name_mode):
+    """name without the backup_name_mode marker, as create_name_file added it."""
+    if name_mode == 'prefix':
+        return name[len(backup_name_mode_text) + 1:]
+    if name_mode == 'suffix':
+        marker = '.' + backup_name_mode_text
+        if name.endswith(marker):
+            # a file without extension
+            return name[:-len(marker)]
+        (filepart, extensionpart) = os.path.splitext(name)
+        if filepart.endswith(marker):
+            return filepart[:-len(marker)] + extensionpart
+    return name
+
+
+def detect_layout(base_dir):
+    """Guess (backup_per_day, backup_per_time, backup_name_mode) from a backup tree."""
+    days = list_days(base_dir)
+    per_time = False
+    names = []
+    for day in days[:3]:
+        day_dir = os.path.join(base_dir, day)
+        # packed versions keep their time folder in their name
+        packed = list(PackStore.load(day_dir)[0])
+        if any(TIME_PATTERN.match(name) for name in os.listdir(day_dir) + [name.split('/')[0] for name in packed]):
+            per_time = 'folder'
+        for (root, dirs, files) in os.walk(day_dir):
+            names.extend(compression.strip_suffix(name) for name in files if not is_pack_file(name))
+            if len(names) >= 50:
+                break
+        names.extend(os.path.basename(name) for name in packed[:50])
+
+    if not days:
+        for (root, dirs, files) in os.walk(base_dir):
+            names.extend(compression.strip_suffix(name) for name in files)
+            if len(names) >= 50:
+                break
+
+    # the name mode goes first, the time of "file" layouts sits inside its marker
+    name_mode = False
+    if names and all(name.startswith(backup_name_mode_text + '.') for name in names):
+        name_mode = 'prefix'
+    elif names and all(strip_name_mode(name, 'suffix') != name for name in names):
+        name_mode = 'suffix'
+
+    if (days and per_time != 'folder' and names
+            and all(FILE_TIME_PATTERN.search(strip_name_mode(name, name_mode)) for name in names)):
+        per_time = 'file'
+    return (bool(days), per_time, name_mode)
+
+
+def walk_backups(top):
+    for (root, dirs, files) in os.walk(top):
+        for name in files:
+            if not is_pack_file(name):
+                yield os.path.join(root, name)
+
+
+def select_versions(base_dir, prefix, at):
+    """Return {source: (timestamp, stored path)} of the newest backups at or before at.
+
+    Only the day and time folders up to at are walked, and inside them only
+    the folder of prefix.
+    """
+    moment = datetime.datetime.fromtimestamp(at)
+    at_key = (moment.strftime('%Y-%m-%d'), moment.strftime('%H%M%S'))
+    prefix_dir = os.path.join(*prefix.split('/')) if prefix else ''
+    # source -> ((day, time), path), days and times compare as strings
+    newest = {}
+
+    def consider(path):
+        parsed = PathsHelper.parse_backup_path(path[len(base_dir) + 1:])
+        if parsed is None:
+            return
+        (source, day, tm) = parsed
+        if prefix and source != prefix and not source.startswith(prefix + '/'):
+            return
+        if day:
+            key = (day, tm or '000000')
+        else:
+            # without day folders only the file time tells when it was written
+            try:
+                mtime = datetime.datetime.fromtimestamp(os.path.getmtime(path))
+            except OSError:
+                return
+            key = (mtime.strftime('%Y-%m-%d'), mtime.strftime('%H%M%S'))
+        if key <= at_key and key >= newest.get(source, (('', ''), None))[0]:
+            newest[source] = (key, path)
+
+    if not PathsHelper.backup_per_day:
+        top = os.path.join(base_dir, prefix_dir)
+        for path in walk_backups(top):
+            rel = os.path.relpath(path, base_dir).replace('\\', '/')
+            if rel.split('/', 1)[0] not in ('.autobackups', untitled_dir_name, unsaved_dir_name):
+                consider(path)
+    else:
+        for day in sorted(list_days(base_dir)):
+            if day > at_key[0]:
+                break
+            day_dir = os.path.join(base_dir, day)
+            if PathsHelper.backup_per_time == 'folder':
+                tops = [os.path.join(day_dir, name, prefix_dir) for name in os.listdir(day_dir)
+                        if TIME_PATTERN.match(name) and (day, name) <= at_key]
+            else:
+                tops = [os.path.join(day_dir, prefix_dir)]
+            for top in tops:
+                for path in walk_backups(top):
+                    consider(path)
+            for (path, size) in PackStore.entries(day_dir):
+                consider(path)
+
+    chosen = {}
+    for (source, (key, path)) in newest.items():
+        stamp = time.mktime(datetime.datetime.strptime(key[0] + key[1], '%Y-%m-%d%H%M%S').timetuple())
+        chosen[source] = (stamp, path)
+    return chosen
+
+
+def target_name(source, prefix):
+    """Path of a restored file below the target, relative to prefix."""
+    rel = source[len(prefix):].lstrip('/') if prefix else source
+    return '/'.join(part for part in rel.split('/') if part not in ('', '.', '..'))
+
+
+def is_plain(path):
+    return os.path.isfile(path) and not compression.get_suffix(path) and not BackupStorage.is_delta_file(path)
+
+
+
+class Restorer(object):
+    """Writes the selected versions through a bounded pool of reader threads.
+
+    Into a directory every worker writes its own files, plain backups are
+    copied with copy_engine. Into a tar the workers only read, the calling
+    thread adds the members one by one.
+    """
+    progress_interval = 1.0
+
+    def __init__(self, workers=8, progress=None):
+        self.workers = max(1, workers)
+        self.progress = progress
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.started = time.time()
+        self.reported = self.started
+        self.lock = threading.Lock()
+
+
+    def summary(self):
+        elapsed = max(time.time() - self.started, 0.001)
+        return '%d files, %.1f MB, %d errors in %.1fs (%.0f files/s)' % (
+            self.files, self.bytes / 1048576.0, self.errors, elapsed, self.files / elapsed)
+
+
+    def report(self, force=False):
+        now = time.time()
+        if self.progress is not None and (force or now - self.reported >= self.progress_interval):
+            self.reported = now
+            self.progress(self)
+
+
+    def done(self, size):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+
+
+    def failed(self, path, error):
+        sys.stderr.write('could not restore ' + path + ', ' + str(error) + '\n')
+        with self.lock:
+            self.errors += 1
+
+
+    def restore_file(self, name, stamp, path, target_dir):
+        dest = os.path.join(target_dir, *name.split('/'))
+        dest_dir = os.path.dirname(dest)
+        if not os.path.isdir(dest_dir):
+            try:
+                os.makedirs(dest_dir)
+            except OSError:
+                if not os.path.isdir(dest_dir):
+                    raise
+        if is_plain(path):
+            copy_engine.copy_file(path, dest)
+            size = os.path.getsize(dest)
+        else:
+            data = BackupStorage.read(path)
+            with open(dest, 'wb') as f:
+                f.write(data)
+            size = len(data)
+        os.utime(dest, (stamp, stamp))
+        return size
+
+
+    def run_pool(self, jobs, handle):
+        tasks = queue.Queue(self.workers * 16)
+
+        def worker():
+            while True:
+                job = tasks.get()
+                if job is None:
+                    return
+                try:
+                    handle(job)
+                except (IOError, OSError, EOFError, ValueError) as e:
+                    self.failed(job[2], e)
+
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        try:
+            for job in jobs:
+                tasks.put(job)
+                self.report()
+        finally:
+            for thread in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+        self.report(True)
+
+
+    def to_directory(self, jobs, target_dir):
+        """Restore (name, timestamp, stored path) jobs below target_dir."""
+        def handle(job):
+            self.done(self.restore_file(job[0], job[1], job[2], target_dir))
+        self.run_pool(jobs, handle)
+
+
+    def to_tar(self, jobs, tar):
+        """Add (name, timestamp, stored path) jobs to the open tarfile tar."""
+        results = queue.Queue(self.workers * 4)
+        finished = object()
+
+        def handle(job):
+            results.put((job[0], job[1], BackupStorage.read(job[2])))
+
+        def produce():
+            try:
+                self.run_pool(jobs, handle)
+            finally:
+                results.put(finished)
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+
+        while True:
+            result = results.get()
+            if result is finished:
+                break
+            (name, stamp, data) = result
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(stamp)
+            info.mode = 0o644
+            tar.addfile(info, BytesReader(data))
+            self.done(len(data))
+        producer.join()
+
+
+
+class BytesReader(object):
+    # minimal file object for tarfile.addfile, avoids copying data into a BytesIO
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.data) - self.offset
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Restore files from an AutoBackups backup directory as of a given time.')
+    parser.add_argument('backup_dir', help='the backup directory (backup_dir setting), or a copy of it')
+    parser.add_argument('--at', help='restore the state at this time, YYYY-MM-DD[ HH:MM[:SS]], now by default')
+    parser.add_argument('--source', default='', help='only files below this original path, e.g. /home/me/project or C:/work')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--target', help='directory to restore into')
+    output.add_argument('--tar', help='tar archive to write, .tar.gz/.tgz/.tar.bz2 are compressed, "-" writes to stdout')
+    output.add_argument('--list', action='store_true', help='only print the versions that would be restored')
+    parser.add_argument('--workers', type=int, default=8, help='parallel readers (default 8)')
+    parser.add_argument('--per-time', choices=['auto', 'none', 'file', 'folder'], default='auto',
+                        help='backup_per_time of the backups, detected by default')
+    parser.add_argument('--name-mode', choices=['auto', 'none', 'prefix', 'suffix'], default='auto',
+                        help='backup_name_mode of the backups, detected by default')
+    args = parser.parse_args(argv)
+
+    base_dir = os.path.abspath(os.path.expanduser(args.backup_dir))
+    if not os.path.isdir(base_dir):
+        parser.error(base_dir + ' is not a directory')
+    try:
+        at = parse_time(args.at) if args.at else time.time()
+    except ValueError as e:
+        parser.error(str(e))
+
+    (per_day, per_time, name_mode) = detect_layout(base_dir)
+    if args.per_time != 'auto':
+        per_time = False if args.per_time == 'none' else args.per_time
+    if args.name_mode != 'auto':
+        name_mode = False if args.name_mode == 'none' else args.name_mode
+    PathsHelper.initialize('Windows' if os.name == 'nt' else 'Linux', base_dir, per_day, per_time, name_mode)
+
+    started = time.time()
+    prefix = source_prefix(args.source)
+    chosen = select_versions(base_dir, prefix, at)
+    jobs = sorted((target_name(source, prefix), stamp, path) for (source, (stamp, path)) in chosen.items())
+    jobs = [job for job in jobs if job[0]]
+    sys.stderr.write('%d files selected in %.1fs\n' % (len(jobs), time.time() - started))
+
+    if args.list:
+        for (name, stamp, path) in jobs:
+            sys.stdout.write('%s\t%s\t%s\n' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp)), name, path))
+        return 0
+
+    def progress(restorer):
+        sys.stderr.write('\r' + restorer.summary())
+        sys.stderr.flush()
+
+    restorer = Restorer(args.workers, progress)
+    if args.target:
+        restorer.to_directory(jobs, os.path.abspath(os.path.expanduser(args.target)))
+    else:
+        name = args.tar
+        method = 'gz' if name.endswith(('.gz', '.tgz')) else 'bz2' if name.endswith('.bz2') else ''
+        if name == '-':
+            stream = getattr(sys.stdout, 'buffer', sys.stdout)
+            tar = tarfile.open(fileobj=stream, mode='w|' + method)
+        else:
+            tar = tarfile.open(name, 'w:' + method if method else 'w')
+        try:
+            restorer.to_tar(jobs, tar)
+        finally:
+            tar.close()
+
+    sys.stderr.write('\n')
+    return 1 if restorer.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import json
+import time
+
+from .paths_helper import PathsHelper
+from .catalog import Catalog
+from .storage import BackupStorage
+from .pack_store import PackStore
+from .search_index import SearchIndex
+from .mirror import Mirror
+
+
+def list_backups():
+    """Return [(timestamp, path, source, day, size)] of every backup, oldest first.
+
+    Uses the catalog when it's complete and walks the backup tree otherwise.
+    """
+    if Catalog.ready:
+        rows = Catalog.all()
+    else:
+        rows = Catalog.scan()
+    backups = [(row[4], Catalog.absolute(row[0]), row[1], row[2], row[5]) for row in rows]
+    backups.sort()
+    return backups
+
+
+def plan_quota(backups, max_bytes=0, max_versions=0):
+    """Pick the backups to delete so every source keeps at most max_versions
+    versions and all backups together take at most max_bytes.
+
+    backups is the list_backups() result, the plan is returned oldest first.
+    Sizes are apparent sizes, deduplicated backups are counted once per link.
+    """
+    doomed = set()
+
+    if max_versions > 0:
+        by_source = {}
+        for backup in backups:
+            by_source.setdefault(backup[2], []).append(backup)
+        for versions in by_source.values():
+            # backups are sorted oldest first
+            for backup in versions[:-max_versions]:
+                doomed.add(backup[1])
+
+    if max_bytes > 0:
+        total = sum(backup[4] for backup in backups if backup[1] not in doomed)
+        for backup in backups:
+            if total <= max_bytes:
+                break
+            if backup[1] not in doomed:
+                doomed.add(backup[1])
+                total -= backup[4]
+
+    return [backup for backup in backups if backup[1] in doomed]
+
+
+def plan_thinning(backups, now, keep_all_hours=24, hourly_days=7, daily_weeks=4):
+    """Pick the per-time backups to delete so each source keeps every version
+    of the last keep_all_hours, one per hour up to hourly_days, one per day up
+    to daily_weeks and one per week after that.
+
+    The newest version of each hour/day/week is the one kept. backups is the
+    list_backups() result, the plan is returned oldest first.
+    """
+    keep_all = keep_all_hours * 3600
+    hourly = max(keep_all, hourly_days * 24 * 3600)
+    daily = max(hourly, daily_weeks * 7 * 24 * 3600)
+
+    doomed = []
+    seen = set()
+    # newest first, so the first version met in a bucket is the one kept
+    for backup in reversed(backups):
+        (stamp, path, source, day, size) = backup
+        age = now - stamp
+        if age < keep_all:
+            continue
+
+        local = time.localtime(stamp)
+        if age < hourly:
+            bucket = time.strftime('%Y-%m-%d %H', local)
+        elif age < daily:
+            bucket = time.strftime('%Y-%m-%d', local)
+        else:
+            bucket = time.strftime('%Y week %W', local)
+
+        key = (source, bucket)
+        if key in seen:
+            doomed.append(backup)
+        else:
+            seen.add(key)
+
+    doomed.reverse()
+    return doomed
+
+
+def versions_of(source, day):
+    """Stored paths of every version of source in one day folder."""
+    if Catalog.ready:
+        return [path for (d, tm, path) in Catalog.versions(source, day)]
+
+    base_dir = PathsHelper.get_base_dir(True)
+    day_dir = os.path.join(base_dir, day)
+    paths = []
+    if not day or not os.path.isdir(day_dir):
+        return paths
+
+    paths.extend(path for (d, tm, path) in PackStore.versions(source, day))
+
+    if PathsHelper.backup_per_time == 'folder':
+        for folder in os.listdir(day_dir):
+            path = BackupStorage.locate(os.path.join(day_dir, folder, source))
+            if path is not None:
+                paths.append(path)
+    else:
+        folder = os.path.join(day_dir, os.path.dirname(source))
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                parsed = PathsHelper.parse_backup_path(Catalog.relative(path))
+                if parsed is not None and parsed[0] == source:
+                    paths.append(path)
+    return paths
+
+
+def remove_empty_dirs(path, stop_dir):
+    # remove now empty parent folders, up to the backup base dir
+    folder = os.path.dirname(path)
+    stop_dir = os.path.normpath(stop_dir)
+    while len(folder) > len(stop_dir) and folder.startswith(stop_dir):
+        try:
+            os.rmdir(folder)
+        except OSError:
+            return
+        folder = os.path.dirname(folder)
+
+
+
+class Pruner(object):
+    """Deletes planned backups oldest first, at a limited rate.
+
+    The plan is saved to <data_dir>/prune.plan together with the number of
+    entries already handled, so a pruning interrupted by a restart continues
+    where it stopped on the next GC run.
+    """
+    checkpoint_every = 50
+
+    def __init__(self, data_dir, files_per_second=0, bytes_per_second=0):
+        self.plan_path = os.path.join(data_dir, 'prune.plan')
+        self.files_per_second = files_per_second or 0
+        self.bytes_per_second = bytes_per_second or 0
+        self.deleted = 0
+        self.freed = 0
+        self.errors = 0
+
+
+    def has_pending(self):
+        return os.path.isfile(self.plan_path)
+
+
+    def save_plan(self, entries, done):
+        data_dir = os.path.dirname(self.plan_path)
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        tmp_path = self.plan_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'entries': entries, 'done': done}, f)
+        if os.path.exists(self.plan_path):
+            os.remove(self.plan_path)
+        os.rename(tmp_path, self.plan_path)
+
+
+    def load_plan(self):
+        try:
+            with open(self.plan_path, 'r') as f:
+                plan = json.load(f)
+            return (plan['entries'], plan['done'])
+        except (IOError, OSError, ValueError, KeyError):
+            return ([], 0)
+
+
+    def start(self, backups):
+        """Prune the backups of a plan_quota() / plan_thinning() result."""
+        entries = [[backup[1], backup[2], backup[3]] for backup in backups]
+        if entries:
+            self.save_plan(entries, 0)
+            self.resume()
+
+
+    def resume(self):
+        (entries, done) = self.load_plan()
+        started = time.time()
+        base_dir = PathsHelper.get_base_dir(True)
+        siblings = {}
+        removed = []
+
+        for index in range(done, len(entries)):
+            (path, source, day) = entries[index]
+
+            # deltas based on this backup are rebased by BackupStorage.delete
+            key = (source, day)
+            if key not in siblings:
+                siblings[key] = versions_of(source, day)
+            others = siblings[key]
+            if path in others:
+                others.remove(path)
+
+            try:
+                size = BackupStorage.delete(path, others)
+                if size or not os.path.exists(path):
+                    self.deleted += 1
+                    self.freed += size
+                    removed.append(path)
+                    remove_empty_dirs(path, base_dir)
+            except Exception as e:
+                self.errors += 1
+                print('AutoBackups: could not delete ' + path + ', ' + str(e))
+
+            if (index + 1) % self.checkpoint_every == 0:
+                Catalog.remove(removed)
+                SearchIndex.remove(removed)
+                Mirror.remove(removed)
+                removed = []
+                self.save_plan(entries, index + 1)
+
+            self.throttle(started)
+
+        Catalog.remove(removed)
+        SearchIndex.remove(removed)
+        Mirror.remove(removed)
+        try:
+            os.remove(self.plan_path)
+        except OSError:
+            pass
+        return (self.deleted, self.freed)
+
+
+    def throttle(self, started):
+        wait = 0
+        if self.files_per_second > 0:
+            wait = max(wait, float(self.deleted + self.errors) / self.files_per_second)
+        if self.bytes_per_second > 0:
+            wait = max(wait, float(self.freed) / self.bytes_per_second)
+        wait -= time.time() - started
+        if wait > 0:
+            time.sleep(wait)
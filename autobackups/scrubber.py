@@ -0,0 +1,92 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import time
+import threading
+
+from .catalog import Catalog
+from .storage import BackupStorage
+from .stats import Stats
+from . import hashing
+
+
+class Scrubber(threading.Thread):
+    """Re-reads stored backups and compares them with the checksum taken when they were written.
+
+    Backups are verified least recently checked first, a batch at a time,
+    reading at most max_bytes_per_second. The verified time in the catalog
+    is the checkpoint, so the next session continues where this one
+    stopped. Backups checked within the last interval seconds are skipped.
+    report(path, status) is called for every backup found missing,
+    unreadable or corrupt.
+    """
+    batch_size = 50
+    idle_seconds = 600
+
+    def __init__(self, report, max_bytes_per_second=1048576, interval=7 * 86400, start_delay=60):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.report = report
+        self.max_bytes_per_second = max_bytes_per_second
+        self.interval = interval
+        self.start_delay = start_delay
+        self.stopped = threading.Event()
+
+
+    def stop(self):
+        self.stopped.set()
+
+
+    def wait(self, seconds):
+        """Sleep up to seconds, return True when the scrubber was stopped meanwhile."""
+        self.stopped.wait(seconds)
+        return self.stopped.is_set()
+
+
+    def run(self):
+        if self.wait(self.start_delay):
+            return
+        started = time.time()
+        while not self.stopped.is_set():
+            # nothing verified during this pass is due again before the next one
+            batch = Catalog.due_checksums(min(time.time() - self.interval, started), self.batch_size)
+            if not batch:
+                if self.wait(self.idle_seconds):
+                    return
+                started = time.time()
+                continue
+            for (path, checksum) in batch:
+                if self.stopped.is_set():
+                    return
+                self.verify(path, checksum)
+
+
+    def verify(self, path, checksum):
+        started = time.time()
+        size = 0
+        if BackupStorage.locate(path) is None:
+            status = 'missing'
+        else:
+            try:
+                data = BackupStorage.read(path)
+                size = len(data)
+                status = 'ok' if hashing.verify_checksum(data, checksum) else 'corrupt'
+            except Exception:
+                # truncated compressed streams, broken deltas...
+                status = 'unreadable'
+
+        Catalog.mark_verified(path, status)
+        Stats.incr('scrub.verified')
+        Stats.incr('scrub.bytes', size)
+        if status != 'ok':
+            Stats.incr('scrub.problems')
+            self.report(path, status)
+
+        if self.max_bytes_per_second > 0:
+            self.wait(float(size) / self.max_bytes_per_second - (time.time() - started))
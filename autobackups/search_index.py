@@ -0,0 +1,318 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import re
+import threading
+
+try:
+    import sqlite3
+except (ImportError):
+    # no index then, searching is disabled
+    sqlite3 = None
+
+from .paths_helper import PathsHelper
+from .version_cache import decode
+from . import hashing
+
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS contents (
+        id INTEGER PRIMARY KEY,
+        hash TEXT UNIQUE NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS versions (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        source TEXT NOT NULL,
+        day TEXT NOT NULL,
+        time TEXT NOT NULL,
+        content INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS postings (
+        token TEXT NOT NULL,
+        content INTEGER NOT NULL,
+        line INTEGER NOT NULL,
+        PRIMARY KEY (token, content)
+    )""",
+    "CREATE INDEX IF NOT EXISTS postings_content ON postings (content)",
+    "CREATE INDEX IF NOT EXISTS versions_day ON versions (day)",
+    "CREATE INDEX IF NOT EXISTS versions_content ON versions (content)",
+]
+
+TOKEN_PATTERN = re.compile(r'\w{2,64}', re.UNICODE)
+# query words, a trailing * matches every word starting with it
+QUERY_PATTERN = re.compile(r'\w{2,64}\*?', re.UNICODE)
+
+# most versions a query returns
+MAX_RESULTS = 500
+
+# most words a prefix query expands to
+MAX_PREFIX_WORDS = 100
+
+
+def tokenize(text):
+    """Return {token: first line number} of text, tokens are lowercased words."""
+    tokens = {}
+    for (number, line) in enumerate(text.split('\n')):
+        for token in TOKEN_PATTERN.findall(line.lower()):
+            if token not in tokens:
+                tokens[token] = number + 1
+    return tokens
+
+
+def find_line(text, query):
+    """Line number of the first line containing query, ignoring case, 0 when none does."""
+    query = query.lower()
+    for (number, line) in enumerate(text.split('\n')):
+        if query in line.lower():
+            return number + 1
+    return 0
+
+
+
+class SearchIndex(object):
+    """Inverted index of backup contents, stored in <data_dir>/search.sqlite.
+
+    Every distinct content is a row in contents, keyed by its hash, and
+    postings maps each word of it to the line the word first appears on.
+    Every backup version is a row in versions pointing at its content, so
+    a file saved again unchanged, or restored to an older state, costs one
+    row. Versions are indexed as they are written and dropped with the
+    backups, so a query is a few indexed lookups instead of reading the
+    backup tree.
+    """
+    enabled = False
+    db_path = False
+    connection = None
+    lock = threading.Lock()
+
+
+    @staticmethod
+    def initialize(data_dir, enabled=True):
+        """Open the index, return True when it was just created."""
+        SearchIndex.close()
+        SearchIndex.enabled = False
+        if not enabled or sqlite3 is None:
+            return False
+
+        SearchIndex.db_path = os.path.join(data_dir, 'search.sqlite')
+        is_new = not os.path.isfile(SearchIndex.db_path)
+        try:
+            if not os.path.isdir(data_dir):
+                os.makedirs(data_dir)
+            connection = sqlite3.connect(SearchIndex.db_path, check_same_thread=False)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(versions)')]
+            if columns and 'content' not in columns:
+                # postings per version from an older version of the plugin, start over
+                connection.execute('DROP TABLE IF EXISTS postings')
+                connection.execute('DROP TABLE versions')
+                is_new = True
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+        except Exception as e:
+            print('AutoBackups: search index disabled, ' + str(e))
+            return False
+
+        SearchIndex.connection = connection
+        SearchIndex.enabled = True
+        return is_new
+
+
+    @staticmethod
+    def close():
+        with SearchIndex.lock:
+            if SearchIndex.connection is not None:
+                SearchIndex.connection.close()
+                SearchIndex.connection = None
+
+
+    @staticmethod
+    def relative(path):
+        return os.path.relpath(path, PathsHelper.get_base_dir(True)).replace('\\', '/')
+
+
+    @staticmethod
+    def add(stored_path, data, content_hash=None):
+        """Index data as the contents of the backup at stored_path.
+
+        content_hash is a checksum of data when the caller already has one.
+        """
+        if not SearchIndex.enabled or b'\0' in data[:8192]:
+            # binary files are not searched
+            return
+        rel_path = SearchIndex.relative(stored_path)
+        parsed = PathsHelper.parse_backup_path(rel_path)
+        if parsed is None:
+            return
+        if content_hash is None:
+            content_hash = hashing.checksum(data, 'blake2b')
+
+        with SearchIndex.lock:
+            if SearchIndex.connection is None:
+                return
+            try:
+                connection = SearchIndex.connection
+                SearchIndex.delete_rows(connection, [rel_path])
+                row = connection.execute('SELECT id FROM contents WHERE hash = ?', (content_hash, )).fetchone()
+                if row is not None:
+                    content = row[0]
+                else:
+                    content = connection.execute('INSERT INTO contents (hash) VALUES (?)', (content_hash, )).lastrowid
+                    connection.executemany('INSERT INTO postings VALUES (?, ?, ?)',
+                                           [(token, content, line) for (token, line) in tokenize(decode(data)).items()])
+                connection.execute('INSERT INTO versions (path, source, day, time, content) VALUES (?, ?, ?, ?, ?)',
+                                   (rel_path, ) + tuple(parsed) + (content, ))
+                connection.commit()
+            except Exception as e:
+                print('AutoBackups: search index error, ' + str(e))
+
+
+    @staticmethod
+    def delete_rows(connection, rel_paths):
+        contents = set()
+        for rel_path in rel_paths:
+            row = connection.execute('SELECT content FROM versions WHERE path = ?', (rel_path, )).fetchone()
+            if row is not None:
+                contents.add(row[0])
+                connection.execute('DELETE FROM versions WHERE path = ?', (rel_path, ))
+        SearchIndex.delete_unused(connection, contents)
+
+
+    @staticmethod
+    def delete_unused(connection, contents):
+        # contents no version points at anymore
+        for content in contents:
+            if connection.execute('SELECT 1 FROM versions WHERE content = ? LIMIT 1', (content, )).fetchone() is None:
+                connection.execute('DELETE FROM postings WHERE content = ?', (content, ))
+                connection.execute('DELETE FROM contents WHERE id = ?', (content, ))
+
+
+    @staticmethod
+    def remove(stored_paths):
+        if not SearchIndex.enabled or not stored_paths:
+            return
+        with SearchIndex.lock:
+            if SearchIndex.connection is None:
+                return
+            try:
+                SearchIndex.delete_rows(SearchIndex.connection, [SearchIndex.relative(path) for path in stored_paths])
+                SearchIndex.connection.commit()
+            except Exception as e:
+                print('AutoBackups: search index error, ' + str(e))
+
+
+    @staticmethod
+    def remove_day(day):
+        if not SearchIndex.enabled:
+            return
+        with SearchIndex.lock:
+            if SearchIndex.connection is None:
+                return
+            try:
+                connection = SearchIndex.connection
+                contents = set(row[0] for row in connection.execute(
+                    'SELECT DISTINCT content FROM versions WHERE day = ?', (day, )))
+                connection.execute('DELETE FROM versions WHERE day = ?', (day, ))
+                SearchIndex.delete_unused(connection, contents)
+                connection.commit()
+            except Exception as e:
+                print('AutoBackups: search index error, ' + str(e))
+
+
+    @staticmethod
+    def search(query, limit=MAX_RESULTS):
+        """Return [(absolute path, source, day, time, line)] of the versions containing every word of query.
+
+        Words ending with * match as prefixes, of up to MAX_PREFIX_WORDS
+        words. Newest versions first, line is where the rarest word first
+        appears.
+        """
+        words = QUERY_PATTERN.findall(query.lower())
+        if not SearchIndex.enabled or not words:
+            return []
+
+        with SearchIndex.lock:
+            if SearchIndex.connection is None:
+                return []
+            connection = SearchIndex.connection
+
+            matches = []
+            for word in words:
+                if word.endswith('*'):
+                    # postings are ordered by token, a prefix is a range of them
+                    tokens = [row[0] for row in connection.execute(
+                        'SELECT DISTINCT token FROM postings WHERE token >= ? AND token < ? LIMIT ?',
+                        (word[:-1], word[:-1] + u'\uffff', MAX_PREFIX_WORDS))]
+                else:
+                    tokens = [word]
+
+                lines = {}
+                for token in tokens:
+                    for (content, line) in connection.execute('SELECT content, line FROM postings WHERE token = ?',
+                                                              (token, )):
+                        if line < lines.get(content, line + 1):
+                            lines[content] = line
+                matches.append(lines)
+
+            matches.sort(key=len)
+            found = matches[0]
+            for other in matches[1:]:
+                found = dict((content, line) for (content, line) in found.items() if content in other)
+                if not found:
+                    return []
+
+            results = []
+            contents = list(found.keys())
+            # stay below sqlite's limit of host parameters
+            for start in range(0, len(contents), 500):
+                chunk = contents[start:start + 500]
+                rows = connection.execute('SELECT content, path, source, day, time FROM versions WHERE content IN (%s)'
+                                          % ','.join('?' * len(chunk)), chunk).fetchall()
+                for (content, path, source, day, tm) in rows:
+                    results.append((day, tm, path, source, found[content]))
+
+        results.sort(reverse=True)
+        base_dir = PathsHelper.get_base_dir(True)
+        return [(os.path.normpath(os.path.join(base_dir, path)), source, day, tm, line)
+                for (day, tm, path, source, line) in results[:limit]]
+
+
+    @staticmethod
+    def count():
+        with SearchIndex.lock:
+            if SearchIndex.connection is None:
+                return 0
+            return SearchIndex.connection.execute('SELECT COUNT(*) FROM versions').fetchone()[0]
+
+
+    @staticmethod
+    def rebuild(paths, read):
+        """Index the backups at paths from scratch, return the number of versions indexed.
+
+        read(path) returns the contents of a backup.
+        """
+        if not SearchIndex.enabled:
+            return 0
+        with SearchIndex.lock:
+            if SearchIndex.connection is None:
+                return 0
+            SearchIndex.connection.execute('DELETE FROM postings')
+            SearchIndex.connection.execute('DELETE FROM versions')
+            SearchIndex.connection.execute('DELETE FROM contents')
+            SearchIndex.connection.commit()
+
+        for path in paths:
+            try:
+                SearchIndex.add(path, read(path))
+            except Exception as e:
+                print('AutoBackups: could not index ' + path + ', ' + str(e))
+        return SearchIndex.count()
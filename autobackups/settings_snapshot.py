@@ -0,0 +1,128 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import re
+import tempfile
+import itertools
+
+from .paths_helper import PathsHelper
+
+
+# ignore regex of the form \.(ext1|ext2|...)$ with plain alternatives,
+# optionally with single optional characters like bz2? or docx?
+EXTENSIONS_REGEX = re.compile(r'^\\\.\(((?:[A-Za-z0-9]\??)+(?:\|(?:[A-Za-z0-9]\??)+)*)\)\$$')
+
+
+def expand_alternative(alternative):
+    # 'docx?' -> ['doc', 'docx']
+    options = []
+    for match in re.finditer(r'([A-Za-z0-9])(\?)?', alternative):
+        if match.group(2):
+            options.append(('', match.group(1)))
+        else:
+            options.append((match.group(1), ))
+    return [''.join(combo) for combo in itertools.product(*options)]
+
+
+class ExclusionMatcher(object):
+    """Compiled form of the ignore_regexes setting.
+
+    Extension-only regexes become a set lookup on the part after the last
+    dot, everything else is joined into one alternation, so a path is
+    checked with at most one set lookup and one regex search.
+    """
+
+    def __init__(self, regexes):
+        self.extensions = set()
+        self.patterns = []
+        self.combined = None
+
+        if not regexes:
+            return
+
+        others = []
+        for regex in regexes:
+            match = EXTENSIONS_REGEX.match(regex)
+            if match is not None:
+                for alternative in match.group(1).split('|'):
+                    self.extensions.update(expand_alternative(alternative))
+            else:
+                others.append(regex)
+
+        if not others:
+            return
+        try:
+            self.combined = re.compile('|'.join('(?:%s)' % regex for regex in others))
+        except re.error:
+            # some pattern can't be embedded (inline flags...), check them one by one
+            self.patterns = [re.compile(regex) for regex in others]
+
+
+    def is_excluded(self, filename):
+        if self.extensions:
+            (head, dot, ext) = filename.rpartition('.')
+            if dot and ext in self.extensions:
+                return True
+
+        if self.combined is not None:
+            return self.combined.search(filename) is not None
+
+        for prog in self.patterns:
+            if prog.search(filename) is not None:
+                return True
+        return False
+
+
+
+class SettingsSnapshot(object):
+    """Read-through cache of the plugin settings.
+
+    A new snapshot replaces the old one whenever the settings change, so the
+    event handlers never hit the settings API more than once per key.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.values = {}
+        self.exclusions = ExclusionMatcher(settings.get('ignore_regexes'))
+
+        # backups and backups opened from temp files must not be backed up again
+        self.backup_prefixes = []
+        for path in (PathsHelper.get_base_dir(True), os.path.join(tempfile.gettempdir(), 'AutoBackups')):
+            self.backup_prefixes.append(self.normalise(path).rstrip('\\/') + os.sep)
+
+
+    def get(self, key, default=None):
+        try:
+            value = self.values[key]
+        except KeyError:
+            value = self.values[key] = self.settings.get(key)
+        if value is None:
+            return default
+        return value
+
+
+    def normalise(self, path):
+        path = PathsHelper.normalise_path(os.path.normpath(os.path.expanduser(path)))
+        if PathsHelper.platform == 'Windows':
+            path = path.lower()
+        return path
+
+
+    def is_excluded(self, filename):
+        return self.exclusions.is_excluded(filename)
+
+
+    def is_backup_file(self, path):
+        path = self.normalise(path)
+        for prefix in self.backup_prefixes:
+            if path.startswith(prefix):
+                return True
+        return False
@@ -0,0 +1,166 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import stat
+import time
+import threading
+
+try:
+    import queue
+except (ImportError):
+    # Python 2
+    import Queue as queue
+
+from . import hashing
+
+
+def walk_files(top, skip_dir=None):
+    """Yield (path, stat) of the regular files below top, not following symlinks.
+
+    Folders for which skip_dir(path) is true are not entered.
+    """
+    scandir = getattr(os, 'scandir', None)
+    stack = [top]
+    while stack:
+        folder = stack.pop()
+        try:
+            if scandir is not None:
+                for entry in scandir(folder):
+                    if entry.is_dir(follow_symlinks=False):
+                        if skip_dir is None or not skip_dir(entry.path):
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        try:
+                            yield (entry.path, entry.stat(follow_symlinks=False))
+                        except OSError:
+                            continue
+            else:
+                for name in os.listdir(folder):
+                    path = os.path.join(folder, name)
+                    try:
+                        st = os.lstat(path)
+                    except OSError:
+                        continue
+                    if stat.S_ISDIR(st.st_mode):
+                        if skip_dir is None or not skip_dir(path):
+                            stack.append(path)
+                    elif stat.S_ISREG(st.st_mode):
+                        yield (path, st)
+        except OSError:
+            continue
+
+
+
+class ProjectSnapshot(object):
+    """Backs up whole folders through a bounded pool of worker threads.
+
+    For every file the workers call unchanged(path, stat) first, files it
+    accepts are not even read. The others are hashed like a saved buffer
+    and handed to store(path, stat, hash), which returns whether a backup
+    was written. hashlib and file I/O release the GIL, so hashing and
+    copying run in parallel. progress(snapshot) is called about twice a
+    second.
+    """
+    progress_interval = 0.5
+
+    def __init__(self, unchanged, store, workers=4, algorithm='blake2b', progress=None):
+        self.unchanged = unchanged
+        self.store = store
+        self.workers = max(1, workers)
+        self.algorithm = algorithm
+        self.progress = progress
+        self.files = 0
+        self.hashed = 0
+        self.hashed_bytes = 0
+        self.written = 0
+        self.written_bytes = 0
+        self.errors = 0
+        self.started = time.time()
+        self.reported = 0
+        self.lock = threading.Lock()
+
+
+    def elapsed(self):
+        return time.time() - self.started
+
+
+    def throughput(self):
+        """(files per second, hashed bytes per second) so far."""
+        elapsed = max(self.elapsed(), 0.001)
+        return (self.files / elapsed, self.hashed_bytes / elapsed)
+
+
+    def summary(self):
+        (files_rate, bytes_rate) = self.throughput()
+        return '%d files, %d hashed (%.1f MB), %d backed up (%.1f MB), %d errors in %.1fs, %.0f files/s, %.1f MB/s' % (
+            self.files, self.hashed, self.hashed_bytes / 1048576.0, self.written, self.written_bytes / 1048576.0,
+            self.errors, self.elapsed(), files_rate, bytes_rate / 1048576.0)
+
+
+    def report(self, force=False):
+        now = time.time()
+        if self.progress is not None and (force or now - self.reported >= self.progress_interval):
+            self.reported = now
+            self.progress(self)
+
+
+    def snapshot_file(self, path, st):
+        try:
+            if self.unchanged(path, st):
+                return
+            current_hash = hashing.hash_file(path, self.algorithm, path)
+            with self.lock:
+                self.hashed += 1
+                self.hashed_bytes += st.st_size
+            if self.store(path, st, current_hash):
+                with self.lock:
+                    self.written += 1
+                    self.written_bytes += st.st_size
+        except (IOError, OSError) as e:
+            print('AutoBackups: could not back up ' + path + ', ' + str(e))
+            with self.lock:
+                self.errors += 1
+
+
+    def worker(self, jobs):
+        while True:
+            job = jobs.get()
+            try:
+                if job is None:
+                    return
+                self.snapshot_file(job[0], job[1])
+            finally:
+                jobs.task_done()
+
+
+    def run(self, files):
+        """Back up the (path, stat) pairs of files, return self."""
+        jobs = queue.Queue(self.workers * 64)
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.worker, args=(jobs, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for job in files:
+                jobs.put(job)
+                with self.lock:
+                    self.files += 1
+                self.report()
+        finally:
+            for thread in threads:
+                jobs.put(None)
+            for thread in threads:
+                thread.join()
+
+        self.report(True)
+        return self
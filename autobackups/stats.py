@@ -0,0 +1,185 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import json
+import time
+import threading
+
+
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        index = 0
+        while index < len(BUCKETS_MS) and ms > BUCKETS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile."""
+        if self.count == 0:
+            return 0.0
+        wanted = self.count * p / 100.0
+        seen = 0
+        for (index, count) in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                if index < len(BUCKETS_MS):
+                    return min(BUCKETS_MS[index], self.max)
+                return self.max
+        return self.max
+
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.mean(), 3),
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max, 3),
+        }
+
+
+
+class Timer(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+
+    def __exit__(self, *exc):
+        Stats.record(self.name, time.time() - self.started)
+        return False
+
+
+
+class Stats(object):
+    """Counters and latency histograms of the plugin's hot paths.
+
+    Kept in memory since the plugin was loaded. With stats_log enabled
+    every timing is also appended to <data_dir>/stats.jsonl.
+    """
+    counters = {}
+    timings = {}
+    started = time.time()
+    log_path = None
+    lock = threading.Lock()
+
+
+    @staticmethod
+    def initialize(data_dir, log=False):
+        Stats.log_path = os.path.join(data_dir, 'stats.jsonl') if log else None
+
+
+    @staticmethod
+    def reset():
+        with Stats.lock:
+            Stats.counters = {}
+            Stats.timings = {}
+            Stats.started = time.time()
+
+
+    @staticmethod
+    def incr(name, amount=1):
+        with Stats.lock:
+            Stats.counters[name] = Stats.counters.get(name, 0) + amount
+
+
+    @staticmethod
+    def timer(name):
+        """Context manager recording how long its block took under name."""
+        return Timer(name)
+
+
+    @staticmethod
+    def record(name, seconds):
+        ms = seconds * 1000
+        with Stats.lock:
+            histogram = Stats.timings.get(name)
+            if histogram is None:
+                histogram = Stats.timings[name] = Histogram()
+            histogram.add(ms)
+
+        if Stats.log_path is not None:
+            Stats.log({'op': name, 'ms': round(ms, 3)})
+
+
+    @staticmethod
+    def log(entry):
+        entry['time'] = round(time.time(), 3)
+        try:
+            data_dir = os.path.dirname(Stats.log_path)
+            if not os.path.isdir(data_dir):
+                os.makedirs(data_dir)
+            with Stats.lock:
+                with open(Stats.log_path, 'a') as f:
+                    f.write(json.dumps(entry, sort_keys=True) + '\n')
+        except (IOError, OSError, TypeError):
+            # the log is only a diagnostic aid, it must never break a backup
+            pass
+
+
+    @staticmethod
+    def snapshot():
+        with Stats.lock:
+            return {
+                'uptime_s': round(time.time() - Stats.started, 1),
+                'counters': dict(Stats.counters),
+                'timings': dict((name, histogram.as_dict()) for (name, histogram) in Stats.timings.items()),
+            }
+
+
+    @staticmethod
+    def report():
+        """Plain text report of the snapshot, for the stats panel."""
+        data = Stats.snapshot()
+        lines = ['AutoBackups statistics, collected over the last %.0f seconds.' % data['uptime_s'], '']
+
+        lines.append('Counters:')
+        if not data['counters']:
+            lines.append('  (none yet)')
+        for name in sorted(data['counters']):
+            lines.append('  %-32s %d' % (name, data['counters'][name]))
+
+        lines.append('')
+        lines.append('Timings (ms, percentiles are bucket upper bounds):')
+        if not data['timings']:
+            lines.append('  (none yet)')
+        else:
+            lines.append('  %-24s %8s %9s %9s %9s %9s %9s' % ('operation', 'count', 'mean', 'p50', 'p90', 'p99', 'max'))
+        for name in sorted(data['timings']):
+            t = data['timings'][name]
+            lines.append('  %-24s %8d %9.3f %9.3f %9.3f %9.3f %9.3f' % (name, t['count'], t['mean_ms'], t['p50_ms'],
+                                                                       t['p90_ms'], t['p99_ms'], t['max_ms']))
+        return '\n'.join(lines)
@@ -0,0 +1,389 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import os
+import shutil
+import datetime
+import tempfile
+from contextlib import closing
+
+from .object_store import ObjectStore
+from .pack_store import PackStore
+from .paths_helper import PathsHelper
+from . import compression
+from . import delta
+from . import copy_engine
+from .stats import Stats
+
+
+class BackupStorage(object):
+    """Writes and reads backup files according to the backup_storage setting.
+
+    "copy"  - every backup is a full copy of the source file
+    "dedup" - every backup is a hardlink to a blob in the shared object store
+    "delta" - per-time backups are deltas against the day's latest keyframe
+    "pack"  - the versions of a day are appended to one pack file, see PackStore
+
+    With backup_compression set, stored files get a .gz/.bz2/.xz suffix,
+    packed versions are compressed inside the pack and keep their plain path.
+    """
+    mode = 'copy'
+    keyframe_interval = 20
+    compression = False
+    compression_level = 6
+    chunk_size = 1024 * 1024
+
+    # source path -> [keyframe path, day, versions written since keyframe]
+    chains = {}
+
+
+    @staticmethod
+    def initialize(mode, data_dir, keyframe_interval=20, compression_method=False, compression_level=6):
+        if mode not in ('copy', 'dedup', 'delta', 'pack'):
+            mode = 'copy'
+        if mode == 'pack' and not PathsHelper.backup_per_day:
+            print('AutoBackups: "pack" storage needs backup_per_day, backups will be copied')
+            mode = 'copy'
+        BackupStorage.mode = mode
+        BackupStorage.keyframe_interval = max(1, int(keyframe_interval or 1))
+        BackupStorage.chains = {}
+
+        if compression_method and not compression.is_available(compression_method):
+            print('AutoBackups: compression "%s" is not available, backups will not be compressed' % compression_method)
+            compression_method = False
+        BackupStorage.compression = compression_method or False
+        BackupStorage.compression_level = min(9, max(1, int(compression_level or 6)))
+
+        ObjectStore.initialize(os.path.join(data_dir, 'objects'))
+
+
+    @staticmethod
+    def store(source, dest):
+        """Store a backup of source at dest, return the path actually written.
+
+        Raises the usual IOError/OSError family.
+        """
+        method = BackupStorage.compression
+        level = BackupStorage.compression_level
+
+        if BackupStorage.mode == 'pack':
+            with Stats.timer('store.write'):
+                with open(source, 'rb') as f:
+                    PackStore.append(dest, f.read(), method, level)
+            return dest
+
+        dest = dest + compression.suffix_for(method)
+
+        if BackupStorage.mode == 'dedup':
+            with Stats.timer('store.write'):
+                (blob, digest) = ObjectStore.put_file(source, method, level)
+                ObjectStore.link(blob, dest)
+            return dest
+
+        with Stats.timer('store.makedirs'):
+            BackupStorage.prepare_dest(dest)
+
+        with Stats.timer('store.write'):
+            try:
+                if BackupStorage.mode == 'delta' and PathsHelper.backup_per_day and PathsHelper.backup_per_time:
+                    BackupStorage.store_delta(source, dest)
+                elif method:
+                    with open(source, 'rb') as src:
+                        with closing(compression.open_write(dest, method, level)) as dst:
+                            shutil.copyfileobj(src, dst, BackupStorage.chunk_size)
+                else:
+                    Stats.incr('copy.' + copy_engine.copy_file(source, dest, BackupStorage.chunk_size))
+                # permission bits of the source, like shutil.copy did, whatever the storage mode
+                shutil.copymode(source, dest)
+            except Exception:
+                BackupStorage.remove_partial(dest)
+                raise
+        return dest
+
+
+    @staticmethod
+    def store_bytes(data, dest):
+        """Store data as a full backup at dest, return the path actually written."""
+        method = BackupStorage.compression
+        if BackupStorage.mode == 'pack' and PackStore.split(dest) is not None:
+            PackStore.append(dest, data, method, BackupStorage.compression_level)
+            return dest
+
+        dest = dest + compression.suffix_for(method)
+        BackupStorage.prepare_dest(dest)
+        try:
+            BackupStorage.write_bytes(dest, data)
+        except Exception:
+            BackupStorage.remove_partial(dest)
+            raise
+        return dest
+
+
+    @staticmethod
+    def remove_partial(dest):
+        # a copy cut short (disk full...) must not pass for a backup
+        try:
+            if os.path.lexists(dest):
+                os.remove(dest)
+                print('AutoBackups: removed incomplete backup ' + dest)
+        except OSError:
+            pass
+
+
+    @staticmethod
+    def prepare_dest(dest):
+        backup_dir = os.path.dirname(dest)
+        if not os.path.isdir(backup_dir):
+            try:
+                os.makedirs(backup_dir)
+            except OSError:
+                # created by another thread meanwhile
+                if not os.path.isdir(backup_dir):
+                    raise
+
+        # dest may be a hardlink left by "dedup" mode, don't write through it
+        if os.path.lexists(dest):
+            os.remove(dest)
+
+
+    @staticmethod
+    def write_bytes(dest, data):
+        with closing(compression.open_write(dest, BackupStorage.compression, BackupStorage.compression_level)) as f:
+            f.write(data)
+
+
+    @staticmethod
+    def store_delta(source, dest):
+        with open(source, 'rb') as f:
+            data = f.read()
+
+        today = str(datetime.date.today())
+        chain = BackupStorage.chains.get(source)
+
+        # keyframes never cross day folders, so deleting a day keeps the others readable
+        if (chain is not None and chain[1] == today and chain[2] < BackupStorage.keyframe_interval
+                and chain[0] != dest and os.path.isfile(chain[0])):
+            base_data = BackupStorage.read_stored(chain[0])
+            base_ref = os.path.relpath(chain[0], os.path.dirname(dest)).replace('\\', '/')
+            patch = delta.make_delta(base_ref, base_data, data)
+
+            # a delta bigger than half of the file is not worth it, start a new keyframe instead
+            if len(patch) < len(data) / 2:
+                BackupStorage.write_bytes(dest, patch)
+                chain[2] += 1
+                return
+
+        BackupStorage.write_bytes(dest, data)
+        BackupStorage.chains[source] = [dest, today, 0]
+
+
+    @staticmethod
+    def locate(path):
+        """Return the stored file for the backup path, with or without a compression suffix."""
+        if os.path.isfile(path):
+            return path
+        for suffix in compression.SUFFIXES:
+            if os.path.isfile(path + suffix):
+                return path + suffix
+        if PackStore.contains(path):
+            return path
+        return None
+
+
+    @staticmethod
+    def stored_size(path):
+        """Bytes the backup at path takes on disk, raises OSError when it doesn't exist."""
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        return PackStore.stored_size(path)
+
+
+    @staticmethod
+    def stat_key(path):
+        """Value that changes whenever the backup stored at path is rewritten."""
+        if os.path.isfile(path):
+            st = os.stat(path)
+            return (st.st_size, st.st_mtime)
+        found = PackStore.find(path)
+        if found is None:
+            raise OSError('AutoBackups: backup ' + path + ' does not exist')
+        return (found[2]['n'], found[2]['o'], found[2]['t'])
+
+
+    @staticmethod
+    def read_stored(path):
+        if not os.path.isfile(path) and PackStore.contains(path):
+            return PackStore.read(path)
+        with closing(compression.open_read(path)) as f:
+            return f.read()
+
+
+    @staticmethod
+    def is_delta_file(path):
+        try:
+            with closing(compression.open_read(path)) as f:
+                return delta.is_delta(f.read(len(delta.DELTA_MAGIC)))
+        except (IOError, OSError, EOFError):
+            return False
+
+
+    @staticmethod
+    def delta_base(path):
+        """Return the keyframe path a delta backup is based on, None for full backups."""
+        try:
+            with closing(compression.open_read(path)) as f:
+                head = f.read(len(delta.DELTA_MAGIC) + 4096)
+        except (IOError, OSError, EOFError):
+            return None
+        if not delta.is_delta(head):
+            return None
+        return os.path.normpath(os.path.join(os.path.dirname(path), delta.read_base_ref(head)))
+
+
+    @staticmethod
+    def delete(path, others=()):
+        """Delete a stored backup, return the number of bytes freed (at least 0).
+
+        Deltas among others that are based on path are rebased first: the
+        oldest becomes a full keyframe and the rest are re-encoded against
+        it, so they stay readable.
+        """
+        path = os.path.normpath(path)
+        if not os.path.lexists(path) and PackStore.contains(path):
+            return PackStore.remove(path)
+
+        dependents = []
+        for other in others:
+            if other != path and BackupStorage.delta_base(other) == path:
+                dependents.append(other)
+
+        grown = 0
+        if dependents:
+            dependents.sort()
+            grown -= sum(os.path.getsize(other) for other in dependents)
+            keyframe = dependents[0]
+            keyframe_data = BackupStorage.read(keyframe)
+            rebuilt = [(other, BackupStorage.read(other)) for other in dependents[1:]]
+
+            BackupStorage.replace_bytes(keyframe, keyframe_data)
+            for (other, data) in rebuilt:
+                base_ref = os.path.relpath(keyframe, os.path.dirname(other)).replace('\\', '/')
+                BackupStorage.replace_bytes(other, delta.make_delta(base_ref, keyframe_data, data))
+            grown += sum(os.path.getsize(other) for other in dependents)
+
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+
+        for (source, chain) in list(BackupStorage.chains.items()):
+            if chain[0] == path:
+                del BackupStorage.chains[source]
+        return max(0, size - grown)
+
+
+    @staticmethod
+    def replace_bytes(path, data):
+        # write next to path and rename over it, a crash never leaves a half written backup
+        tmp_path = path + '.tmp'
+        with closing(compression.open_write(tmp_path, compression.get_method(path), BackupStorage.compression_level)) as f:
+            f.write(data)
+        if os.path.lexists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+
+    @staticmethod
+    def read(path):
+        """Return the full contents of the backup stored at path."""
+        data = BackupStorage.read_stored(path)
+        if not delta.is_delta(data):
+            return data
+
+        base = os.path.join(os.path.dirname(path), delta.read_base_ref(data))
+        return delta.apply_delta(BackupStorage.read_stored(os.path.normpath(base)), data)
+
+
+    @staticmethod
+    def materialize_dir():
+        # backups that can't be opened in place are rebuilt below this folder
+        return os.path.join(tempfile.gettempdir(), 'AutoBackups')
+
+
+    @staticmethod
+    def materialize(path):
+        """Return a path that can be opened in the editor for the backup stored at path.
+
+        Plain backups are returned as is, compressed and delta ones are rebuilt
+        into a temp folder keeping their relative path, so syntax detection
+        still works.
+        """
+        packed = not os.path.isfile(path)
+        if not packed and not compression.get_suffix(path) and not BackupStorage.is_delta_file(path):
+            return path
+
+        base_dir = PathsHelper.get_base_dir(True)
+        rel = os.path.relpath(compression.strip_suffix(path), base_dir)
+        if rel.startswith('..'):
+            rel = os.path.basename(compression.strip_suffix(path))
+        target = os.path.join(BackupStorage.materialize_dir(), rel)
+
+        target_dir = os.path.dirname(target)
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        if os.path.lexists(target):
+            os.remove(target)
+
+        if packed or BackupStorage.is_delta_file(path):
+            with open(target, 'wb') as f:
+                f.write(BackupStorage.read(path))
+        else:
+            with closing(compression.open_read(path)) as src:
+                with open(target, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, BackupStorage.chunk_size)
+        return target
+
+
+    @staticmethod
+    def release(filename):
+        """Remove filename if materialize() rebuilt it, with the folders left empty."""
+        top = BackupStorage.materialize_dir()
+        try:
+            rel = os.path.relpath(filename, top)
+        except ValueError:
+            # another drive
+            return
+        if rel.startswith('..'):
+            return
+        try:
+            os.remove(filename)
+            folder = os.path.dirname(filename)
+            while folder != top and not os.listdir(folder):
+                os.rmdir(folder)
+                folder = os.path.dirname(folder)
+        except OSError:
+            pass
+
+
+    @staticmethod
+    def clear_materialized():
+        # backups rebuilt for views of an earlier session
+        shutil.rmtree(BackupStorage.materialize_dir(), True)
+
+
+    @staticmethod
+    def sweep():
+        return ObjectStore.sweep()
+
+
+    @staticmethod
+    def compact():
+        """Rewrite packs that are mostly deleted versions, return (packs, bytes reclaimed)."""
+        return PackStore.compact_all()
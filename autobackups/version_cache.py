@@ -0,0 +1,110 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import threading
+from collections import OrderedDict
+
+from .storage import BackupStorage
+
+
+def decode(data):
+    try:
+        text = data.decode('UTF-8')
+    except UnicodeDecodeError:
+        text = data.decode('latin-1')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+class VersionCache(object):
+    """Bounded LRU cache of decoded backup contents for the preview pane.
+
+    Entries are keyed by stored path and checked against BackupStorage.stat_key,
+    so rebased or deleted backups are read again. Works for plain, compressed,
+    delta and packed backups alike, BackupStorage.read does the decoding.
+    """
+    max_bytes = 16 * 1024 * 1024
+
+    # path -> (stat key, text)
+    entries = OrderedDict()
+    size = 0
+    lock = threading.Lock()
+
+    # paths waiting to be prefetched, newest request wins
+    wanted = []
+    prefetching = False
+
+
+    @staticmethod
+    def initialize(max_bytes):
+        with VersionCache.lock:
+            VersionCache.max_bytes = max(0, int(max_bytes or 0))
+            VersionCache.entries = OrderedDict()
+            VersionCache.size = 0
+            VersionCache.wanted = []
+
+
+    @staticmethod
+    def get(path):
+        """Decoded contents of the backup stored at path, raises IOError/OSError."""
+        key = BackupStorage.stat_key(path)
+        with VersionCache.lock:
+            entry = VersionCache.entries.get(path)
+            if entry is not None and entry[0] == key:
+                # most recently used last
+                del VersionCache.entries[path]
+                VersionCache.entries[path] = entry
+                return entry[1]
+
+        text = decode(BackupStorage.read(path))
+        VersionCache.put(path, key, text)
+        return text
+
+
+    @staticmethod
+    def put(path, key, text):
+        with VersionCache.lock:
+            old = VersionCache.entries.pop(path, None)
+            if old is not None:
+                VersionCache.size -= len(old[1])
+            if len(text) > VersionCache.max_bytes:
+                return
+            VersionCache.entries[path] = (key, text)
+            VersionCache.size += len(text)
+            while VersionCache.size > VersionCache.max_bytes:
+                (evicted, entry) = VersionCache.entries.popitem(last=False)
+                VersionCache.size -= len(entry[1])
+
+
+    @staticmethod
+    def prefetch(paths):
+        """Decode paths into the cache on a background thread."""
+        with VersionCache.lock:
+            VersionCache.wanted = [path for path in paths if path not in VersionCache.entries]
+            if not VersionCache.wanted or VersionCache.prefetching:
+                return
+            VersionCache.prefetching = True
+
+        thread = threading.Thread(target=VersionCache.prefetch_worker)
+        thread.daemon = True
+        thread.start()
+
+
+    @staticmethod
+    def prefetch_worker():
+        while True:
+            with VersionCache.lock:
+                if not VersionCache.wanted:
+                    VersionCache.prefetching = False
+                    return
+                path = VersionCache.wanted.pop(0)
+            try:
+                VersionCache.get(path)
+            except Exception:
+                # a broken backup shows its error when it's actually previewed
+                pass
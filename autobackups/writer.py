@@ -0,0 +1,112 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+import time
+import threading
+import traceback
+
+from .stats import Stats
+
+
+class BackupWriter(threading.Thread):
+    """Dedicated thread writing backups off Sublime's shared async thread.
+
+    Jobs are keyed (by source file and event). A job waits coalesce_window seconds
+    before it is written, a newer job with the same key replaces the pending
+    one, so a burst of saves results in one backup of the newest version.
+    At most max_pending keys are queued. When it's full, the job of a new
+    key is written right away in the calling thread instead of waiting for
+    room. Jobs are passed to handler, or to the handler given to submit().
+    """
+
+    def __init__(self, handler, coalesce_window=0.5, max_pending=256):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.handler = handler
+        self.coalesce_window = max(0.0, coalesce_window)
+        self.max_pending = max(1, max_pending)
+        self.pending = {}
+        self.order = []
+        self.condition = threading.Condition()
+        self.stopping = False
+
+
+    def submit(self, key, job, handler=None):
+        with self.condition:
+            if self.stopping:
+                return False
+            overflow = key not in self.pending and len(self.pending) >= self.max_pending
+            if not overflow:
+                deadline = time.time() + self.coalesce_window
+                if key not in self.pending:
+                    self.order.append(key)
+                self.pending[key] = (deadline, job, handler or self.handler)
+                self.condition.notify_all()
+                return True
+
+        # never wait for the writer, the caller may be Sublime's shared async thread
+        Stats.incr('writer.overflow')
+        self.write(job, handler or self.handler)
+        return True
+
+
+    def write(self, job, handler):
+        try:
+            handler(job)
+        except Exception:
+            print('AutoBackups: backup failed')
+            traceback.print_exc()
+
+
+    def take_due(self, force):
+        # called with the condition held, returns due jobs in submit order
+        now = time.time()
+        due = []
+        for key in list(self.order):
+            (deadline, job, handler) = self.pending[key]
+            if force or deadline <= now:
+                due.append((job, handler))
+                del self.pending[key]
+                self.order.remove(key)
+        if due:
+            self.condition.notify_all()
+        return due
+
+
+    def next_deadline(self):
+        if not self.order:
+            return None
+        return min(self.pending[key][0] for key in self.order)
+
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    jobs = self.take_due(self.stopping)
+                    if jobs or (self.stopping and not self.pending):
+                        break
+                    deadline = self.next_deadline()
+                    timeout = None if deadline is None else max(0.0, deadline - time.time())
+                    self.condition.wait(timeout)
+
+            for (job, handler) in jobs:
+                self.write(job, handler)
+
+            if not jobs and self.stopping:
+                return
+
+
+    def stop(self, timeout=5.0):
+        """Write everything still pending, then end the thread."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.is_alive():
+            self.join(timeout)
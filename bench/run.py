@@ -0,0 +1,344 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+"""Offline benchmarks for AutoBackups.
+
+Runs AutoBackups.py against the stub sublime/sublime_plugin modules in
+bench/stubs, on synthetic backup trees of files x days x versions in the
+"file" and "folder" per-time layouts, and prints the results as JSON:
+
+    python bench/run.py > bench_output.txt
+    python bench/run.py --files 200 --days 30 --versions 20 --layout folder
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import warnings
+import threading
+import importlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+sys.path.insert(0, os.path.join(BENCH_DIR, 'stubs'))
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        import imp
+except ImportError:
+    # removed in Python 3.12, the plugin only needs imp.reload
+    imp = types.ModuleType('imp')
+    imp.reload = importlib.reload
+    sys.modules['imp'] = imp
+
+import sublime
+
+
+def load_plugin():
+    # the package is imported as "AutoBackups", whatever the checkout folder is called
+    package = types.ModuleType('AutoBackups')
+    package.__path__ = [ROOT_DIR]
+    sys.modules['AutoBackups'] = package
+    return importlib.import_module('AutoBackups.AutoBackups')
+
+
+def settings_name():
+    name = sublime.platform().title()
+    if name == 'Osx':
+        name = 'OSX'
+    return 'AutoBackups (' + name + ').sublime-settings'
+
+
+def start_plugin(plugin, overrides):
+    settings = sublime.load_settings(settings_name())
+    settings.values.update(overrides)
+    plugin.plugin_loaded()
+    wait_for_threads()
+
+
+def stop_plugin(plugin):
+    plugin.plugin_unloaded()
+    plugin.Catalog.close()
+    wait_for_threads()
+
+
+def wait_for_threads():
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and not thread.daemon:
+            thread.join()
+
+
+def stats(samples):
+    """Summary of timings given in seconds, reported in milliseconds."""
+    if not samples:
+        return {'n': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'n': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered) * 1000,
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def source_path(src_dir, index):
+    return os.path.join(src_dir, 'dir%d' % (index % 10), 'file%d.txt' % index)
+
+
+def make_sources(src_dir, files, size):
+    line = 'lorem ipsum dolor sit amet, consectetur adipiscing elit\n'
+    text = line * max(1, size // len(line))
+    for index in range(files):
+        path = source_path(src_dir, index)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
+
+
+def generate_tree(plugin, backup_dir, src_dir, layout, files, days, versions, first_day):
+    """Write files x days x versions backups the way PathsHelper lays them out."""
+    PathsHelper = plugin.PathsHelper
+    written = 0
+    for day_index in range(days):
+        day = str(first_day - datetime.timedelta(days=day_index))
+        for index in range(files):
+            source = source_path(src_dir, index)
+            folder = PathsHelper.normalise_path(os.path.dirname(source))
+            (filepart, extpart) = os.path.splitext(os.path.basename(source))
+            for version in range(versions):
+                tm = '%02d%02d%02d' % (9 + version // 3600, (version // 60) % 60, version % 60)
+                if layout == 'folder':
+                    path = os.path.join(backup_dir, day, tm, folder, filepart + extpart)
+                else:
+                    path = os.path.join(backup_dir, day, folder, filepart + '_' + tm + extpart)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'w') as f:
+                    f.write('version %d of %s\n' % (version, source))
+                written += 1
+    return written
+
+
+class JobCollector(object):
+    # stands in for the writer thread, so the save event and the write are timed apart
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, key, job):
+        self.jobs.append(job)
+        return True
+
+    def stop(self, timeout=None):
+        pass
+
+
+def bench_save(plugin, args, work_dir, layout):
+    src_dir = os.path.join(work_dir, 'src-save')
+    backup_dir = os.path.join(work_dir, 'backups-save-' + layout)
+    text = make_sources(src_dir, args.files, args.file_size)
+    start_plugin(plugin, {'backup_dir': backup_dir, 'backup_per_day': True, 'backup_per_time': layout,
+                          'backup_coalesce_ms': 0, 'max_backup_file_size_bytes': max(262144, args.file_size * 2)})
+    listener = plugin.AutoBackupsEventListener()
+    listener.console = lambda text: None
+    real_writer = plugin.writer
+    collector = JobCollector()
+    plugin.writer = collector
+
+    event_times = []
+    write_times = []
+    for round_index in range(args.save_rounds):
+        for index in range(args.files):
+            path = source_path(src_dir, index)
+            view = sublime.View(path, text + 'round %d\n' % round_index)
+            with open(path, 'w') as f:
+                f.write(view.text)
+
+            started = time.time()
+            listener.save_backup(view, 0)
+            event_times.append(time.time() - started)
+
+        for job in collector.jobs:
+            started = time.time()
+            plugin.write_backup(job)
+            write_times.append(time.time() - started)
+        collector.jobs = []
+
+    plugin.writer = real_writer
+    stop_plugin(plugin)
+    return {'save_backup.event': stats(event_times), 'save_backup.write': stats(write_times)}
+
+
+def bench_listing(plugin, args, work_dir, layout, catalog):
+    src_dir = os.path.join(work_dir, 'src-list')
+    backup_dir = os.path.join(work_dir, 'backups-list-' + layout)
+    overrides = {'backup_dir': backup_dir, 'backup_per_day': True, 'backup_per_time': layout,
+                 'backup_catalog': catalog}
+
+    if not os.path.isdir(backup_dir):
+        start_plugin(plugin, dict(overrides, backup_catalog=False))
+        generate_tree(plugin, backup_dir, src_dir, layout, args.files, args.days, args.versions,
+                      datetime.date.today())
+        stop_plugin(plugin)
+
+    start_plugin(plugin, overrides)
+    days_times = []
+    versions_times = []
+    for index in range(min(args.files, args.list_samples)):
+        view = sublime.View(source_path(src_dir, index), window=sublime.active_window())
+        command = plugin.AutoBackupsOpenBackupCommand(view)
+
+        started = time.time()
+        command.getData(False)
+        days_times.append(time.time() - started)
+
+        started = time.time()
+        command.getData(0)
+        versions_times.append(time.time() - started)
+    stop_plugin(plugin)
+
+    name = 'getData.catalog' if catalog else 'getData.scan'
+    return {name + '.days': stats(days_times), name + '.versions': stats(versions_times)}
+
+
+def bench_excluded(plugin, args, work_dir):
+    start_plugin(plugin, {'backup_dir': os.path.join(work_dir, 'backups-excluded')})
+    listener = plugin.AutoBackupsEventListener()
+    paths = [
+        '/home/user/project/src/module/file.py',
+        '/home/user/project/.git/objects/ab/cdef',
+        '/home/user/project/assets/image.PNG',
+        '/home/user/project/docs/readme.md',
+        '/home/user/project/build/archive.tar.gz',
+        '/home/user/project/node_modules/package/index.js',
+    ]
+    batch = 1000
+    times = []
+    for i in range(args.excluded_batches):
+        started = time.time()
+        for j in range(batch // len(paths)):
+            for path in paths:
+                listener.is_excluded(path)
+        times.append((time.time() - started) / (batch // len(paths) * len(paths)))
+    stop_plugin(plugin)
+    return {'is_excluded': stats(times)}
+
+
+def bench_gc(plugin, args, work_dir, layout):
+    src_dir = os.path.join(work_dir, 'src-gc')
+    backup_dir = os.path.join(work_dir, 'backups-gc-' + layout)
+    overrides = {'backup_dir': backup_dir, 'backup_per_day': True, 'backup_per_time': layout,
+                 'delete_old_backups': 1}
+
+    start_plugin(plugin, overrides)
+    first_day = datetime.date.today() - datetime.timedelta(days=10)
+    written = generate_tree(plugin, backup_dir, src_dir, layout, args.files, args.days, args.versions, first_day)
+
+    thread = plugin.AutoBackupsGcBackup(1)
+    started = time.time()
+    thread.run()
+    elapsed = time.time() - started
+    stop_plugin(plugin)
+
+    return {'gc.' + layout: {
+        'files': written,
+        'removed': thread.engine.files,
+        'errors': thread.engine.errors,
+        'seconds': elapsed,
+        'files_per_second': written / elapsed if elapsed > 0 else 0,
+    }}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AutoBackups offline benchmarks')
+    parser.add_argument('--files', type=int, default=50, help='source files')
+    parser.add_argument('--days', type=int, default=10, help='day folders')
+    parser.add_argument('--versions', type=int, default=10, help='per-time versions per file and day')
+    parser.add_argument('--layout', choices=['file', 'folder', 'both'], default='both')
+    parser.add_argument('--file-size', type=int, default=16384, help='bytes per source file')
+    parser.add_argument('--save-rounds', type=int, default=5)
+    parser.add_argument('--list-samples', type=int, default=20)
+    parser.add_argument('--excluded-batches', type=int, default=200)
+    parser.add_argument('--only', action='append', choices=['save', 'listing', 'excluded', 'gc'],
+                        help='run only these benchmarks (repeatable)')
+    parser.add_argument('--work-dir', help='where to build the trees, a temp dir by default')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args()
+
+    layouts = ['file', 'folder'] if args.layout == 'both' else [args.layout]
+    only = set(args.only or ['save', 'listing', 'excluded', 'gc'])
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='autobackups-bench-')
+
+    # the plugin prints every backup it writes
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        plugin = load_plugin()
+        results = {}
+        if 'excluded' in only:
+            results.update(bench_excluded(plugin, args, work_dir))
+        for layout in layouts:
+            layout_results = {}
+            if 'save' in only:
+                layout_results.update(bench_save(plugin, args, work_dir, layout))
+            if 'listing' in only:
+                layout_results.update(bench_listing(plugin, args, work_dir, layout, False))
+                layout_results.update(bench_listing(plugin, args, work_dir, layout, True))
+            if 'gc' in only:
+                layout_results.update(bench_gc(plugin, args, work_dir, layout))
+            results[layout] = layout_results
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(os.path.join(ROOT_DIR, 'messages.json')) as f:
+        versions = sorted(key for key in json.load(f) if key != 'install')
+
+    report = {
+        'plugin_version': versions[-1] if versions else None,
+        'python': platform.python_version(),
+        'platform': sys.platform,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {
+            'files': args.files,
+            'days': args.days,
+            'versions': args.versions,
+            'file_size': args.file_size,
+            'layouts': layouts,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
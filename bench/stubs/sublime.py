@@ -0,0 +1,318 @@
+##
+# This file is part of the AutoBackups package.
+#
+# (c) Avtandil Kikabidze aka LONGMAN <akalongman@gmail.com>
+#
+# For the full copyright and license information, please view the LICENSE
+# file that was distributed with this source code.
+##
+
+# Minimal stand-in for Sublime Text's sublime module, enough to run the
+# plugin outside the editor for benchmarks. Timeouts are queued, not run,
+# call run_timeouts() to execute them.
+
+import os
+import re
+import json
+
+
+ENCODED_POSITION = 1
+TRANSIENT = 4
+FORCE_GROUP = 8
+MONOSPACE_FONT = 1
+HIDDEN = 128
+DRAW_NO_FILL = 32
+LAYOUT_INLINE = 1
+LAYOUT_BELOW = 2
+
+packages_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_settings = {}
+_timeouts = []
+_windows = []
+status = []
+
+
+def version():
+    return '3211'
+
+
+def platform():
+    return 'linux' if os.name != 'nt' else 'windows'
+
+
+def arch():
+    return 'x64'
+
+
+def packages_path():
+    return os.path.dirname(packages_dir)
+
+
+def strip_json_comments(text):
+    # drop // and /* */ comments outside of strings, then trailing commas
+    out = []
+    i = 0
+    in_string = False
+    while i < len(text):
+        c = text[i]
+        if in_string:
+            out.append(c)
+            if c == '\\':
+                out.append(text[i + 1])
+                i += 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+            out.append(c)
+        elif text.startswith('//', i):
+            while i < len(text) and text[i] != '\n':
+                i += 1
+            continue
+        elif text.startswith('/*', i):
+            i = text.index('*/', i) + 1
+        else:
+            out.append(c)
+        i += 1
+    return re.sub(r',(\s*[\]}])', r'\1', ''.join(out))
+
+
+class Settings(object):
+    def __init__(self, values=None):
+        self.values = values or {}
+        self.callbacks = {}
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+        for callback in list(self.callbacks.values()):
+            callback()
+
+    def has(self, key):
+        return key in self.values
+
+    def erase(self, key):
+        self.values.pop(key, None)
+
+    def add_on_change(self, key, callback):
+        self.callbacks[key] = callback
+
+    def clear_on_change(self, key):
+        self.callbacks.pop(key, None)
+
+
+def load_settings(name):
+    if name not in _settings:
+        path = os.path.join(packages_dir, name)
+        values = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                values = json.loads(strip_json_comments(f.read()))
+        _settings[name] = Settings(values)
+    return _settings[name]
+
+
+def save_settings(name):
+    pass
+
+
+class Region(object):
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return self.end() - self.begin()
+
+
+class Selection(list):
+    pass
+
+
+class View(object):
+    next_id = 1
+
+    def __init__(self, file_name=None, text='', window=None):
+        self._file_name = file_name
+        self.text = text
+        self._window = window
+        self._id = View.next_id
+        View.next_id += 1
+        self._settings = Settings()
+        self._name = ''
+        self.read_only = False
+        self.scratch = False
+        self.dirty = False
+        self.selection = Selection([Region(0)])
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._id
+
+    def file_name(self):
+        return self._file_name
+
+    def name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+
+    def size(self):
+        return len(self.text)
+
+    def substr(self, region):
+        if isinstance(region, int):
+            return self.text[region:region + 1]
+        return self.text[region.begin():region.end()]
+
+    def is_read_only(self):
+        return self.read_only
+
+    def set_read_only(self, value):
+        self.read_only = value
+
+    def is_scratch(self):
+        return self.scratch
+
+    def set_scratch(self, value):
+        self.scratch = value
+
+    def is_dirty(self):
+        return self.dirty
+
+    def is_loading(self):
+        return False
+
+    def line_endings(self):
+        return 'Unix'
+
+    def settings(self):
+        return self._settings
+
+    def window(self):
+        return self._window
+
+    def sel(self):
+        return self.selection
+
+    def rowcol(self, point):
+        before = self.text[:point]
+        row = before.count('\n')
+        return (row, point - (before.rfind('\n') + 1))
+
+    def text_point(self, row, col):
+        lines = self.text.split('\n')
+        return sum(len(line) + 1 for line in lines[:row]) + col
+
+    def run_command(self, cmd, args=None):
+        if cmd == 'append':
+            self.text += args.get('characters', '')
+
+    def show_at_center(self, point):
+        pass
+
+    def assign_syntax(self, syntax):
+        pass
+
+    def set_syntax_file(self, syntax):
+        pass
+
+    def close(self):
+        pass
+
+
+class Window(object):
+    def __init__(self, folders=None):
+        self._folders = folders or []
+        self.views = []
+        self.panels = []
+        self.opened = []
+
+    def id(self):
+        return 1
+
+    def folders(self):
+        return self._folders
+
+    def active_view(self):
+        return self.views[-1] if self.views else None
+
+    def new_file(self):
+        view = View(window=self)
+        self.views.append(view)
+        return view
+
+    def open_file(self, path, flags=0):
+        self.opened.append((path, flags))
+        view = View(path.split(':')[0] if flags & ENCODED_POSITION else path, window=self)
+        self.views.append(view)
+        return view
+
+    def focus_view(self, view):
+        pass
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1, on_highlight=None):
+        self.panels.append(items)
+
+    def create_output_panel(self, name):
+        return View(window=self)
+
+    def find_output_panel(self, name):
+        return None
+
+    def run_command(self, cmd, args=None):
+        pass
+
+    def status_message(self, message):
+        status.append(message)
+
+
+def active_window():
+    if not _windows:
+        _windows.append(Window())
+    return _windows[0]
+
+
+def windows():
+    return [active_window()]
+
+
+def set_timeout(callback, delay=0):
+    _timeouts.append(callback)
+
+
+def set_timeout_async(callback, delay=0):
+    _timeouts.append(callback)
+
+
+def run_timeouts():
+    while _timeouts:
+        _timeouts.pop(0)()
+
+
+def status_message(message):
+    status.append(message)
+
+
+def error_message(message):
+    status.append(message)
+
+
+def message_dialog(message):
+    status.append(message)
+
+
+def ok_cancel_dialog(message, ok_title=''):
+    return True